@@ -0,0 +1,397 @@
+"""
+benchmark suite for every tokenizer in miniBPE, subDNA and miniChar
+--> corpora are synthetic (seeded, same text on every run) or bundled with the repo
+    (README.md, subDNA/tokenizer.md), any extra file can be added with --corpus
+--> per tokenizer/corpus/size: training time (and per merge), encode/decode MB/s and
+    tokens/s, compression ratio, round-trip check, latency percentiles of short inputs,
+    peak traced memory of encode, model load time and the process' peak RSS
+--> timings (training and the latency passes too) are the fastest of --repeat runs after
+    a warmup run, their run-to-run spread and a calibration workload timed around every
+    measurement are kept next to them
+--> results are written as json, --compare flags metrics that got worse than a saved
+    baseline by more than --threshold and by more than the spread of both runs and the
+    change in calibration time, skips measurements under --min-seconds and exits with
+    status 1
+
+  python benchmark.py --out results.json
+  python benchmark.py --compare results.json
+"""
+
+import os
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+import statistics
+
+# the tokenizer modules chdir into their own directory on import, every path is made absolute first
+ROOT = os.path.dirname(os.path.realpath(__file__))
+_CWD = os.getcwd()
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from miniBPE import BasicTokenizer, RegexTokenizer, Tokenizer
+from miniBPE.trainer import train_merges
+from subDNA import DNAtokenizer, KMerTokenizer, KmerPairTokenizer, PerCharTokenizer as DNAPerCharTokenizer
+from miniChar import PerCharTokenizer
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+def _parse_size(size):
+  units = {'k': 1 << 10, 'm': 1 << 20}
+  size = size.strip().lower()
+  return int(size[:-1]) * units[size[-1]] if size[-1] in units else int(size)
+
+def _fit(text, size):
+  return (text * (size // max(len(text), 1) + 1))[:size]
+
+def synthetic_text(size, seed=0):
+  """
+    zipf-distributed pseudo words with punctuation, digits, newlines and some non-ascii,
+    identical for the same size and seed
+  """
+  rng = random.Random(seed)
+  letters = "etaoinshrdlcumwfgypbvkjxqz"
+  words = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 10))) for _ in range(2000)]
+  words += ["café", "naïve", "über", "日本語", "données", "🙂"]
+  weights = [1 / (rank + 1) for rank in range(len(words))]
+  parts, n = [], 0
+  while n < size:
+    for word in rng.choices(words, weights, k=1024):
+      r = rng.random()
+      piece = word + (". " if r < 0.06 else ",\n" if r < 0.08 else f" {rng.randint(0, 9999)} " if r < 0.1 else " ")
+      parts.append(piece)
+      n += len(piece)
+  return "".join(parts)[:size]
+
+def synthetic_dna(size, seed=0):
+  """
+    A/C/G/T in lines of 80 with repeated motifs so merges have something to find
+  """
+  rng = random.Random(seed)
+  motifs = ["".join(rng.choice("ACGT") for _ in range(rng.randint(3, 12))) for _ in range(64)]
+  parts, n = [], 0
+  while n < size:
+    piece = rng.choice(motifs) if rng.random() < 0.5 else "".join(rng.choice("ACGT") for _ in range(8))
+    parts.append(piece)
+    n += len(piece)
+  seq = "".join(parts)[:size]
+  return "\n".join(seq[i:i+80] for i in range(0, len(seq), 80))[:size]
+
+def bundled_text(size):
+  texts = []
+  for name in ("README.md", os.path.join("subDNA", "tokenizer.md")):
+    with open(os.path.join(ROOT, name), 'r', encoding='utf-8') as f:
+      texts.append(f.read())
+  return _fit("\n".join(texts), size)
+
+def file_corpus(path, size):
+  with open(path, 'r', encoding='utf-8') as f:
+    return _fit(f.read(size), size)
+
+# -- tokenizer adapters: make(), train(tok, text, n_merges), save(tok, prefix) -> path, load(path),
+#    encode_args for every encode() call
+
+def _train_index(tok, text, n_merges):
+  # index.Tokenizer has no train(), merges come from the shared trainer over its char ids
+  tok.chars = sorted(set(text))
+  tok.vocab_size = len(tok.chars)
+  tok.string_to_index = {ch: i for i, ch in enumerate(tok.chars)}
+  tok.index_to_string = {i: ch for i, ch in enumerate(tok.chars)}
+  tok.merges = train_merges([tok._encode(text)], n_merges, start_idx=len(tok.chars))
+  tok.vocab = tok._build_vocab(tok.merges)
+
+def _load_into(cls, method):
+  def load(path):
+    tok = cls()
+    getattr(tok, method)(path)
+    return tok
+  return load
+
+def _save_binary(tok, prefix):
+  path = prefix + '.bin'
+  tok.save_binary(path)
+  return path
+
+def _save_perchar(tok, prefix):
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    tok.save_model(prefix)
+  return prefix + '.model'
+
+TOKENIZERS = {
+  'miniBPE.BasicTokenizer': dict(kind='text', make=BasicTokenizer,
+    train=lambda tok, text, n: tok.train(text, 256 + n), save=_save_binary, load=_load_into(BasicTokenizer, 'load_model')),
+  'miniBPE.RegexTokenizer': dict(kind='text', make=RegexTokenizer,
+    train=lambda tok, text, n: tok.train(text, 256 + n), save=_save_binary, load=_load_into(RegexTokenizer, 'load_binary')),
+  'miniBPE.Tokenizer': dict(kind='text', make=Tokenizer, train=_train_index),
+  'miniChar.PerCharTokenizer': dict(kind='text', make=PerCharTokenizer, merges=False,
+    train=lambda tok, text, n: tok.train(text), save=_save_perchar, load=_load_into(PerCharTokenizer, 'load')),
+  'subDNA.DNAtokenizer': dict(kind='dna', make=DNAtokenizer,
+    train=lambda tok, text, n: tok.train(text, tok.vocab_size + n - 1), save=_save_binary, load=_load_into(DNAtokenizer, 'load_model')),
+  # short inputs cut at any offset hold k-mers the vocab never saw, skip them instead of
+  # stopping there so every input is encoded in full
+  'subDNA.KMerTokenizer': dict(kind='dna', make=KMerTokenizer, merges=False, encode_args={'unknown': 'skip'},
+    train=lambda tok, text, n: tok.build_vocab([text]), save=_save_binary, load=_load_into(KMerTokenizer, 'load_model')),
+  # its training recounts every pair per merge (quadratic), only run on small inputs, and
+  # like KMerTokenizer, unseen k-mers are skipped so every input is encoded in full
+  'subDNA.KmerPairTokenizer': dict(kind='dna', make=KmerPairTokenizer, max_size=16 << 10, encode_args={'unknown': 'skip'},
+    train=lambda tok, text, n: tok.train_tokenizer(text, n), save=_save_binary, load=_load_into(KmerPairTokenizer, 'load_binary')),
+  'subDNA.PerCharTokenizer': dict(kind='dna', make=DNAPerCharTokenizer, merges=False, train=None),
+}
+
+def _best_time(fn, repeat, warmup=1):
+  """
+    (fastest of repeat timed calls after warmup untimed ones, result of the last call,
+    relative spread (median - fastest) / fastest), other load on the machine only ever
+    makes a run slower, so the fastest one is the least noisy
+  """
+  result = None
+  for _ in range(warmup):
+    result = fn()
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    times.append(time.perf_counter() - start)
+  best = min(times)
+  return best, result, (statistics.median(times) - best) / best if best else 0.0
+
+_CALIBRATION_WORDS = ["".join(random.Random(i).choice("etaoinshrd") for _ in range(1 + i % 7)) for i in range(20000)]
+_CALIBRATION_INTS = np.random.default_rng(0).integers(0, 1 << 30, 1 << 17)
+
+def _calibration_work():
+  counts = {}
+  for word in _CALIBRATION_WORDS:
+    counts[word] = counts.get(word, 0) + 1
+  sorted(counts.items(), key=lambda item: item[1])
+  np.sort(_CALIBRATION_INTS)
+
+def _calibrate(repeat=3):
+  """
+    seconds of a fixed python + numpy workload, compare() doesn't flag changes of a measurement
+    that are within how much faster or slower the machine ran this workload around it
+  """
+  return _best_time(_calibration_work, repeat)[0]
+
+def _calibrated(fn):
+  """
+    (fn(), calibration seconds around it, relative change of the calibration during it)
+  """
+  before = _calibrate()
+  result = fn()
+  after = _calibrate()
+  return result, (before + after) / 2, abs(after - before) / min(after, before)
+
+def _percentiles(samples, points=(50, 90, 99)):
+  samples = sorted(samples)
+  return {p: samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] for p in points}
+
+def _max_rss_mb():
+  if resource is None:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+def run_case(name, spec, text, n_merges, repeat, n_short=200, short_len=64, seed=0):
+  """
+    every metric of one tokenizer on one corpus
+  """
+  result, timings = {}, {}
+  def measure(measurement, fn, warmup=1):
+    (seconds, value, spread), calibration, drift = _calibrated(lambda: _best_time(fn, repeat, warmup))
+    timings[measurement] = {'seconds': seconds, 'spread': spread + drift, 'calibration': calibration}
+    return seconds, value
+
+  encode_args = spec.get('encode_args', {})
+  tok = spec['make']()
+  if spec.get('train') is not None:
+    # a small warmup run, then every timed run trains a fresh tokenizer, the last one is kept
+    spec['train'](spec['make'](), text[:1024], min(n_merges, 8))
+    def train():
+      trained = spec['make']()
+      spec['train'](trained, text, n_merges)
+      return trained
+    train_s, tok = measure('train', train, warmup=0)
+    result['train_s'] = train_s
+    if spec.get('merges', True) and len(getattr(tok, 'merges', {})):
+      result['train_ms_per_merge'] = 1e3 * train_s / len(tok.merges)
+
+  n_bytes = len(text.encode('utf-8'))
+  encode_s, ids = measure('encode', lambda: tok.encode(text, **encode_args))
+  decode_s, decoded = measure('decode', lambda: tok.decode(ids))
+  result.update({
+    'n_tokens': len(ids),
+    'compression': n_bytes / max(len(ids), 1),
+    'encode_mbps': n_bytes / encode_s / 1e6,
+    'encode_tokens_per_s': len(ids) / encode_s,
+    'decode_mbps': n_bytes / decode_s / 1e6,
+    'decode_tokens_per_s': len(ids) / decode_s,
+    'roundtrip': decoded == text,
+  })
+
+  # every pass times all the snippets, each percentile is the best over the passes
+  rng = random.Random(seed)
+  starts = [rng.randrange(max(len(text) - short_len, 1)) for _ in range(n_short)]
+  snippets = [text[start:start + short_len] for start in starts]
+  def latency_pass():
+    latencies = []
+    for snippet in snippets:
+      t0 = time.perf_counter_ns()
+      tok.encode(snippet, **encode_args)
+      latencies.append((time.perf_counter_ns() - t0) / 1e3)
+    return _percentiles(latencies)
+  def latency_passes():
+    passes, pass_times = [], []
+    latency_pass()
+    for _ in range(repeat):
+      start = time.perf_counter()
+      passes.append(latency_pass())
+      pass_times.append(time.perf_counter() - start)
+    return passes, pass_times
+  (passes, pass_times), calibration, drift = _calibrated(latency_passes)
+  for p in passes[0]:
+    values = [percentiles[p] for percentiles in passes]
+    best = min(values)
+    result[f'latency_us_p{p}'] = best
+    timings[f'latency_p{p}'] = {'seconds': min(pass_times), 'spread': (statistics.median(values) - best) / best + drift if best else drift,
+                                'calibration': calibration}
+
+  tracemalloc.start()
+  tok.encode(text, **encode_args)
+  result['encode_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+  tracemalloc.stop()
+
+  if spec.get('save') is not None:
+    with tempfile.TemporaryDirectory() as tmp:
+      path = spec['save'](tok, os.path.join(tmp, 'model'))
+      result['load_s'], _ = measure('load', lambda: spec['load'](path))
+  result['max_rss_mb'] = _max_rss_mb()
+  result['timings'] = timings
+  return result
+
+def run(args):
+  sizes = [_parse_size(size) for size in args.sizes.split(',')]
+  names = [name for name in TOKENIZERS if not args.only or any(part in name for part in args.only.split(','))]
+  corpora = {'text': [('synthetic', lambda size: synthetic_text(size, args.seed)), ('bundled', bundled_text)],
+             'dna': [('synthetic_dna', lambda size: synthetic_dna(size, args.seed))]}
+  for path in args.corpus or []:
+    corpora['text'].append((os.path.basename(path), lambda size, path=os.path.join(_CWD, path): file_corpus(path, size)))
+  for path in args.dna or []:
+    corpora['dna'].append((os.path.basename(path), lambda size, path=os.path.join(_CWD, path): file_corpus(path, size)))
+
+  results = {}
+  for name in names:
+    spec = TOKENIZERS[name]
+    for corpus, make_text in corpora[spec['kind']]:
+      for size in sizes:
+        key = f"{name}/{corpus}/{size}"
+        if size > spec.get('max_size', size):
+          print(f"{key}: skipped (max size {spec['max_size']})")
+          continue
+        results[key] = run_case(name, spec, make_text(size), args.merges, args.repeat, seed=args.seed)
+        print(f"{key}: " + ", ".join(f"{k}={_fmt(v)}" for k, v in results[key].items() if k != 'timings'))
+  return {
+    'meta': {
+      'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args),
+    },
+    'results': results,
+  }
+
+def _fmt(value):
+  return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+# metrics where bigger is better, every other timing/memory metric is better when smaller
+_HIGHER = ('_mbps', '_per_s', 'compression')
+_IGNORED = ('n_tokens', 'max_rss_mb', 'timings')
+# the measurement (run_case()'s timings) every timed metric is derived from
+_TIMED = {'train_s': 'train', 'train_ms_per_merge': 'train', 'encode_mbps': 'encode', 'encode_tokens_per_s': 'encode',
+          'decode_mbps': 'decode', 'decode_tokens_per_s': 'decode', 'load_s': 'load'}
+
+def _measurement(metric):
+  if metric.startswith('latency_us_'):
+    return metric.replace('latency_us_', 'latency_')
+  return _TIMED.get(metric)
+
+def compare(baseline, current, threshold, min_seconds=0.005):
+  """
+    returns [(case, metric, baseline value, current value, relative change)] of the regressions
+      - a timed metric is only flagged when it got worse by more than threshold and by more than
+        the run-to-run spread of both runs together plus how much faster or slower the machine
+        ran the calibration workload around the measurement
+      - measurements that took under min_seconds in both runs are too short to compare
+  """
+  regressions = []
+  for key, metrics in current['results'].items():
+    base = baseline['results'].get(key)
+    if base is None:
+      continue
+    timings, old_timings = metrics['timings'], base['timings']
+    for metric, value in metrics.items():
+      old = base.get(metric)
+      if metric in _IGNORED or old is None or value is None:
+        continue
+      if isinstance(value, bool):
+        if old and not value:
+          regressions.append((key, metric, old, value, None))
+        continue
+      if old == 0:
+        continue
+      limit = threshold
+      timing = timings.get(_measurement(metric))
+      if timing is not None:
+        old_timing = old_timings[_measurement(metric)]
+        if max(timing['seconds'], old_timing['seconds']) < min_seconds:
+          continue
+        # how much faster or slower the machine ran the calibration around the two measurements
+        speed = timing['calibration'] / old_timing['calibration']
+        limit = max(threshold, timing['spread'] + old_timing['spread'] + max(speed, 1 / speed) - 1)
+      elif metric.endswith('_s') and max(old, value) < min_seconds:
+        continue
+      change = (value - old) / abs(old)
+      worse = -change if metric.endswith(_HIGHER) else change
+      if worse > limit:
+        regressions.append((key, metric, old, value, change))
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', default='16k,256k', help="corpus sizes in characters, eg. 16k,256k,1m")
+  parser.add_argument('--merges', type=int, default=256, help="no of merges for the bpe tokenizers")
+  parser.add_argument('--repeat', type=int, default=5, help="runs per timing, the fastest is kept")
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--only', help="comma separated substrings of tokenizer names to run")
+  parser.add_argument('--corpus', action='append', help="extra text file to benchmark on (eg. captions.txt)")
+  parser.add_argument('--dna', action='append', help="extra dna file to benchmark on")
+  parser.add_argument('--out', help="write the results to this json file")
+  parser.add_argument('--compare', help="baseline json to compare against")
+  parser.add_argument('--threshold', type=float, default=0.1, help="relative change counted as a regression")
+  parser.add_argument('--min-seconds', type=float, default=0.005, help="measurements shorter than this aren't compared")
+  args = parser.parse_args(argv)
+
+  current = run(args)
+  if args.out:
+    with open(os.path.join(_CWD, args.out), 'w') as f:
+      json.dump(current, f, indent=2)
+  if args.compare:
+    with open(os.path.join(_CWD, args.compare)) as f:
+      baseline = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_seconds)
+    for key, metric, old, value, change in regressions:
+      print(f"REGRESSION {key} {metric}: {_fmt(old)} -> {_fmt(value)}" + (f" ({change:+.1%})" if change is not None else ""))
+    print(f"{len(regressions)} regression(s) against {args.compare}")
+    return 1 if regressions else 0
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
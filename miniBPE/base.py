@@ -7,11 +7,15 @@
 
 import regex as re
 import unicodedata
+from .encoder import merge_ids
+from .decoder import ByteDecoder
+from .idarray import as_ids
 
 merges = {}
 vocab = {idx: bytes([idx]) for idx in range(256)}
 pattern = ""
 special_tokens = {}
+_decoder, _decoder_key = None, None
 
 def get_stats(ids, counts=None):
   """
@@ -86,23 +90,26 @@ def render_token(t: bytes) -> str:
   s = replace_control_characters(s)
   return s
 
+def _get_decoder():
+  # vocab grows in place while training, the byte table is rebuilt when it changed
+  global _decoder, _decoder_key
+  key = (id(vocab), len(vocab))
+  if _decoder_key != key:
+    _decoder, _decoder_key = ByteDecoder(vocab), key
+  return _decoder
+
 def decode(ids):
-  text_bytes = b"".join(vocab[idx] for idx in ids)
-  text = text_bytes.decode("utf-8", errors="replace")
-  return text
+  return _get_decoder().decode(ids)
 
-def encode(text):
-  text_bytes = text.encode("utf-8")
-  ids = list(text_bytes)
-  while len(ids) >= 2:
-    stats = get_stats(ids)
-    pair = min(stats, key=lambda p: merges.get(p, float('inf')))
-    if pair not in merges:
-      break
+def decode_into(ids, out, offset=0):
+  return _get_decoder().decode_into(ids, out, offset)
 
-    idx = merges[pair]
-    ids = merge(ids, pair, idx)
-  return ids
+def decode_batch(batch):
+  return _get_decoder().decode_batch(batch)
+
+def encode(text, out='list', dtype=None):
+  text_bytes = text.encode("utf-8")
+  return as_ids(merge_ids(text_bytes, merges), out, len(vocab), dtype)
 
 def train(text, vocab_size, verbose=False):
   """
@@ -1,13 +1,35 @@
 import json
-from tqdm import tqdm
 from collections import Counter
+from .trainer import PairIndex
+from .sketch import train_approx_merges, sample_report
+from .encoder import merge_ids
+from .batch import BatchMixin
+from .binary import save_binary_model, load_binary_model, merge_items
+from .decoder import ByteDecoder, StreamDecoder
+from .idarray import new_ids, finish_ids
+from .instrument import NULL
+
+class BasicTokenizer(BatchMixin):
+  # timers/counters/progress bars, see instrument.py
+  instrument = NULL
 
-class BasicTokenizer:
   def __init__(self):
     self.vocab_size = 0
     self.vocab = {}
     self.merges = {}
 
+  @property
+  def merges(self):
+    # load_binary() leaves the merges in the file until they're first needed
+    if self._merges is None:
+      self._merges = self._watched(merge_items(self._merge_rows))
+      self._merge_rows = None
+    return self._merges
+
+  @merges.setter
+  def merges(self, merges):
+    self._merges, self._merge_rows = self._watched(merges), None
+
   def _get_stats(self, ids): 
     """
     Takes a list of integers and returns a dictionary of counts of pairs(consecutive ones).
@@ -38,13 +60,19 @@ class BasicTokenizer:
     text_bytes = train_data.encode('utf-8')
     ids = list(text_bytes)
 
-    stats = self._get_stats(ids)
-    merges = {}
-    for i in tqdm(range(n_merges), desc='Training the tokenizer\t'):
-      pair = max(stats, key=stats.get)
-      idx = 256 + i
-      stats = self._update_stats(stats, ids, pair, idx)
-      merges[pair] = idx
+    inst = self.instrument
+    with inst.timer('train'):
+      index = PairIndex([ids])
+      merges = {}
+      for i in inst.progress(range(n_merges), total=n_merges, desc='Training the tokenizer\t'):
+        top = index.most_common()
+        if top is None:
+          break
+        pair, _ = top
+        idx = 256 + i
+        index.merge(pair, idx)
+        merges[pair] = idx
+    inst.count('merges_learned', len(merges))
     
     vocab = self._build_vocab(merges)
     self.vocab = vocab
@@ -53,42 +81,93 @@ class BasicTokenizer:
 
     return self.vocab, self.merges
 
-  def _update_stats(self, stats, ids, pair, idx):
+  def train_approx(self, corpus, target_vocab, sample=None, **sketch_args):
     """
-    Updates the statistics after each merge.
+    Approximate training with bounded memory, pair counts are kept in a count-min sketch.
+    'corpus' is a list of strings or a callable returning a fresh iterable of strings,
+    it is streamed once per pass (64 or more, see sketch.py). 'sketch_args' go to sketch.train_approx_merges().
+    If 'sample' (a string) is given, approximate and exact training are compared on it
+    and the result is kept in self.approx_report.
     """
-    new_stats = stats.copy()
-    new_stats.pop(pair)
-    for i in range(len(ids) - 1):
-      if (ids[i], ids[i+1]) == pair:
-        new_pair = (idx, ids[i+2] if i+2 < len(ids) else ids[i+1])
-        new_stats[new_pair] = new_stats.get(new_pair, 0) + 1
-    return new_stats
+    assert target_vocab >= 256
+    n_merges = target_vocab - 256
+    texts = corpus if callable(corpus) else (lambda: corpus)
+    chunks = lambda: (list(text.encode('utf-8')) for text in texts())
+    with self.instrument.timer('train'):
+      merges = train_approx_merges(chunks, n_merges, **sketch_args)
+    if sample is not None:
+      self.approx_report = sample_report([list(sample.encode('utf-8'))], n_merges, **sketch_args)
+
+    self.vocab = self._build_vocab(merges)
+    self.merges = merges
+    self.vocab_size = len(self.vocab)
 
-  def encode(self, text):
+    return self.vocab, self.merges
+
+  def encode(self, text, out='list', dtype=None):
     """
     Encodes the input string using 'utf-8' encodings.
+    'out' is 'list', 'array' (array.array) or 'numpy', the element type is the smallest
+    one that fits the vocab unless 'dtype' is given, see idarray.py.
     """
     text_bytes = text.encode('utf-8')
-    ids = list(text_bytes)
-    stats = self._get_stats(ids)
-    while len(ids) >= 2:
-      pair = min(stats, key=lambda p: self.merges.get(p, float('inf')))
-      if pair not in self.merges:
-        break
-
-      idx = self.merges[pair]
-      stats = self._update_stats(stats, ids, pair, idx)
-      ids = [idx if (ids[i] == pair[0] and ids[i+1] == pair[1]) else ids[i] for i in range(len(ids)-1)]
-    return ids
+    inst = self.instrument
+    with inst.timer('merge'):
+      merged = merge_ids(text_bytes, self.merges)
+    if inst.enabled:
+      inst.count('bytes_in', len(text_bytes))
+      inst.count('tokens_out', len(merged))
+      inst.count('merges_applied', len(text_bytes) - len(merged))
+    if out == 'list':
+      return merged
+    ids = new_ids(out, len(self.vocab), dtype)
+    ids.extend(merged)
+    return finish_ids(ids, out)
+
+  def _get_decoder(self):
+    """
+    Flat byte table of the vocab (see decoder.py), rebuilt when the model changed (see batch.py).
+    """
+    if getattr(self, '_decoder_key', None) != self._generation:
+      self._decoder = ByteDecoder(self.vocab)
+      self._decoder_key = self._generation
+    return self._decoder
 
   def decode(self, ids):
     """
-    Decodes the input list of integers into string.
+    Decodes the input ids (list, array or numpy array) into string.
+    """
+    inst = self.instrument
+    if not inst.enabled:
+      return self._get_decoder().decode(ids)
+    with inst.timer('decode'):
+      text_bytes = self._get_decoder().decode_bytes(ids)
+    inst.count('tokens_in', len(ids))
+    inst.count('bytes_out', len(text_bytes))
+    return text_bytes.decode('utf-8', errors='replace')
+
+  def decode_into(self, ids, out, offset=0):
+    """
+    Writes the decoded bytes into 'out' (bytearray/memoryview) at 'offset', returns the no of bytes written.
     """
-    text_bytes = b"".join(self.vocab[idx] for idx in ids)
-    text = text_bytes.decode('utf-8', errors='replace')
-    return text
+    with self.instrument.timer('decode'):
+      return self._get_decoder().decode_into(ids, out, offset)
+
+  def decode_batch(self, batch, num_workers=1, **kwargs):
+    """
+    Decodes many id sequences in-process with one vectorized gather,
+    num_workers > 1 (or stream=True) uses the process pool of BatchMixin.
+    """
+    if num_workers == 1 and not kwargs:
+      with self.instrument.timer('decode'):
+        return self._get_decoder().decode_batch(batch)
+    return super().decode_batch(batch, num_workers=num_workers, **kwargs)
+
+  def stream_decoder(self, errors='replace'):
+    """
+    Stateful decoder for streamed generation, step() returns only the newly completed text.
+    """
+    return StreamDecoder(self._get_decoder(), errors)
 
   def save_model(self, prefix):
     """
@@ -111,10 +190,28 @@ class BasicTokenizer:
       json.dump(serializable_vocab)
     f.close()
 
+  def save_binary(self, path):
+    """
+    Saves merges and vocab to one binary '.bin' file, see binary.py.
+    """
+    save_binary_model(path, self.merges, self.vocab, meta={'tokenizer': 'basic'})
+
+  def load_binary(self, path):
+    """
+    Loads a '.bin' file with mmap, merges are read from it on first use, vocab entries on lookup.
+    """
+    model = load_binary_model(path)
+    assert model.meta.get('tokenizer') == 'basic', f"{path} was not saved by BasicTokenizer"
+    self._merges, self._merge_rows = None, model.merge_rows
+    self.vocab = model.vocab
+    self.vocab_size = len(self.vocab)
+
   def load_model(self, model_file):
     """
-    Loads the model from '.model' file.
+    Loads the model from '.model' file (or a '.bin' file, see load_binary()).
     """
+    if model_file.endswith('.bin'):
+      return self.load_binary(model_file)
     assert model_file.endswith('.model')
 
     merges = {}
@@ -0,0 +1,129 @@
+"""
+  batch encoding/decoding on a persistent process pool
+  --> the tokenizer is pickled once per worker when the pool starts (pool initializer),
+      tasks only carry the texts or ids
+  --> the pool is kept on the tokenizer until close() (or the end of a with block) and restarted
+      if the model changed since it started:
+      setting a public attribute or editing a model dict in place (dicts are kept as
+      WatchedDicts, see cache.py) bumps the tokenizer's generation
+"""
+
+import os
+import multiprocessing as mp
+from .cache import WatchedDict
+
+_worker_tokenizer = None
+# not sent to the workers, so changing it doesn't restart the pool
+_UNPICKLED = ('instrument',)
+
+def _init_worker(tokenizer):
+  global _worker_tokenizer
+  _worker_tokenizer = tokenizer
+
+def _encode_task(task):
+  i, text, kwargs = task
+  return i, _worker_tokenizer.encode(text, **kwargs)
+
+def _decode_task(task):
+  i, ids, kwargs = task
+  return i, _worker_tokenizer.decode(ids, **kwargs)
+
+class BatchMixin:
+  """
+    adds encode_batch()/decode_batch() to any tokenizer with encode()/decode()
+  """
+  _generation = 0
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state.pop('_pool', None)
+    state.pop('_pool_key', None)
+    # worker processes can't report back into the parent's metrics
+    for name in _UNPICKLED:
+      state.pop(name, None)
+    return state
+
+  def __setattr__(self, name, value):
+    """
+      public dicts are stored as WatchedDicts, properties wrap their own
+    """
+    if name.startswith('_'):
+      return super().__setattr__(name, value)
+    if isinstance(value, dict) and not isinstance(getattr(type(self), name, None), property):
+      value = self._watched(value)
+    super().__setattr__(name, value)
+    if name not in _UNPICKLED:
+      self._model_changed()
+
+  def _watched(self, value, on_change=None):
+    """
+      value as a WatchedDict calling on_change (default _model_changed), not copied if it already is one
+    """
+    on_change = self._model_changed if on_change is None else on_change
+    if isinstance(value, WatchedDict) and value._on_change == on_change:
+      return value
+    return WatchedDict(value, on_change)
+
+  def _model_changed(self):
+    """
+      bumps the generation that the pool (and cached tables like the byte decoder) are keyed on
+    """
+    self._generation += 1
+
+  def _get_pool(self, num_workers):
+    key = (num_workers, self._generation)
+    pool = getattr(self, '_pool', None)
+    if pool is not None and self._pool_key == key:
+      return pool
+    self.close_pool()
+    self._pool = mp.Pool(num_workers, initializer=_init_worker, initargs=(self,))
+    self._pool_key = key
+    return self._pool
+
+  def close_pool(self):
+    pool = getattr(self, '_pool', None)
+    if pool is not None:
+      pool.terminate()
+      pool.join()
+    self._pool = None
+    self._pool_key = None
+
+  def close(self):
+    """
+      stops the worker processes, the next batch starts a new pool
+      with tokenizer: ... closes it on the way out
+    """
+    self.close_pool()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def _run_batch(self, task_fn, fn, items, num_workers, chunksize, stream, kwargs):
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers <= 1:
+      results = ((i, fn(item, **kwargs)) for i, item in enumerate(items))
+    else:
+      tasks = ((i, item, kwargs) for i, item in enumerate(items))
+      pool = self._get_pool(num_workers)
+      results = (pool.imap_unordered if stream else pool.imap)(task_fn, tasks, chunksize)
+    if stream:
+      return results
+    return [out for _, out in results]
+
+  def encode_batch(self, texts, num_workers=None, chunksize=16, stream=False, **kwargs):
+    """
+      encodes every text in a process pool (num_workers defaults to all cores, 1 runs in-process)
+      - returns the list of ids in input order
+      - stream=True returns a generator of (index, ids) in the order they finish
+      - kwargs go to encode()
+    """
+    return self._run_batch(_encode_task, self.encode, texts, num_workers, chunksize, stream, kwargs)
+
+  def decode_batch(self, batch, num_workers=None, chunksize=16, stream=False, **kwargs):
+    """
+      decodes every list of ids in a process pool, same options as encode_batch()
+    """
+    return self._run_batch(_decode_task, self.decode, batch, num_workers, chunksize, stream, kwargs)
@@ -0,0 +1,172 @@
+"""
+  versioned binary model format, loaded with mmap
+  --> layout (little endian, every section starts 8-byte aligned):
+        header   : magic b"TOKBIN\x00\x00", version, no of special tokens, no of merges,
+                   no of vocab entries, meta length (u32 each), 4 pad bytes
+        meta     : json (tokenizer kind, pattern, chars, ...)
+        merges   : int32 rows of [p0, p1, idx], in merge order
+        specials : int32 ids, uint64 offsets (n + 1), utf-8 bytes
+        vocab    : int32 ids (sorted), uint64 offsets (n + 1), token bytes
+  --> loading only maps the file and parses the header, merges are turned into a dict
+      on first use and vocab entries are sliced out of the byte table on lookup
+"""
+
+import json
+import mmap
+import struct
+import numpy as np
+from collections.abc import Mapping
+
+MAGIC = b"TOKBIN\x00\x00"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIIIII")
+
+def _pad(n):
+  return (8 - n % 8) % 8
+
+def _table(items):
+  """
+    list of (id, bytes) -> (ids, offsets, blob)
+  """
+  ids = np.array([idx for idx, _ in items], dtype=np.int32)
+  lengths = np.array([len(token) for _, token in items], dtype=np.uint64)
+  offsets = np.zeros(len(items) + 1, dtype=np.uint64)
+  np.cumsum(lengths, out=offsets[1:])
+  return ids, offsets, b"".join(token for _, token in items)
+
+def save_binary_model(path, merges, vocab, special_tokens=None, meta=None):
+  """
+    - merges: {(p0, p1): idx}
+    - vocab: {idx: bytes or str}, str tokens are stored as utf-8 and come back as str
+    - special_tokens: {str: idx}
+    - meta: json-serializable dict of whatever else the tokenizer needs
+  """
+  special_tokens = special_tokens or {}
+  meta = dict(meta or {})
+  meta['vocab_type'] = 'str' if any(isinstance(token, str) for token in vocab.values()) else 'bytes'
+  meta_bytes = json.dumps(meta).encode('utf-8')
+
+  merge_rows = np.array([[p0, p1, idx] for (p0, p1), idx in merges.items()], dtype=np.int32).reshape(-1, 3)
+  # both tables are looked up by id (BinaryVocab._position), so they are written sorted by id
+  specials = _table(sorted((idx, special.encode('utf-8')) for special, idx in special_tokens.items()))
+  vocab_items = [(idx, token.encode('utf-8') if isinstance(token, str) else token) for idx, token in sorted(vocab.items())]
+  vocab_table = _table(vocab_items)
+
+  with open(path, 'wb') as f:
+    def write(data):
+      f.write(data)
+      f.write(b"\x00" * _pad(len(data)))
+    f.write(_HEADER.pack(MAGIC, VERSION, len(special_tokens), len(merge_rows), len(vocab_items), len(meta_bytes), 0))
+    write(meta_bytes)
+    write(merge_rows.tobytes())
+    for ids, offsets, blob in (specials, vocab_table):
+      write(ids.tobytes())
+      write(offsets.tobytes())
+      write(blob)
+
+class BinaryVocab(Mapping):
+  """
+    read-only {idx: token} view on the vocab byte table
+  """
+  def __init__(self, ids, offsets, blob, as_str):
+    self.ids = ids
+    self.offsets = offsets
+    self.blob = blob
+    self.as_str = as_str
+    assert len(ids) < 2 or bool(np.all(ids[1:] > ids[:-1])), "vocab ids in the binary model are not sorted"
+    # ids written by a tokenizer are usually 0..n-1 or start..start+n-1, then lookup is a subtraction
+    self._dense = len(ids) > 0 and int(ids[-1]) - int(ids[0]) == len(ids) - 1
+
+  def _position(self, idx):
+    if self._dense:
+      pos = idx - int(self.ids[0])
+      return pos if 0 <= pos < len(self.ids) else -1
+    pos = int(np.searchsorted(self.ids, idx))
+    return pos if pos < len(self.ids) and self.ids[pos] == idx else -1
+
+  def __getitem__(self, idx):
+    pos = self._position(idx) if isinstance(idx, (int, np.integer)) else -1
+    if pos < 0:
+      raise KeyError(idx)
+    token = bytes(self.blob[int(self.offsets[pos]):int(self.offsets[pos + 1])])
+    return token.decode('utf-8') if self.as_str else token
+
+  def __contains__(self, idx):
+    return isinstance(idx, (int, np.integer)) and self._position(idx) >= 0
+
+  def __iter__(self):
+    return iter(self.ids.tolist())
+
+  def tokens(self):
+    """
+      every token in id order, sliced from one copy of the byte table
+    """
+    blob = bytes(self.blob)
+    offsets = self.offsets.tolist()
+    tokens = [blob[start:end] for start, end in zip(offsets, offsets[1:])]
+    return [token.decode('utf-8') for token in tokens] if self.as_str else tokens
+
+  def __len__(self):
+    return len(self.ids)
+
+  def to_dict(self):
+    """
+      {idx: token} of the whole table, for decoding many ids without slicing the file per token
+    """
+    return dict(zip(self.ids.tolist(), self.tokens()))
+
+class BinaryModel:
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf = self._mm
+    magic, version, n_special, n_merges, n_vocab, meta_len, _ = _HEADER.unpack_from(buf, 0)
+    assert magic == MAGIC, f"{path} is not a binary model file"
+    assert version == VERSION, f"unsupported binary model version {version}"
+
+    offset = _HEADER.size
+    def take(dtype, count):
+      nonlocal offset
+      arr = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+      offset += arr.nbytes + _pad(arr.nbytes)
+      return arr
+
+    self.meta = json.loads(bytes(take(np.uint8, meta_len)))
+    self.merge_rows = take(np.int32, 3 * n_merges).reshape(-1, 3)
+    tables = []
+    for n in (n_special, n_vocab):
+      ids = take(np.int32, n)
+      offsets = take(np.uint64, n + 1)
+      blob = take(np.uint8, int(offsets[-1]))
+      tables.append((ids, offsets, blob))
+    self.vocab = BinaryVocab(*tables[1], as_str=self.meta['vocab_type'] == 'str')
+    special_vocab = BinaryVocab(*tables[0], as_str=True)
+    self.special_tokens = {special_vocab[idx]: idx for idx in special_vocab}
+    self._merges = None
+
+  @property
+  def merges(self):
+    if self._merges is None:
+      self._merges = dict(merge_items(self.merge_rows))
+    return self._merges
+
+def merge_items(rows):
+  """
+    ((p0, p1), idx) of every [p0, p1, idx] row, in merge order
+  """
+  return (((p0, p1), idx) for p0, p1, idx in rows.tolist())
+
+def load_binary_model(path):
+  return BinaryModel(path)
+
+def convert_model(model_file, out_file=None):
+  """
+    converts a BasicTokenizer '.model' file (eg. models/sample.model) into the binary format
+    returns the path of the written file
+  """
+  from .basic import BasicTokenizer
+  out_file = model_file[:-len('.model')] + '.bin' if out_file is None else out_file
+  tokenizer = BasicTokenizer()
+  tokenizer.load_model(model_file)
+  tokenizer.save_binary(out_file)
+  return out_file
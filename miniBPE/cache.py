@@ -0,0 +1,126 @@
+"""
+  bounded LRU cache from regex chunks to their token ids
+  --> safe to share between threads, every operation holds one lock
+  --> clear() bumps a generation counter, so a put() computed with merges from before
+      the clear is dropped instead of storing stale ids
+"""
+
+import threading
+from collections import OrderedDict
+
+class ChunkCache:
+  def __init__(self, maxsize=65536):
+    """
+      maxsize: max no of chunks kept, 0 disables the cache
+    """
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.generation = 0
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    # the lock can't be pickled, a copied tokenizer starts with an empty cache
+    return {'maxsize': self.maxsize}
+
+  def __setstate__(self, state):
+    self.__init__(state['maxsize'])
+
+  def get(self, chunk):
+    """
+      returns the cached ids (a tuple) or None
+    """
+    with self._lock:
+      ids = self._data.get(chunk)
+      if ids is None:
+        self.misses += 1
+        return None
+      self._data.move_to_end(chunk)
+      self.hits += 1
+      return ids
+
+  def put(self, chunk, ids, generation):
+    if self.maxsize <= 0:
+      return
+    with self._lock:
+      if generation != self.generation:
+        return
+      self._data[chunk] = tuple(ids)
+      self._data.move_to_end(chunk)
+      if len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+      self.generation += 1
+
+  def resize(self, maxsize):
+    with self._lock:
+      self.maxsize = maxsize
+      while len(self._data) > max(maxsize, 0):
+        self._data.popitem(last=False)
+
+  def stats(self):
+    with self._lock:
+      total = self.hits + self.misses
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': self.hits / total if total else 0.0,
+        'size': len(self._data),
+        'maxsize': self.maxsize,
+      }
+
+class WatchedDict(dict):
+  """
+    dict that calls on_change() after every write, for model dicts (merges, special_tokens)
+    that cached encodings depend on, so in-place edits can't leave stale ids behind
+  """
+  __slots__ = ('_on_change',)
+
+  def __init__(self, data, on_change):
+    super().__init__(data)
+    self._on_change = on_change
+
+  def __reduce__(self):
+    # pickle would otherwise fill in the items before _on_change is restored
+    return (WatchedDict, (dict(self), self._on_change))
+
+  def __setitem__(self, key, value):
+    super().__setitem__(key, value)
+    self._on_change()
+
+  def __delitem__(self, key):
+    super().__delitem__(key)
+    self._on_change()
+
+  def __ior__(self, other):
+    super().__ior__(other)
+    self._on_change()
+    return self
+
+  def update(self, *args, **kwargs):
+    super().update(*args, **kwargs)
+    self._on_change()
+
+  def setdefault(self, key, default=None):
+    if key in self:
+      return self[key]
+    self[key] = default
+    return default
+
+  def pop(self, key, *default):
+    value = super().pop(key, *default)
+    self._on_change()
+    return value
+
+  def popitem(self):
+    item = super().popitem()
+    self._on_change()
+    return item
+
+  def clear(self):
+    super().clear()
+    self._on_change()
@@ -0,0 +1,137 @@
+"""
+  decode engine on one flat byte table
+  --> every token's bytes sit in one contiguous blob, ordered by id, with start/length
+      arrays indexed by token id
+  --> ids can be a list, an array.array or a numpy array, long inputs are gathered from
+      the blob with one numpy take instead of a join over dict lookups
+  --> decode_into() writes straight into a caller's bytearray/memoryview
+  --> StreamDecoder decodes token by token for streamed generation, incomplete utf-8
+      sequences are held back until the next token completes them
+"""
+
+import codecs
+import numpy as np
+
+# below this many ids a plain join over the token list is faster than numpy
+_SMALL = 64
+
+class ByteDecoder:
+  def __init__(self, vocab, special_tokens=None):
+    """
+      - vocab: {idx: bytes}
+      - special_tokens: {idx: str}, only used for ids that aren't in vocab
+    """
+    tokens = dict(vocab)
+    for idx, special in (special_tokens or {}).items():
+      tokens.setdefault(idx, special.encode('utf-8'))
+    ordered = sorted(tokens.items())
+    size = ordered[-1][0] + 1 if ordered else 0
+
+    ids = np.array([idx for idx, _ in ordered], dtype=np.int64)
+    self.lengths = np.zeros(size, dtype=np.int64)
+    self.lengths[ids] = [len(token) for _, token in ordered]
+    self.valid = np.zeros(size, dtype=bool)
+    self.valid[ids] = True
+    self.starts = np.zeros(size, dtype=np.int64)
+    self.starts[1:] = np.cumsum(self.lengths)[:-1]
+    self.blob = b"".join(token for _, token in ordered)
+    self._blob = np.frombuffer(self.blob, dtype=np.uint8)
+    self._tokens = [None] * size
+    for idx, token in ordered:
+      self._tokens[idx] = token
+
+  def _invalid(self, ids):
+    bad = next(idx for idx in np.asarray(ids).tolist() if not (0 <= idx < len(self.valid) and self.valid[idx]))
+    return ValueError(f"invalid token id: {bad}")
+
+  def _check(self, ids):
+    ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+    if len(ids) and (ids.min() < 0 or ids.max() >= len(self.valid) or not self.valid[ids].all()):
+      raise self._invalid(ids)
+    return ids
+
+  def _gather_index(self, ids):
+    """
+      positions in the blob of every output byte
+    """
+    lengths = self.lengths[ids]
+    ends = np.cumsum(lengths)
+    return np.repeat(self.starts[ids] - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+  def decode_bytes(self, ids):
+    if isinstance(ids, list) and len(ids) < _SMALL:
+      try:
+        parts = [self._tokens[idx] for idx in ids]
+        if not ids or min(ids) >= 0:
+          return b"".join(parts)
+      except (IndexError, TypeError):
+        pass
+      raise self._invalid(ids)
+    ids = self._check(ids)
+    return self._blob[self._gather_index(ids)].tobytes()
+
+  def decode(self, ids, errors='replace'):
+    return self.decode_bytes(ids).decode('utf-8', errors=errors)
+
+  def decode_into(self, ids, out, offset=0):
+    """
+      writes the bytes of ids into out (bytearray, writable memoryview or uint8 array) at offset
+      returns the no of bytes written
+    """
+    ids = self._check(ids)
+    index = self._gather_index(ids)
+    view = np.frombuffer(out, dtype=np.uint8)
+    if offset + len(index) > len(view):
+      raise ValueError(f"output buffer too small: need {offset + len(index)} bytes, got {len(view)}")
+    np.take(self._blob, index, out=view[offset:offset + len(index)])
+    return len(index)
+
+  def decode_batch(self, batch, errors='replace'):
+    """
+      decodes many id sequences with one gather over all of them
+    """
+    arrays = [np.asarray(ids, dtype=np.int64).reshape(-1) for ids in batch]
+    if not arrays:
+      return []
+    flat = self._check(np.concatenate(arrays))
+    data = self._blob[self._gather_index(flat)].tobytes()
+    byte_ends = np.concatenate([[0], np.cumsum(self.lengths[flat])])
+    seq_ends = np.concatenate([[0], np.cumsum([len(ids) for ids in arrays])])
+    bounds = byte_ends[seq_ends].tolist()
+    return [data[start:end].decode('utf-8', errors=errors) for start, end in zip(bounds, bounds[1:])]
+
+class StreamDecoder:
+  def __init__(self, decoder, errors='replace'):
+    """
+      - decoder: a ByteDecoder (or a tokenizer, its current byte table is used)
+      - errors: utf-8 error handling for bytes that can never become valid
+    """
+    if not isinstance(decoder, ByteDecoder):
+      decoder = decoder._get_decoder()
+    self.decoder = decoder
+    self.errors = errors
+    self._utf8 = codecs.getincrementaldecoder('utf-8')(errors=errors)
+
+  def step(self, ids):
+    """
+      feeds one id (or a few) and returns only the newly completed text
+    """
+    tokens = self.decoder._tokens
+    if isinstance(ids, (int, np.integer)):
+      ids = (ids,)
+    try:
+      parts = [tokens[idx] if idx >= 0 else None for idx in ids]
+      return self._utf8.decode(b"".join(parts))
+    except (IndexError, TypeError):
+      raise self.decoder._invalid(ids) from None
+
+  def flush(self):
+    """
+      ends the stream, a still incomplete utf-8 sequence comes out as replacement chars
+    """
+    text = self._utf8.decode(b"", final=True)
+    self._utf8.reset()
+    return text
+
+  def reset(self):
+    self._utf8.reset()
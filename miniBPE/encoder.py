@@ -0,0 +1,54 @@
+"""
+  merge engine for encoding
+  --> symbols live in a linked list (flat prev/next arrays), every adjacent pair that has
+      a merge sits in a min-heap keyed by (merge rank, position)
+  --> entries are never removed from the heap, stale ones are skipped when popped
+  --> O(n log n) per chunk, same output as the get_stats()/min()/merge() loop: merges are
+      applied lowest rank first, left to right within a rank
+"""
+
+import heapq
+
+def merge_ids(ids, merges):
+  """
+    encodes a list of integers with merges {pair: idx}, the idx of a merge is its rank
+    eg: ids=[1, 2, 3, 1, 2], merges={(1, 2): 4, (4, 3): 5} -> [5, 4]
+  """
+  ids = list(ids)
+  n = len(ids)
+  if n < 2 or not merges:
+    return ids
+
+  get = merges.get
+  nxt = list(range(1, n + 1))
+  nxt[-1] = -1
+  prv = list(range(-1, n - 1))
+  heap = []
+  for i in range(n - 1):
+    rank = get((ids[i], ids[i+1]))
+    if rank is not None:
+      heap.append((rank, i))
+  heapq.heapify(heap)
+
+  while heap:
+    rank, pos = heapq.heappop(heap)
+    right = nxt[pos]
+    # dead symbols are marked -1, and a pair that changed no longer maps to this rank
+    if right == -1 or get((ids[pos], ids[right])) != rank:
+      continue
+    ids[pos] = rank
+    ids[right] = -1
+    after = nxt[right]
+    nxt[pos] = after
+    if after != -1:
+      prv[after] = pos
+      new_rank = get((rank, ids[after]))
+      if new_rank is not None:
+        heapq.heappush(heap, (new_rank, pos))
+    left = prv[pos]
+    if left != -1:
+      new_rank = get((ids[left], rank))
+      if new_rank is not None:
+        heapq.heappush(heap, (new_rank, left))
+
+  return [idx for idx in ids if idx != -1]
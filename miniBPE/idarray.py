@@ -0,0 +1,55 @@
+"""
+  compact containers for token ids
+  --> encode(..., out='array') fills an array.array, out='numpy' returns a numpy array (a
+      zero-copy view on the filled array.array), the default out='list' keeps python lists
+  --> the element type is the smallest unsigned type that holds every id of the tokenizer,
+      uint16 for up to 65536 ids and uint32 above, dtype= overrides it
+  --> an int in a list costs ~36 bytes (8 byte pointer + 28 byte object), a uint16 costs 2
+"""
+
+from array import array
+import numpy as np
+
+OUTPUTS = ('list', 'array', 'numpy')
+
+def id_dtype(n_ids, dtype=None):
+  """
+    smallest unsigned dtype for ids 0..n_ids-1, unless dtype is given
+  """
+  dtype = np.dtype(np.uint16 if n_ids <= 1 << 16 else np.uint32) if dtype is None else np.dtype(dtype)
+  assert dtype.kind in 'iu', f"token ids need an integer dtype, got {dtype}"
+  return dtype
+
+def new_ids(out, n_ids, dtype=None):
+  """
+    empty container that encode() extends chunk by chunk: a list or an array.array
+  """
+  assert out in OUTPUTS, f"out = {out} not understood, expected one of {OUTPUTS}"
+  if out == 'list':
+    return []
+  return array(id_dtype(n_ids, dtype).char)
+
+def finish_ids(ids, out):
+  """
+    turns a container from new_ids() into the requested output
+  """
+  if out == 'numpy':
+    return np.frombuffer(ids, dtype=ids.typecode) if len(ids) else np.empty(0, dtype=ids.typecode)
+  return ids
+
+def as_ids(ids, out, n_ids, dtype=None):
+  """
+    converts finished ids (a list or a numpy array) into the requested output
+  """
+  assert out in OUTPUTS, f"out = {out} not understood, expected one of {OUTPUTS}"
+  if out == 'list':
+    return ids.tolist() if isinstance(ids, np.ndarray) else ids
+  dtype = id_dtype(n_ids, dtype)
+  ids = np.asarray(ids, dtype=dtype)
+  return ids if out == 'numpy' else array(dtype.char, ids.tobytes())
+
+def as_list(ids):
+  """
+    ids from any of the outputs as a list of python ints, for the dict based decoders
+  """
+  return ids.tolist() if isinstance(ids, (np.ndarray, array)) else ids
@@ -3,13 +3,19 @@
   still in progress
 """
 
-from tqdm import tqdm
 import json
 import os
+from .encoder import merge_ids
+from .batch import BatchMixin
+from .idarray import as_ids, as_list
+from .instrument import NULL
 current_dir = os.path.dirname(os.path.realpath(__file__))
 os.chdir(current_dir)
 
-class Tokenizer:
+class Tokenizer(BatchMixin):
+  # timers/counters/progress bars, see instrument.py
+  instrument = NULL
+
   def __init__(self):
     super().__init__()
     self.chars = []
@@ -54,19 +60,24 @@ class Tokenizer:
         i += 1
     return new_ids
 
-  def encode(self, en_text):
-    tokens = list(self._encode(en_text))
-    while True:
-      stats = self._get_stats(tokens)
-      pair = min(stats, key=lambda p: self.merges.get(p, float('inf')))
-      if pair not in self.merges:
-        break
-      idx = self.merges[pair]
-      tokens = self._merge(tokens, pair, idx)
-    return tokens
+  def encode(self, en_text, out='list', dtype=None):
+    """
+      out: 'list', 'array' or 'numpy', see idarray.py
+    """
+    inst = self.instrument
+    with inst.timer('pretokenize'):
+      tokens = self._encode(en_text)
+    with inst.timer('merge'):
+      ids = merge_ids(tokens, self.merges)
+    if inst.enabled:
+      inst.count('chars_in', len(tokens))
+      inst.count('tokens_out', len(ids))
+      inst.count('merges_applied', len(tokens) - len(ids))
+    return as_ids(ids, out, len(self.vocab), dtype)
   
   def decode(self, de_text):
-    tokens = [self.vocab[idx] for idx in de_text]
+    with self.instrument.timer('decode'):
+      tokens = [self.vocab[idx] for idx in as_list(de_text)]
     text = ''.join(tokens)
     return text
   
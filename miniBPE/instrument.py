@@ -0,0 +1,202 @@
+"""
+  instrumentation for the tokenizers: per-phase timers, counters and pluggable sinks
+  --> every tokenizer has an `instrument` attribute, by default the shared no-op NULL, so
+      a disabled tokenizer pays one attribute check per call
+  --> tokenizer.instrument = Metrics(LoggingSink(), PrometheusSink('tok.prom')) turns it on,
+      phases are 'pretokenize', 'merge', 'special_split', 'decode', 'train', counters are
+      'chunks', 'merges_applied', 'cache_hits', 'cache_misses', 'bytes_in', 'bytes_out', ...
+  --> progress bars are a sink too: Metrics(ProgressSink()) shows tqdm bars while training
+"""
+
+import os
+import time
+import logging
+import threading
+
+class _NullTimer:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_NULL_TIMER = _NullTimer()
+
+class Instrument:
+  """
+    no-op instrument, the default of every tokenizer
+  """
+  enabled = False
+
+  def timer(self, phase):
+    return _NULL_TIMER
+
+  def count(self, name, n=1):
+    pass
+
+  def progress(self, iterable, total=None, desc=None):
+    return iterable
+
+NULL = Instrument()
+
+class _Timer:
+  __slots__ = ('metrics', 'phase', 'start')
+
+  def __init__(self, metrics, phase):
+    self.metrics = metrics
+    self.phase = phase
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.metrics.record(self.phase, time.perf_counter() - self.start)
+    return False
+
+class Metrics(Instrument):
+  enabled = True
+
+  def __init__(self, *sinks, flush_every=None):
+    """
+      - sinks: where timings, counters and progress go
+      - flush_every: seconds between automatic flush() calls, None to only flush by hand
+    """
+    self.sinks = list(sinks)
+    self.flush_every = flush_every
+    self.timings = {}
+    self.counters = {}
+    self._lock = threading.Lock()
+    self._last_flush = time.monotonic()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['_lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+  def timer(self, phase):
+    return _Timer(self, phase)
+
+  def record(self, phase, seconds):
+    with self._lock:
+      calls, total = self.timings.get(phase, (0, 0.0))
+      self.timings[phase] = (calls + 1, total + seconds)
+    for sink in self.sinks:
+      sink.on_timing(phase, seconds)
+    self._maybe_flush()
+
+  def count(self, name, n=1):
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+    for sink in self.sinks:
+      sink.on_count(name, n)
+
+  def progress(self, iterable, total=None, desc=None):
+    for sink in self.sinks:
+      iterable = sink.progress(iterable, total, desc)
+    return iterable
+
+  def snapshot(self):
+    """
+      {'timings': {phase: {'calls', 'seconds'}}, 'counters': {name: value}}
+    """
+    with self._lock:
+      return {
+        'timings': {phase: {'calls': calls, 'seconds': total} for phase, (calls, total) in self.timings.items()},
+        'counters': dict(self.counters),
+      }
+
+  def flush(self):
+    snapshot = self.snapshot()
+    for sink in self.sinks:
+      sink.flush(snapshot)
+    self._last_flush = time.monotonic()
+
+  def _maybe_flush(self):
+    if self.flush_every is not None and time.monotonic() - self._last_flush >= self.flush_every:
+      self.flush()
+
+  def reset(self):
+    with self._lock:
+      self.timings.clear()
+      self.counters.clear()
+
+class Sink:
+  """
+    base sink, every hook is a no-op
+  """
+  def on_timing(self, phase, seconds):
+    pass
+
+  def on_count(self, name, n):
+    pass
+
+  def progress(self, iterable, total=None, desc=None):
+    return iterable
+
+  def flush(self, snapshot):
+    pass
+
+class LoggingSink(Sink):
+  def __init__(self, logger=None, level=logging.INFO):
+    self.logger = logger or logging.getLogger('tokenizers')
+    self.level = level
+
+  def flush(self, snapshot):
+    for phase, timing in sorted(snapshot['timings'].items()):
+      self.logger.log(self.level, "phase %s: %d calls, %.6f s", phase, timing['calls'], timing['seconds'])
+    for name, value in sorted(snapshot['counters'].items()):
+      self.logger.log(self.level, "counter %s: %d", name, value)
+
+def prometheus_labels(labels):
+  if not labels:
+    return ""
+  return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+def render_prometheus(snapshot, prefix='tokenizer', labels=None):
+  """
+    a Metrics.snapshot() in the prometheus text format, as a list of lines
+  """
+  labels = dict(labels or {})
+  p = prefix
+  lines = [f"# TYPE {p}_phase_seconds_total counter", f"# TYPE {p}_phase_calls_total counter"]
+  for phase, timing in sorted(snapshot['timings'].items()):
+    lines.append(f"{p}_phase_seconds_total{prometheus_labels({**labels, 'phase': phase})} {timing['seconds']}")
+    lines.append(f"{p}_phase_calls_total{prometheus_labels({**labels, 'phase': phase})} {timing['calls']}")
+  for name, value in sorted(snapshot['counters'].items()):
+    lines.append(f"# TYPE {p}_{name}_total counter")
+    lines.append(f"{p}_{name}_total{prometheus_labels(labels)} {value}")
+  return lines
+
+class PrometheusSink(Sink):
+  """
+    writes the metrics in the prometheus text format on every flush, for the node exporter's
+    textfile collector, the file is replaced atomically
+  """
+  def __init__(self, path, prefix='tokenizer', labels=None):
+    self.path = os.path.abspath(path)
+    self.prefix = prefix
+    self.labels = dict(labels or {})
+
+  def flush(self, snapshot):
+    lines = render_prometheus(snapshot, self.prefix, self.labels)
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as f:
+      f.write("\n".join(lines) + "\n")
+    os.replace(tmp, self.path)
+
+class ProgressSink(Sink):
+  """
+    tqdm progress bars for the long loops (training, vocab building)
+  """
+  def __init__(self, **tqdm_args):
+    from tqdm import tqdm
+    self._tqdm = tqdm
+    self.tqdm_args = tqdm_args
+
+  def progress(self, iterable, total=None, desc=None):
+    return self._tqdm(iterable, total=total, desc=desc, **self.tqdm_args)
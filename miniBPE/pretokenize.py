@@ -0,0 +1,70 @@
+"""
+  streaming pre-tokenization for corpora larger than memory
+  --> the source is read in fixed-size blocks and split with compiled_pattern.finditer()
+  --> the last match of every block (and any whitespace-only matches before it) may continue
+      into the next one, so it isn't yielded, the text from its start is carried over and
+      matched again with the next block (finditer on carry + block resumes exactly where a
+      scan of the whole text would)
+  --> memory is bounded by the block size plus the longest chunk/whitespace run
+"""
+
+import os
+
+def iter_blocks(source, block_size=1 << 20):
+  """
+    - source: a file path, an open text file or an iterable of strings
+    yields the text in blocks of at most block_size characters (iterables are passed as they are)
+  """
+  if isinstance(source, (str, os.PathLike)):
+    with open(source, 'r', encoding='utf-8', newline='') as f:
+      yield from iter_blocks(f, block_size)
+  elif hasattr(source, 'read'):
+    while True:
+      block = source.read(block_size)
+      if not block:
+        break
+      yield block
+  else:
+    yield from source
+
+def iter_chunk_blocks(source, compiled_pattern, block_size=1 << 20):
+  """
+    yields the chunks of every block as a list, same chunks in the same order as
+    compiled_pattern.findall() over the whole text
+  """
+  carry = ""
+  for block in iter_blocks(source, block_size):
+    text = carry + block
+    matches = list(compiled_pattern.finditer(text))
+    if not matches:
+      carry = text
+      continue
+    last = matches.pop()
+    # whitespace is matched with backtracking over the whole run (\s*[\r\n], \s+(?!\S)),
+    # so whitespace-only matches right before the last one can change too
+    while matches and matches[-1].group().isspace():
+      last = matches.pop()
+    carry = text[last.start():]
+    if matches:
+      yield [match.group() for match in matches]
+  if carry:
+    chunks = compiled_pattern.findall(carry)
+    if chunks:
+      yield chunks
+
+def iter_chunks(source, compiled_pattern, block_size=1 << 20):
+  """
+    yields the chunks one at a time
+  """
+  for chunks in iter_chunk_blocks(source, compiled_pattern, block_size):
+    yield from chunks
+
+def count_chunks(source, compiled_pattern, block_size=1 << 20, counts=None):
+  """
+    {chunk: no of occurrences}, grows with the no of distinct chunks, not the size of the source
+  """
+  counts = {} if counts is None else counts
+  for chunks in iter_chunk_blocks(source, compiled_pattern, block_size):
+    for chunk in chunks:
+      counts[chunk] = counts.get(chunk, 0) + 1
+  return counts
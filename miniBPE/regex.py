@@ -8,111 +8,325 @@ import os
 current_dir = os.path.dirname(os.path.realpath(__file__))
 os.chdir(current_dir)
 
-from .base import get_stats, merge
+from .trainer import PairIndex
+from .sketch import train_approx_merges, sample_report
+from .encoder import merge_ids
+from .cache import ChunkCache
+from .batch import BatchMixin
+from .binary import save_binary_model, load_binary_model, merge_items
+from .decoder import ByteDecoder, StreamDecoder
+from .idarray import new_ids, finish_ids
+from .pretokenize import iter_chunk_blocks, count_chunks
+from .instrument import NULL
 regex_pattern = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
 
-class RegexTokenizer:
-  def __init__(self, pattern=None):
+class RegexTokenizer(BatchMixin):
+  # timers/counters/progress bars, see instrument.py
+  instrument = NULL
+
+  def __init__(self, pattern=None, cache_size=65536):
+    """
+      - pattern: regex used to split the text into chunks, defaults to regex_pattern
+      - cache_size: no of chunk encodings kept in the LRU cache, 0 disables it
+    """
     super().__init__()
+    # first, every model change from here on clears it
+    self.cache = ChunkCache(cache_size)
     self.pattern = regex_pattern if pattern is None else pattern
     self.compiled_pattern = re.compile(self.pattern)
+    self.merges = {}
+    self.vocab = {idx: bytes([idx]) for idx in range(256)}
     self.special_tokens = {}
-    self.inverse_special_tokens = {}
+
+  # cached chunk encodings and the byte decoder are only valid for the model they were built
+  # from, merges and special tokens are kept as WatchedDict copies (like every public dict,
+  # see batch.py) so replacing them or editing them in place (tok.merges[pair] = idx,
+  # tok.special_tokens[s] = idx) moves the generation and drops the cache
+  @property
+  def merges(self):
+    # load_binary() leaves the merges in the file until they're first needed
+    if self._merges is None:
+      self._merges = self._watched(merge_items(self._merge_rows))
+      self._merge_rows = None
+    return self._merges
+
+  @merges.setter
+  def merges(self, merges):
+    self._merges, self._merge_rows = self._watched(merges), None
+
+  @property
+  def special_tokens(self):
+    return self._special_tokens
+
+  @special_tokens.setter
+  def special_tokens(self, special_tokens):
+    self._special_tokens = self._watched(special_tokens, self._special_tokens_changed)
+    self._special_tokens_changed()
+
+  def _special_tokens_changed(self):
+    self._special_matchers = {}
+    self.inverse_special_tokens = {v: k for k, v in self._special_tokens.items()}
+
+  def _model_changed(self):
+    super()._model_changed()
+    self.cache.clear()
   
   def train(self, text, vocab_size, verbose=False):
+    # identical chunks are trained once, their pairs weighted by how often they occur
+    chunk_counts = {}
+    with self.instrument.timer('pretokenize'):
+      for chunk in re.findall(self.compiled_pattern, text):
+        chunk_counts[chunk] = chunk_counts.get(chunk, 0) + 1
+    self._train_counts(chunk_counts, vocab_size, verbose)
+
+  def train_stream(self, source, vocab_size, verbose=False, block_size=1 << 20):
+    """
+      same as train() but the text is read from source in blocks, see pretokenize.py
+      - source: a file path, an open text file or an iterable of strings
+      memory grows with the no of distinct chunks, not the size of the file
+    """
+    with self.instrument.timer('pretokenize'):
+      chunk_counts = count_chunks(source, self.compiled_pattern, block_size)
+    self._train_counts(chunk_counts, vocab_size, verbose)
+
+  def _train_counts(self, chunk_counts, vocab_size, verbose=False):
     assert vocab_size >= 256
     n_merges = vocab_size - 256
+    ids = [list(chunk.encode('utf-8')) for chunk in chunk_counts]
+    inst = self.instrument
 
-    # text_chunks = re.findall(self.compiled_pattern, text)
-    # ids = [list(ch.encode('utf-8') for ch in text_chunks)]
-    tokens = list(text.encode('utf-8'))
-    ids = [tokens]
+    with inst.timer('train'):
+      index = PairIndex(ids, list(chunk_counts.values()))
+      merges = {}
+      vocab = {idx: bytes([idx]) for idx in range(256)}
+      for i in inst.progress(range(n_merges), total=n_merges, desc='Training the tokenizer\t'):
+        top = index.most_common()
+        if top is None:
+          break
+        pair, count = top
+        idx = 256 + i
+        index.merge(pair, idx)
+        merges[pair] = idx
+        vocab[idx] = vocab[pair[0]] + vocab[pair[1]]
 
-    merges = {}
-    vocab = {idx: bytes([idx]) for idx in range(256)}
-    for i in range(n_merges):
-      stats = {}
-      for chunk_ids in ids:
-        stats = get_stats(chunk_ids, stats)
-      
-      pair = max(stats, key=stats.get)
-      idx = 256 + i
-      ids = [merge(chunk_ids, pair, idx) for chunk_ids in ids]
-      merges[pair] = idx
+        if verbose:
+          print(f"merge {i+1}/{n_merges}: {pair} -> {idx} ({vocab[idx]}) had {count} occurrences")
+    inst.count('merges_learned', len(merges))
     
-      if verbose:
-        pass
+    self.vocab = vocab
+    self.merges = merges
+  
+  def train_approx(self, corpus, vocab_size, sample=None, verbose=False, **sketch_args):
+    """
+      approximate training with bounded memory, pair counts are kept in a count-min sketch
+      - corpus: list of strings or a callable returning a fresh iterable of strings,
+        streamed once per pass (64 or more, see sketch.py)
+      - sample: if given, approximate and exact training are compared on this string,
+        the result is kept in self.approx_report
+      - sketch_args: go to sketch.train_approx_merges()
+    """
+    assert vocab_size >= 256
+    n_merges = vocab_size - 256
+    texts = corpus if callable(corpus) else (lambda: corpus)
+    chunks = lambda: (list(chunk.encode('utf-8')) for text in texts() for chunk in re.findall(self.compiled_pattern, text))
+    with self.instrument.timer('train'):
+      merges = train_approx_merges(chunks, n_merges, **sketch_args)
+
+    vocab = {idx: bytes([idx]) for idx in range(256)}
     for (p0, p1), idx in merges.items():
       vocab[idx] = vocab[p0] + vocab[p1]
-    
     self.vocab = vocab
     self.merges = merges
-  
+
+    if sample is not None:
+      sample_chunks = [list(chunk.encode('utf-8')) for chunk in re.findall(self.compiled_pattern, sample)]
+      self.approx_report = sample_report(sample_chunks, n_merges, **sketch_args)
+      if verbose:
+        print(f"approximate vs exact on sample: {self.approx_report}")
+
   def register_special_token(self, special_tokens):
     self.special_tokens = special_tokens
-    self.inverse_special_tokens = {v: k for k, v in special_tokens.items()}
+
+  def _special_matcher(self, allowed):
+    """
+      one compiled alternation of the allowed special tokens ('all' or a frozenset of them),
+      longest first so a token that's a prefix of another can't cut it short
+      cached per allowed set until special_tokens changes, None if none are allowed
+    """
+    if allowed not in self._special_matchers:
+      tokens = [k for k in self.special_tokens if allowed == 'all' or k in allowed]
+      tokens.sort(key=len, reverse=True)
+      self._special_matchers[allowed] = re.compile("|".join(re.escape(k) for k in tokens)) if tokens else None
+    return self._special_matchers[allowed]
   
+  def _get_decoder(self):
+    """
+      flat byte table of vocab + special tokens (see decoder.py), rebuilt when the model changed
+    """
+    if getattr(self, '_decoder_key', None) != self._generation:
+      self._decoder = ByteDecoder(self.vocab, self.inverse_special_tokens)
+      self._decoder_key = self._generation
+    return self._decoder
+
   def decode(self, ids):
-    part_bytes = []
-    for idx in ids:
-      if idx in self.vocab:
-        part_bytes.append(self.vocab[idx])
-      elif idx in self.inverse_special_tokens:
-        part_bytes.append(self.inverse_special_tokens[idx].encode('utf-8'))
-      else:
-        raise ValueError(f"invalid token id: {idx}")
-    
-    text_bytes = b"".join(part_bytes)
-    text = text_bytes.decode('utf-8', errors='replace')
-    return text
+    """
+      ids can be a list, an array or a numpy array
+    """
+    inst = self.instrument
+    if not inst.enabled:
+      return self._get_decoder().decode(ids)
+    with inst.timer('decode'):
+      text_bytes = self._get_decoder().decode_bytes(ids)
+    inst.count('tokens_in', len(ids))
+    inst.count('bytes_out', len(text_bytes))
+    return text_bytes.decode('utf-8', errors='replace')
+
+  def decode_into(self, ids, out, offset=0):
+    """
+      writes the decoded bytes into out (bytearray/memoryview) at offset, returns the no of bytes written
+    """
+    with self.instrument.timer('decode'):
+      return self._get_decoder().decode_into(ids, out, offset)
+
+  def decode_batch(self, batch, num_workers=1, **kwargs):
+    """
+      decodes many id sequences in-process with one vectorized gather,
+      num_workers > 1 (or stream=True) uses the process pool of BatchMixin
+    """
+    if num_workers == 1 and not kwargs:
+      with self.instrument.timer('decode'):
+        return self._get_decoder().decode_batch(batch)
+    return super().decode_batch(batch, num_workers=num_workers, **kwargs)
+
+  def stream_decoder(self, errors='replace'):
+    """
+      stateful decoder for streamed generation: feed ids with step(), it returns only newly
+      completed text, utf-8 sequences split across tokens are held back, see decoder.py
+    """
+    return StreamDecoder(self._get_decoder(), errors)
   
   def _encode_chunk(self, text_bytes):
-    ids = list(text_bytes)
-    while len(ids) > 2:
-      stats = get_stats(ids)
-      pair = min(stats, key= lambda p: self.merges.get(p, float('inf')))
-      if pair not in self.merges:
-        break
-      
-      idx = self.merges[pair]
-      ids = merge(ids, pair, idx)
-    return ids
+    return merge_ids(text_bytes, self.merges)
   
-  def encode_ordinary(self, text):
-    """Encoding that ignores any special tokens."""
-    text_chunks = re.findall(self.compiled_pattern, text)
-    ids = []
-    for chunk in text_chunks:
-      chunk_bytes = chunk.encode("utf-8")
-      chunk_ids = self._encode_chunk(chunk_bytes)
+  def _n_ids(self):
+    # vocab ids are 0..len(vocab)-1, special tokens can sit anywhere above
+    return max(len(self.vocab), max(self.inverse_special_tokens, default=-1) + 1)
+
+  def encode_ordinary(self, text, out='list', dtype=None):
+    """
+      encoding that ignores any special tokens
+      - out: 'list', 'array' (array.array) or 'numpy', filled chunk by chunk
+      - dtype: element type, defaults to the smallest one that fits every id, see idarray.py
+    """
+    ids = new_ids(out, self._n_ids(), dtype)
+    self._extend_segment(ids, text)
+    return finish_ids(ids, out)
+
+  def _iter_chunks(self, text, pos=0, endpos=None):
+    # chunks are matched one at a time, the text is never held as a list of chunk strings
+    endpos = len(text) if endpos is None else endpos
+    return (match.group() for match in self.compiled_pattern.finditer(text, pos, endpos))
+
+  def iter_encode(self, source, out='list', dtype=None, block_size=1 << 20):
+    """
+      encodes a file (path, open text file or iterable of strings) block by block, special
+      tokens are ignored like in encode_ordinary()
+      yields the ids of every block, concatenated they are the ids of the whole text
+    """
+    for chunks in iter_chunk_blocks(source, self.compiled_pattern, block_size):
+      ids = new_ids(out, self._n_ids(), dtype)
+      if self.instrument.enabled:
+        self._extend_counted(ids, chunks)
+      else:
+        self._extend_chunks(ids, chunks)
+      yield finish_ids(ids, out)
+
+  def _extend_segment(self, ids, text, pos=0, endpos=None):
+    inst = self.instrument
+    if not inst.enabled:
+      self._extend_chunks(ids, self._iter_chunks(text, pos, endpos))
+      return
+    # instrumented: the chunks of the segment are listed so pre-tokenize and merge are timed apart
+    with inst.timer('pretokenize'):
+      chunks = list(self._iter_chunks(text, pos, endpos))
+    self._extend_counted(ids, chunks)
+
+  def _extend_counted(self, ids, chunks):
+    inst = self.instrument
+    cache = self.cache
+    hits, misses, n_before = cache.hits, cache.misses, len(ids)
+    with inst.timer('merge'):
+      self._extend_chunks(ids, chunks)
+    n_bytes = sum(len(chunk.encode('utf-8')) for chunk in chunks)
+    n_tokens = len(ids) - n_before
+    inst.count('chunks', len(chunks))
+    inst.count('cache_hits', cache.hits - hits)
+    inst.count('cache_misses', cache.misses - misses)
+    inst.count('bytes_in', n_bytes)
+    inst.count('tokens_out', n_tokens)
+    # every merge turns two tokens into one
+    inst.count('merges_applied', n_bytes - n_tokens)
+
+  def _extend_chunks(self, ids, chunks):
+    cache = self.cache
+    generation = cache.generation
+    for chunk in chunks:
+      chunk_ids = cache.get(chunk)
+      if chunk_ids is None:
+        chunk_ids = self._encode_chunk(chunk.encode("utf-8"))
+        cache.put(chunk, chunk_ids, generation)
       ids.extend(chunk_ids)
-    return ids
   
-  def encode(self, text, allowed_special="none_raise"):
-    special = None
-    if allowed_special == 'all':
-      special = self.special_tokens
-    elif allowed_special == 'none':
-      special = {}
-    elif allowed_special == 'none_raise':
-      special = {}
-      assert all(token not in text for token in self.special_tokens)
+  def encode(self, text, allowed_special="none_raise", out='list', dtype=None):
+    """
+      - allowed_special: 'all', 'none', 'none_raise' (fails if the text holds any special
+        token) or a set of the special tokens to recognise
+      special tokens are found with one cached matcher in a single pass over the text, the
+      text between them is encoded in place without being sliced out
+    """
+    inst = self.instrument
+    if allowed_special in ('all', 'none', 'none_raise'):
+      matcher = self._special_matcher('all') if allowed_special == 'all' else None
+      if allowed_special == 'none_raise' and self.special_tokens:
+        with inst.timer('special_split'):
+          found = self._special_matcher('all').search(text)
+        assert found is None, f"special token {found.group()!r} found in text"
     elif isinstance(allowed_special, set):
-      special = {k: v for k, v in self.special_tokens.items() if k in allowed_special}
+      matcher = self._special_matcher(frozenset(allowed_special))
     else:
       raise ValueError(f"allowed_special = {allowed_special} not understood")
     
-    if not special:
-      return self.encode_ordinary(text)
-    
-    special_pattern = "(" + "|".join(re.escape(k) for k in special) + ")"
-    special_chunks = re.split(special_pattern, text)
+    if matcher is None:
+      return self.encode_ordinary(text, out, dtype)
 
-    ids = []
-    for part in special_chunks:
-      if part in special:
-        ids.append(special[part])
-      else:
-        ids.extend(self.encode_ordinary(part))
+    with inst.timer('special_split'):
+      spans = [(match.start(), match.end(), self.special_tokens[match.group()]) for match in matcher.finditer(text)]
+    inst.count('special_tokens', len(spans))
+
+    ids = new_ids(out, self._n_ids(), dtype)
+    pos = 0
+    for start, end, idx in spans:
+      self._extend_segment(ids, text, pos, start)
+      ids.append(idx)
+      pos = end
+    self._extend_segment(ids, text, pos)
     
-    return ids
\ No newline at end of file
+    return finish_ids(ids, out)
+
+  def save_binary(self, path):
+    """
+      saves pattern, special tokens, merges and vocab to one binary '.bin' file, see binary.py
+    """
+    save_binary_model(path, self.merges, self.vocab, self.special_tokens, meta={'tokenizer': 'regex', 'pattern': self.pattern})
+
+  def load_binary(self, path):
+    """
+      loads a '.bin' file with mmap, merges are read from it on first use, vocab entries on lookup
+    """
+    model = load_binary_model(path)
+    assert model.meta.get('tokenizer') == 'regex', f"{path} was not saved by RegexTokenizer"
+    self.pattern = model.meta['pattern']
+    self.compiled_pattern = re.compile(self.pattern)
+    self._merges, self._merge_rows = None, model.merge_rows
+    self.vocab = model.vocab
+    self.register_special_token(model.special_tokens)
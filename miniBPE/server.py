@@ -0,0 +1,497 @@
+"""
+  asyncio tokenization service with dynamic micro-batching, stdlib only
+  --> HTTP/1.1 with keep-alive and json bodies, on localhost or on a unix socket:
+        POST /encode {"text", "model"?, "allowed_special"?}  -> {"ids": [...]}
+        POST /decode {"ids", "model"?}                        -> {"text": "..."}
+        POST /count  {"text", "model"?, "allowed_special"?}  -> {"count": n}
+        GET  /health, GET /stats (json), GET /metrics (prometheus text)
+  --> concurrent requests for the same model and operation wait in one queue and are sent as a
+      micro-batch once it holds max_batch_size requests or max_wait_ms after its first request,
+      whichever comes first
+  --> batches run on a process pool (the models are pickled once per worker) so encoding never
+      holds the event loop's GIL, num_workers=0 runs them on one thread in-process
+  --> backpressure: at most 2 batches per worker are in flight, so bursts queue up here (and the
+      batches grow) instead of in the pool, and past max_queue waiting requests new ones are
+      answered with 503 and a Retry-After header
+  --> metrics: request/batch/reject counters and per-operation latency in instrument.Metrics,
+      latency and batch size histograms, queue depth and in-flight gauges
+"""
+
+import os
+import json
+import time
+import asyncio
+import functools
+import collections
+import concurrent.futures
+from .instrument import Metrics, render_prometheus, prometheus_labels
+
+OPERATIONS = ('encode', 'decode', 'count')
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class Overloaded(Exception):
+  """
+    max_queue requests are already waiting, retry later
+  """
+
+class RequestError(ValueError):
+  """
+    the tokenizer rejected the request (eg. a disallowed special token)
+  """
+
+_worker_models = None
+
+def _init_worker(models):
+  global _worker_models
+  _worker_models = models
+
+def _encode_kwargs(payload):
+  kwargs = {}
+  if 'allowed_special' in payload:
+    allowed = payload['allowed_special']
+    kwargs['allowed_special'] = set(allowed) if isinstance(allowed, list) else allowed
+  return kwargs
+
+def _run_batch(name, op, payloads, models=None):
+  """
+    runs one micro-batch in a worker, a failing request doesn't fail the others:
+    returns (True, result) or (False, error message) per request
+  """
+  tokenizer = (_worker_models if models is None else models)[name]
+  results = []
+  for payload in payloads:
+    try:
+      if op == 'decode':
+        result = {'text': tokenizer.decode(payload['ids'])}
+      else:
+        ids = tokenizer.encode(payload['text'], **_encode_kwargs(payload))
+        ids = ids.tolist() if hasattr(ids, 'tolist') else list(ids)
+        result = {'ids': ids} if op == 'encode' else {'count': len(ids)}
+      results.append((True, result))
+    except Exception as e:
+      results.append((False, f"{type(e).__name__}: {e}"))
+  return results
+
+def _ping():
+  return os.getpid()
+
+class _Histogram:
+  """
+    cumulative prometheus buckets plus the most recent samples for quantiles
+  """
+  def __init__(self, buckets, recent=10000):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+    self.recent = collections.deque(maxlen=recent)
+
+  def observe(self, value):
+    i = 0
+    while i < len(self.buckets) and value > self.buckets[i]:
+      i += 1
+    self.counts[i] += 1
+    self.sum += value
+    self.count += 1
+    self.recent.append(value)
+
+  def quantiles(self, qs=(0.5, 0.9, 0.99), scale=1.0):
+    values = sorted(self.recent)
+    if not values:
+      return {}
+    return {f"p{round(q * 100)}": values[min(int(q * len(values)), len(values) - 1)] * scale for q in qs}
+
+  def render(self, name, labels=None):
+    labels = dict(labels or {})
+    lines, total = [], 0
+    for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+      total += n
+      lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': bound})} {total}")
+    lines.append(f"{name}_sum{prometheus_labels(labels)} {self.sum}")
+    lines.append(f"{name}_count{prometheus_labels(labels)} {self.count}")
+    return lines
+
+class _HTTPError(Exception):
+  def __init__(self, status, message):
+    super().__init__(message)
+    self.status = status
+
+class TokenizerServer:
+  def __init__(self, models, num_workers=None, max_batch_size=64, max_wait_ms=2.0, max_queue=1024,
+               max_body=16 << 20, sinks=()):
+    """
+      - models: {name: tokenizer}, any tokenizer with encode()/decode(), the first one answers
+        requests that don't name a model
+      - num_workers: processes in the pool, defaults to all cores, 0 runs batches on a thread
+      - max_batch_size, max_wait_ms: when a micro-batch is sent, see the top of this file
+      - max_queue: waiting requests before new ones get a 503
+      - max_body: largest request body in bytes, larger ones get a 413
+      - sinks: instrument sinks for the server metrics (eg. LoggingSink, PrometheusSink)
+    """
+    assert models, "the server needs at least one model"
+    assert max_batch_size >= 1 and max_queue >= 1
+    self.models = dict(models)
+    self.default_model = next(iter(self.models))
+    self.num_workers = os.cpu_count() if num_workers is None else num_workers
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait_ms / 1000
+    self.max_queue = max_queue
+    self.max_body = max_body
+    self.metrics = Metrics(*sinks)
+    self.latency = {op: _Histogram(_LATENCY_BUCKETS) for op in OPERATIONS}
+    self.batch_sizes = _Histogram(_BATCH_BUCKETS)
+    self.queue_depth = 0
+    self.in_flight = 0
+    self.address = None
+    self._queues = {}
+    self._tasks = set()
+    self._connections = set()
+    self._server = None
+    self._executor = None
+    self._slots = None
+
+  async def start(self, host='127.0.0.1', port=0, path=None):
+    """
+      starts the pool and listens on host:port (port 0 picks a free one) or on the unix socket
+      at path, returns the address
+    """
+    loop = asyncio.get_running_loop()
+    if self.num_workers > 0:
+      self._executor = concurrent.futures.ProcessPoolExecutor(self.num_workers, initializer=_init_worker, initargs=(self.models,))
+      # start the workers now, not on the first requests
+      await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.num_workers)))
+    else:
+      self._executor = concurrent.futures.ThreadPoolExecutor(1)
+    self._slots = asyncio.Semaphore(2 * max(self.num_workers, 1))
+    if path is not None:
+      if os.path.exists(path):
+        os.unlink(path)
+      self._server = await asyncio.start_unix_server(self._handle, path=path)
+      self.address = path
+    else:
+      self._server = await asyncio.start_server(self._handle, host, port)
+      self.address = self._server.sockets[0].getsockname()[:2]
+    return self.address
+
+  async def stop(self):
+    if self._server is not None:
+      self._server.close()
+      for writer in list(self._connections):
+        writer.close()
+      await self._server.wait_closed()
+    for task in list(self._tasks):
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    if self._executor is not None:
+      # waiting for the workers blocks, do it off the event loop so other servers/clients keep running
+      await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._executor.shutdown, wait=True, cancel_futures=True))
+    if isinstance(self.address, str) and os.path.exists(self.address):
+      os.unlink(self.address)
+
+  async def __aenter__(self):
+    if self._server is None:
+      await self.start()
+    return self
+
+  async def __aexit__(self, *exc):
+    await self.stop()
+
+  def _spawn(self, coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+    return task
+
+  async def submit(self, op, payload, model=None):
+    """
+      queues one request for the next micro-batch of its model and operation and waits for
+      its result, the same call the http handler makes
+      raises KeyError for an unknown model, Overloaded when max_queue requests are waiting
+      and RequestError when the tokenizer rejects the request
+    """
+    assert op in OPERATIONS, f"op = {op} not understood"
+    name = self.default_model if model is None else model
+    if name not in self.models:
+      raise KeyError(f"unknown model {name!r}")
+    if self.queue_depth >= self.max_queue:
+      self.metrics.count('rejected')
+      raise Overloaded(f"{self.queue_depth} requests are waiting")
+    key = (name, op)
+    queue = self._queues.get(key)
+    if queue is None:
+      queue = self._queues[key] = asyncio.Queue()
+      self._spawn(self._batcher(key, queue))
+    future = asyncio.get_running_loop().create_future()
+    start = time.perf_counter()
+    self.queue_depth += 1
+    queue.put_nowait((payload, future))
+    ok, result = await future
+    elapsed = time.perf_counter() - start
+    self.latency[op].observe(elapsed)
+    self.metrics.record(op, elapsed)
+    self.metrics.count('requests')
+    if not ok:
+      self.metrics.count('errors')
+      raise RequestError(result)
+    return result
+
+  async def _batcher(self, key, queue):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = [await queue.get()]
+      deadline = loop.time() + self.max_wait
+      while len(batch) < self.max_batch_size:
+        if not queue.empty():
+          batch.append(queue.get_nowait())
+          continue
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+          break
+      await self._slots.acquire()
+      # requests that came in while every slot was busy ride along
+      while len(batch) < self.max_batch_size and not queue.empty():
+        batch.append(queue.get_nowait())
+      self.queue_depth -= len(batch)
+      self.in_flight += 1
+      self._spawn(self._dispatch(key, batch))
+
+  async def _dispatch(self, key, batch):
+    name, op = key
+    payloads = [payload for payload, _ in batch]
+    models = None if self.num_workers > 0 else self.models
+    try:
+      results = await asyncio.get_running_loop().run_in_executor(self._executor, _run_batch, name, op, payloads, models)
+    except Exception as e:
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+    finally:
+      self._slots.release()
+      self.in_flight -= 1
+    self.metrics.count('batches')
+    self.metrics.count('batched_requests', len(batch))
+    self.batch_sizes.observe(len(batch))
+    for (_, future), result in zip(batch, results):
+      if not future.done():
+        future.set_result(result)
+
+  def stats(self):
+    """
+      json view of the metrics, latencies in ms over the most recent requests
+    """
+    snapshot = self.metrics.snapshot()
+    return {
+      'queue_depth': self.queue_depth,
+      'in_flight': self.in_flight,
+      'counters': snapshot['counters'],
+      'latency_ms': {op: {'count': hist.count, **hist.quantiles(scale=1000)} for op, hist in self.latency.items()},
+      'batch_size': {'count': self.batch_sizes.count, 'mean': self.batch_sizes.sum / max(self.batch_sizes.count, 1),
+                     **self.batch_sizes.quantiles()},
+    }
+
+  def render_metrics(self):
+    p = 'tokenizer_server'
+    lines = render_prometheus(self.metrics.snapshot(), p)
+    lines += [f"# TYPE {p}_queue_depth gauge", f"{p}_queue_depth {self.queue_depth}",
+              f"# TYPE {p}_in_flight_batches gauge", f"{p}_in_flight_batches {self.in_flight}",
+              f"# TYPE {p}_request_seconds histogram"]
+    for op, hist in self.latency.items():
+      lines += hist.render(f"{p}_request_seconds", {'op': op})
+    lines.append(f"# TYPE {p}_batch_size histogram")
+    lines += self.batch_sizes.render(f"{p}_batch_size")
+    return "\n".join(lines) + "\n"
+
+  async def _read_request(self, reader):
+    """
+      (method, path, headers, body) of the next request on the connection, None at its end
+    """
+    line = await reader.readline()
+    if not line:
+      return None
+    try:
+      method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+      raise _HTTPError(400, "malformed request line")
+    headers = {}
+    while True:
+      line = await reader.readline()
+      if line in (b"\r\n", b"\n", b""):
+        break
+      name, _, value = line.decode('latin-1').partition(':')
+      headers[name.strip().lower()] = value.strip()
+    try:
+      length = int(headers.get('content-length') or 0)
+    except ValueError:
+      length = -1
+    if length < 0:
+      raise _HTTPError(400, f"invalid Content-Length {headers['content-length']!r}")
+    if length > self.max_body:
+      raise _HTTPError(413, f"body larger than {self.max_body} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split('?', 1)[0], headers, body
+
+  async def _route(self, method, path, body):
+    """
+      (status, json-able body or text, extra headers)
+    """
+    if method == 'GET' and path == '/health':
+      return 200, {'status': 'ok', 'models': list(self.models)}, {}
+    if method == 'GET' and path == '/stats':
+      return 200, self.stats(), {}
+    if method == 'GET' and path == '/metrics':
+      return 200, self.render_metrics(), {}
+    op = path.strip('/')
+    if op not in OPERATIONS:
+      return 404, {'error': f"no route for {method} {path}"}, {}
+    if method != 'POST':
+      return 405, {'error': f"{path} only takes POST"}, {'Allow': 'POST'}
+    try:
+      payload = json.loads(body)
+    except ValueError:
+      return 400, {'error': "body is not valid json"}, {}
+    field = 'ids' if op == 'decode' else 'text'
+    if not isinstance(payload, dict) or field not in payload:
+      return 400, {'error': f"body needs a {field!r} field"}, {}
+    try:
+      return 200, await self.submit(op, payload, payload.get('model')), {}
+    except KeyError as e:
+      return 404, {'error': str(e.args[0])}, {}
+    except Overloaded as e:
+      return 503, {'error': f"overloaded, {e}"}, {'Retry-After': '1'}
+    except RequestError as e:
+      return 400, {'error': str(e)}, {}
+    except Exception as e:
+      return 500, {'error': f"{type(e).__name__}: {e}"}, {}
+
+  def _write_response(self, writer, status, content, headers, keep_alive):
+    if isinstance(content, str):
+      body, content_type = content.encode('utf-8'), 'text/plain; version=0.0.4'
+    else:
+      body, content_type = json.dumps(content).encode('utf-8'), 'application/json'
+    head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body)
+
+  async def _handle(self, reader, writer):
+    self._connections.add(writer)
+    try:
+      while True:
+        try:
+          request = await self._read_request(reader)
+        except _HTTPError as e:
+          self._write_response(writer, e.status, {'error': str(e)}, {}, False)
+          await writer.drain()
+          break
+        if request is None:
+          break
+        method, path, headers, body = request
+        status, content, extra = await self._route(method, path, body)
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        self._write_response(writer, status, content, extra, keep_alive)
+        await writer.drain()
+        if not keep_alive:
+          break
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass
+    finally:
+      self._connections.discard(writer)
+      writer.close()
+
+class Client:
+  """
+    minimal asyncio client for the server over one keep-alive connection, for tests and load
+    tests, raises Overloaded on a 503 and RequestError on any other error status
+  """
+  def __init__(self, host='127.0.0.1', port=None, path=None):
+    self.host = host
+    self.port = port
+    self.path = path
+    self._reader = None
+    self._writer = None
+
+  async def connect(self):
+    if self.path is not None:
+      self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+    else:
+      self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+    return self
+
+  async def close(self):
+    if self._writer is not None:
+      self._writer.close()
+      self._writer = None
+
+  async def __aenter__(self):
+    return await self.connect()
+
+  async def __aexit__(self, *exc):
+    await self.close()
+
+  async def request(self, method, path, payload=None):
+    """
+      (status, body bytes) of one request
+    """
+    body = b"" if payload is None else json.dumps(payload).encode('utf-8')
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    self._writer.write(head.encode('latin-1') + body)
+    await self._writer.drain()
+    status = int((await self._reader.readline()).split(b" ", 2)[1])
+    length = 0
+    while True:
+      line = await self._reader.readline()
+      if line in (b"\r\n", b"\n", b""):
+        break
+      name, _, value = line.decode('latin-1').partition(':')
+      if name.strip().lower() == 'content-length':
+        length = int(value)
+    return status, await self._reader.readexactly(length)
+
+  async def _call(self, op, payload):
+    status, body = await self.request('POST', '/' + op, payload)
+    result = json.loads(body)
+    if status == 503:
+      raise Overloaded(result['error'])
+    if status != 200:
+      raise RequestError(f"{status}: {result['error']}")
+    return result
+
+  async def encode(self, text, model=None, **kwargs):
+    return (await self._call('encode', {'text': text, 'model': model, **kwargs}))['ids']
+
+  async def decode(self, ids, model=None):
+    return (await self._call('decode', {'ids': list(ids), 'model': model}))['text']
+
+  async def count(self, text, model=None, **kwargs):
+    return (await self._call('count', {'text': text, 'model': model, **kwargs}))['count']
+
+  async def stats(self):
+    return json.loads((await self.request('GET', '/stats'))[1])
+
+  async def metrics(self):
+    return (await self.request('GET', '/metrics'))[1].decode('utf-8')
+
+def serve(models, host='127.0.0.1', port=8000, path=None, **server_args):
+  """
+    runs a TokenizerServer until interrupted
+  """
+  async def main():
+    server = TokenizerServer(models, **server_args)
+    address = await server.start(host, port, path)
+    print(f"serving {', '.join(server.models)} on {address}", flush=True)
+    try:
+      await asyncio.Event().wait()
+    finally:
+      await server.stop()
+  try:
+    asyncio.run(main())
+  except KeyboardInterrupt:
+    pass
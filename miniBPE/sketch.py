@@ -0,0 +1,142 @@
+"""
+  approximate streaming bpe training, for corpora that don't fit in memory
+  --> pair counts go into a count-min sketch of fixed size instead of an exact dict
+  --> next to it a bounded set of candidate pairs (heavy hitters) is kept, merges are
+      picked from those candidates
+  --> memory is width * depth counters + capacity candidates, whatever the corpus size
+  --> every pass streams the corpus once, applies the merges learned so far and picks
+      up to merges_per_pass new merges (n_merges // 64 by default), so a vocab takes 64 passes
+      or more, see train_approx_merges()
+"""
+
+import random
+from array import array
+from .trainer import train_merges
+from .encoder import merge_ids
+
+_PRIME = (1 << 61) - 1
+
+class CountMinSketch:
+  def __init__(self, width=1 << 20, depth=4, seed=0):
+    """
+      depth rows of width counters each, estimates never undercount
+    """
+    self.width = width
+    self.depth = depth
+    rng = random.Random(seed)
+    self.hashes = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(depth)]
+    self.tables = [array('q', bytes(8 * width)) for _ in range(depth)]
+
+  def _cells(self, key):
+    return [((a * key + b) % _PRIME) % self.width for a, b in self.hashes]
+
+  def add(self, key, count=1):
+    """
+      conservative update: only the smallest counters are raised, returns the new estimate
+    """
+    cells = self._cells(key)
+    est = min(table[cell] for table, cell in zip(self.tables, cells)) + count
+    for table, cell in zip(self.tables, cells):
+      if table[cell] < est:
+        table[cell] = est
+    return est
+
+  def estimate(self, key):
+    return min(table[cell] for table, cell in zip(self.tables, self._cells(key)))
+
+def _pair_key(pair):
+  return (pair[0] << 32) | pair[1]
+
+def _picks(ranked, estimates, limit, tolerance):
+  """
+    the merges of one pass, in rank order, at most limit
+      - a pair picked after (a, b) could have been outranked on the merged ids by:
+          - a pair sharing a token with (a, b), its count is stale
+          - a pair the merge creates, (x, ab) or (ab, y), counted at most min(count of (a, b),
+            count of (x, a) or (b, y))
+      - the pass ends at the first pair counted no more than tolerance times the most any of
+        those could be counted, with tolerance=1 and exact counts a pass gives the same merges as one
+        merge per pass, lower values trade that for fewer passes
+  """
+  ending, starting = {}, {}
+  for (p0, p1), est in estimates.items():
+    ending[p1] = max(ending.get(p1, 0), est)
+    starting[p0] = max(starting.get(p0, 0), est)
+  picks, used, bound = [], set(), 0
+  for pair in ranked:
+    if len(picks) == limit or estimates[pair] <= tolerance * bound:
+      break
+    if pair[0] in used or pair[1] in used:
+      bound = max(bound, estimates[pair])
+      continue
+    picks.append(pair)
+    used.update(pair)
+    bound = max(bound, min(estimates[pair], max(ending.get(pair[0], 0), starting.get(pair[1], 0))))
+  return picks
+
+def train_approx_merges(corpus, n_merges, start_idx=256, width=1 << 20, depth=4, capacity=4096, merges_per_pass=None,
+                        tolerance=0.8, seed=0):
+  """
+    - corpus: callable returning a fresh iterable of chunks (lists of integers), called once per pass
+    - width, depth: size of the count-min sketch
+    - capacity: no of candidate pairs kept between prunes (at most 2 * capacity are held)
+    - merges_per_pass: most merges picked per pass over the corpus, defaults to n_merges // 64
+      (1 below 128 merges, which always picks the top pair like exact training)
+    - tolerance: how far down the ranking a pass may pick, see _picks()
+    training takes at least n_merges / merges_per_pass passes, more when fewer pairs of a pass
+    qualify, eg. 2000 merges over 2 MB of text take about 100 passes (639 with tolerance=1)
+    returns the merges dict {pair: idx}
+  """
+  merges = {}
+  if merges_per_pass is None:
+    merges_per_pass = max(n_merges // 64, 1)
+  while len(merges) < n_merges:
+    sketch = CountMinSketch(width, depth, seed)
+    candidates = {}
+    for chunk in corpus():
+      ids = merge_ids(chunk, merges)
+      for pair in zip(ids, ids[1:]):
+        est = sketch.add(_pair_key(pair))
+        candidates[pair] = est
+        if len(candidates) > 2 * capacity:
+          kept = sorted(candidates.items(), key=lambda item: item[1], reverse=True)[:capacity]
+          candidates = dict(kept)
+    if not candidates:
+      break
+
+    estimates = {pair: sketch.estimate(_pair_key(pair)) for pair in candidates}
+    ranked = sorted(candidates, key=estimates.get, reverse=True)
+    for pair in _picks(ranked, estimates, min(merges_per_pass, n_merges - len(merges)), tolerance):
+      merges[pair] = start_idx + len(merges)
+  return merges
+
+def _merge_bytes(merges):
+  vocab = {idx: bytes([idx]) for idx in range(256)}
+  tokens = []
+  for (p0, p1), idx in merges.items():
+    vocab[idx] = vocab[p0] + vocab[p1]
+    tokens.append(vocab[idx])
+  return tokens
+
+def merge_divergence(approx_merges, exact_merges):
+  """
+    compares two byte-level merge lists by the tokens they produce (ids stop lining up
+    after the first difference):
+      - first_divergence: index of the first differing merge, None if the lists agree
+      - overlap: fraction of the exact tokens that the approximate merges also learned
+  """
+  approx, exact = _merge_bytes(approx_merges), _merge_bytes(exact_merges)
+  first = next((i for i, (a, e) in enumerate(zip(approx, exact)) if a != e), None)
+  if first is None and len(approx) != len(exact):
+    first = min(len(approx), len(exact))
+  overlap = len(set(approx) & set(exact)) / len(exact) if exact else 1.0
+  return {'first_divergence': first, 'overlap': overlap}
+
+def sample_report(chunks, n_merges, start_idx=256, **sketch_args):
+  """
+    trains exact and approximate merges on the same (small) list of chunks and returns
+    merge_divergence() of the two
+  """
+  approx = train_approx_merges(lambda: chunks, n_merges, start_idx, **sketch_args)
+  exact = train_merges(chunks, n_merges, start_idx)
+  return merge_divergence(approx, exact)
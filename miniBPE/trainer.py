@@ -0,0 +1,141 @@
+"""
+  incremental bpe training engine
+  --> tokens live in a doubly linked list (flat arrays of prev/next positions)
+  --> every pair keeps the set of positions where it occurs, so a merge only touches
+      those positions and fixes up the neighbouring pair counts in place
+  --> pair counts sit in a lazy max-heap, ties are broken by the first occurrence
+      in the sequence, which gives the same merges as the get_stats()/merge() loop
+      in base.py
+"""
+
+import heapq
+from array import array
+
+class PairIndex:
+  def __init__(self, chunks, counts=None):
+    """
+      - chunks: list of lists of integers, pairs never cross chunk boundaries
+      - counts: optional list of weights, one per chunk (eg. frequency of a unique chunk)
+        every pair found in a chunk is counted 'weight' times
+    """
+    self.ids = array('l')
+    self.prev = array('l')
+    self.next = array('l')
+    self.weight = array('q')
+    self.stats = {}
+    self.occurrences = {}
+
+    for c, chunk in enumerate(chunks):
+      w = 1 if counts is None else counts[c]
+      start = len(self.ids)
+      n = len(chunk)
+      self.ids.extend(chunk)
+      self.prev.extend(range(start - 1, start + n - 1))
+      self.next.extend(range(start + 1, start + n + 1))
+      self.weight.extend([w] * n)
+      if n:
+        self.prev[start] = -1
+        self.next[start + n - 1] = -1
+      for pos in range(start, start + n - 1):
+        self._add(pos, (chunk[pos - start], chunk[pos - start + 1]), w)
+
+    self.heap = [(-count, 0, pair) for pair, count in self.stats.items()]
+    heapq.heapify(self.heap)
+
+  def _add(self, pos, pair, w):
+    self.stats[pair] = self.stats.get(pair, 0) + w
+    occ = self.occurrences.get(pair)
+    if occ is None:
+      self.occurrences[pair] = {pos}
+    else:
+      occ.add(pos)
+
+  def _remove(self, pos, pair, w):
+    self.stats[pair] -= w
+    self.occurrences[pair].discard(pos)
+
+  def _push(self, pair):
+    count = self.stats.get(pair, 0)
+    if count > 0:
+      heapq.heappush(self.heap, (-count, 0, pair))
+
+  def most_common(self):
+    """
+      returns (pair, count) of the most frequent pair, or None if there are no pairs left
+      ties go to the pair that occurs first, same as max(stats, key=stats.get)
+    """
+    heap = self.heap
+    while heap:
+      neg_count, first, pair = heap[0]
+      if self.stats.get(pair, 0) != -neg_count:
+        heapq.heappop(heap)
+        continue
+      true_first = min(self.occurrences[pair])
+      if true_first != first:
+        heapq.heapreplace(heap, (neg_count, true_first, pair))
+        continue
+      return pair, -neg_count
+    return None
+
+  def merge(self, pair, idx):
+    """
+      replaces every occurrence of pair with idx, left to right, touching only the
+      positions where the pair occurs
+    """
+    ids, prev, nxt, weight = self.ids, self.prev, self.next, self.weight
+    p0, p1 = pair
+    changed = set()
+    for pos in sorted(self.occurrences.get(pair, ())):
+      # an earlier overlapping merge (eg. 'aaa') may have consumed this occurrence
+      if ids[pos] != p0:
+        continue
+      right = nxt[pos]
+      if right == -1 or ids[right] != p1:
+        continue
+      w = weight[pos]
+      left = prev[pos]
+      if left != -1:
+        old, new = (ids[left], p0), (ids[left], idx)
+        self._remove(left, old, w)
+        self._add(left, new, w)
+        changed.add(old)
+        changed.add(new)
+      after = nxt[right]
+      if after != -1:
+        old, new = (p1, ids[after]), (idx, ids[after])
+        self._remove(right, old, w)
+        self._add(pos, new, w)
+        changed.add(old)
+        changed.add(new)
+        prev[after] = pos
+      self._remove(pos, pair, w)
+      ids[pos] = idx
+      nxt[pos] = after
+      ids[right] = -1
+
+    self.stats.pop(pair, None)
+    self.occurrences.pop(pair, None)
+    changed.discard(pair)
+    for p in changed:
+      if not self.occurrences.get(p, True):
+        del self.occurrences[p]
+        del self.stats[p]
+      else:
+        self._push(p)
+
+def train_merges(chunks, n_merges, start_idx=256, counts=None):
+  """
+    runs n_merges merges over the chunks and returns the merges dict {pair: idx}
+    stops early if every chunk has been merged down to a single token
+  """
+  index = PairIndex(chunks, counts)
+  merges = {}
+  for i in range(n_merges):
+    top = index.most_common()
+    if top is None:
+      break
+    pair, _ = top
+    idx = start_idx + i
+    index.merge(pair, idx)
+    merges[pair] = idx
+  return merges
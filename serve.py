@@ -0,0 +1,147 @@
+"""
+tokenization service for saved binary models, see miniBPE/server.py for the endpoints
+--> every --model NAME=PATH is a '.bin' file written by save_binary() of any tokenizer, the
+    tokenizer class is read from the file, the first model is the default
+--> --load-test N runs the server in-process, sends N requests from --concurrency clients and
+    prints throughput, client-side latency percentiles and the server's stats as json, the
+    exit status is 1 if any request failed (503s are counted as rejected, not failed)
+
+  python serve.py --model bpe=models/sample.bin --port 8000
+  python serve.py --model bpe=models/sample.bin --unix /tmp/tokenizer.sock
+  python serve.py --model bpe=models/sample.bin --load-test 5000 --concurrency 64
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# the tokenizer modules chdir into their own directory on import, every path is made absolute first
+ROOT = os.path.dirname(os.path.realpath(__file__))
+_CWD = os.getcwd()
+sys.path.insert(0, ROOT)
+
+from miniBPE import BasicTokenizer, RegexTokenizer
+from miniBPE.binary import load_binary_model
+from miniBPE.server import TokenizerServer, Client, Overloaded, serve
+from subDNA import DNAtokenizer, KMerTokenizer, KmerPairTokenizer
+
+TOKENIZERS = {
+  'basic': BasicTokenizer,
+  'regex': RegexTokenizer,
+  'dna': DNAtokenizer,
+  'kmer': KMerTokenizer,
+  'kmer_pair': KmerPairTokenizer,
+}
+
+def load_model(path):
+  """
+    tokenizer of a '.bin' file, whichever class saved it
+  """
+  path = os.path.join(_CWD, path)
+  kind = load_binary_model(path).meta.get('tokenizer')
+  assert kind in TOKENIZERS, f"{path} has no known tokenizer type (got {kind!r})"
+  tokenizer = TOKENIZERS[kind]()
+  tokenizer.load_binary(path)
+  return tokenizer
+
+def _parse_models(specs):
+  models = {}
+  for spec in specs:
+    name, sep, path = spec.partition('=')
+    if not sep:
+      name, path = os.path.splitext(os.path.basename(spec))[0], spec
+    models[name] = load_model(path)
+  return models
+
+def _sample_texts(tokenizer, n=256, seed=0):
+  """
+    short inputs the model can encode, decoded from random ids of its vocab
+  """
+  rng = random.Random(seed)
+  ids = list(tokenizer.vocab)
+  texts = []
+  for _ in range(n):
+    text = tokenizer.decode(rng.choices(ids, k=rng.randint(8, 64)))
+    texts.append(text if isinstance(text, str) else text.decode('utf-8', errors='replace'))
+  return texts
+
+async def load_test(models, n_requests, concurrency, server_args, path=None):
+  """
+    json summary of n_requests encodes sent by concurrency clients
+  """
+  server = TokenizerServer(models, **server_args)
+  await server.start(path=path)
+  host_port = {'path': path} if path is not None else {'host': server.address[0], 'port': server.address[1]}
+  texts = _sample_texts(models[server.default_model])
+  latencies, rejected, failed = [], 0, []
+  next_request = iter(range(n_requests))
+
+  async def worker():
+    nonlocal rejected
+    async with Client(**host_port) as client:
+      for i in next_request:
+        start = time.perf_counter()
+        try:
+          await client.encode(texts[i % len(texts)])
+          latencies.append(time.perf_counter() - start)
+        except Overloaded:
+          rejected += 1
+        except Exception as e:
+          failed.append(f"{type(e).__name__}: {e}")
+
+  start = time.perf_counter()
+  try:
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stats = server.stats()
+  finally:
+    await server.stop()
+  latencies.sort()
+  percentile = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None
+  return {
+    'requests': n_requests,
+    'concurrency': concurrency,
+    'seconds': elapsed,
+    'requests_per_second': len(latencies) / elapsed,
+    'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)},
+    'rejected': rejected,
+    'failed': len(failed),
+    'errors': sorted(set(failed))[:10],
+    'server': stats,
+  }
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--model', action='append', required=True, help="NAME=PATH of a '.bin' model, repeatable")
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--unix', help="listen on this unix socket instead of host:port")
+  parser.add_argument('--workers', type=int, help="processes in the pool, defaults to all cores, 0 for in-process")
+  parser.add_argument('--max-batch', type=int, default=64, help="requests per micro-batch")
+  parser.add_argument('--max-wait-ms', type=float, default=2.0, help="longest a request waits for its batch to fill")
+  parser.add_argument('--max-queue', type=int, default=1024, help="waiting requests before answering 503")
+  parser.add_argument('--load-test', type=int, metavar='N', help="send N requests in-process and print a json summary")
+  parser.add_argument('--concurrency', type=int, default=32, help="clients of the load test")
+  parser.add_argument('--out', help="also write the load test summary to this json file")
+  args = parser.parse_args(argv)
+
+  models = _parse_models(args.model)
+  server_args = {'num_workers': args.workers, 'max_batch_size': args.max_batch, 'max_wait_ms': args.max_wait_ms,
+                 'max_queue': args.max_queue}
+  unix = os.path.join(_CWD, args.unix) if args.unix else None
+  if args.load_test is None:
+    serve(models, args.host, args.port, unix, **server_args)
+    return 0
+  summary = asyncio.run(load_test(models, args.load_test, args.concurrency, server_args, unix))
+  print(json.dumps(summary, indent=2))
+  if args.out:
+    with open(os.path.join(_CWD, args.out), 'w') as f:
+      json.dump(summary, f, indent=2)
+  return 1 if summary['failed'] else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
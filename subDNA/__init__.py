@@ -1,4 +1,7 @@
 from .main import DNAtokenizer
 from .perChar import PerCharTokenizer
 from .kmer_bpe import KmerPairTokenizer
-from .kmer import KMerTokenizer
\ No newline at end of file
+from .kmer import KMerTokenizer
+from .packed import PackedSequence
+from .fasta import FastxReader, Record
+from .dataset import build_dataset, TokenDataset
@@ -0,0 +1,32 @@
+"""
+  batch encoding/decoding on a persistent process pool, shared with miniBPE
+  (see miniBPE/batch.py), plus per-record encoding of sequence files
+"""
+
+import os
+import itertools
+from miniBPE.batch import BatchMixin as _BatchMixin
+
+class BatchMixin(_BatchMixin):
+  """
+    encode_batch()/decode_batch() plus encode_records() for (name, sequence) records
+  """
+  def encode_records(self, records, num_workers=1, chunksize=1, out='numpy', **kwargs):
+    """
+      encodes every (name, sequence) record, e.g. a fasta.FastxReader, yields (name, ids)
+      in input order
+      - num_workers > 1 encodes on the process pool, num_workers * chunksize records are
+        read ahead at most, so memory stays bounded by a few records
+      - out and kwargs go to encode(), one numpy array per record by default
+    """
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    records = iter(records)
+    window = max(num_workers, 1) * chunksize
+    while True:
+      batch = list(itertools.islice(records, window))
+      if not batch:
+        break
+      names = [name for name, _ in batch]
+      encoded = self.encode_batch([sequence for _, sequence in batch], num_workers, chunksize, out=out, **kwargs)
+      del batch
+      yield from zip(names, encoded)
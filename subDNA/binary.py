@@ -0,0 +1,32 @@
+"""
+  binary format for the subDNA tokenizers, the format itself is shared with miniBPE
+  (see miniBPE/binary.py), this only converts the older model files
+"""
+
+def convert_model(kind, src, out_file=None, vocab_file=None):
+  """
+    converts an existing model into the binary format, returns the path of the written file
+      - kind='dna': DNAtokenizer '.model' file (eg. 'trained models/base_1k.model')
+      - kind='kmer': KMerTokenizer '.json' vocab (eg. 'trained models/base_5k.json')
+      - kind='kmer_pair': KmerPairTokenizer '.model' + vocab_file '.json' (eg. base_4mer.*)
+  """
+  from .main import DNAtokenizer
+  from .kmer import KMerTokenizer
+  from .kmer_bpe import KmerPairTokenizer
+  out_file = src.rsplit('.', 1)[0] + '.bin' if out_file is None else out_file
+  if kind == 'dna':
+    tokenizer = DNAtokenizer()
+    tokenizer.load_model(src)
+  elif kind == 'kmer':
+    tokenizer = KMerTokenizer()
+    tokenizer.load_model(src)
+    # the json vocab doesn't record k, it's the length of the longest k-mer
+    tokenizer.k_mers = max(len(token) for token in tokenizer.token_to_id)
+  elif kind == 'kmer_pair':
+    assert vocab_file is not None, "kmer_pair models need their '.json' vocab file"
+    tokenizer = KmerPairTokenizer()
+    tokenizer.load(src, vocab_file)
+  else:
+    raise ValueError(f"kind = {kind} not understood")
+  tokenizer.save_binary(out_file)
+  return out_file
@@ -0,0 +1,308 @@
+"""
+  dataset building: sharded, parallel pre-tokenization of sequence files into token shards
+  --> every input file is cut into byte ranges of about range_size bytes, a range starts at a
+      record ('>' header for fasta, '@' header followed by a '+' line two lines later for 4-line
+      fastq) or, for any other file, at a line, each record/line is one document
+  --> gzip files can't be cut and are one range each
+  --> a process pool encodes the ranges, each worker reads only its range and writes it
+      straight to shard_NNNNN.bin (raw token ids in one fixed dtype, read back with np.memmap)
+      and shard_NNNNN.json (source range, per-document names and token offsets), no tokens go
+      back through the parent, so memory is a range (or its largest record) per worker
+  --> the .bin is written under a temp name and renamed, the .json is written last: a restarted
+      build skips every shard whose .json matches its range, dtype and model fingerprint (a
+      hash of the tokenizer's model and the encode/reader args), shards left over from an
+      older plan are deleted, index.json lists all the shards
+  --> PerCharTokenizer gives new ids to unseen characters while encoding, every worker would
+      number them on its own, so it has to have seen every character before
+"""
+
+import os
+import re
+import gzip
+import json
+import hashlib
+import multiprocessing as mp
+import numpy as np
+from collections.abc import Mapping
+from .fasta import FastxReader
+
+_worker_args = None
+
+def _init_worker(*args):
+  global _worker_args
+  _worker_args = args
+
+def _detect(path):
+  """
+    (gzipped, kind) of a file, kind is 'fasta', 'fastq' or 'lines'
+  """
+  with open(path, 'rb') as f:
+    gzipped = f.read(2) == b"\x1f\x8b"
+  with (gzip.open if gzipped else open)(path, 'rb') as f:
+    for line in f:
+      if line.strip():
+        first = line[:1]
+        return gzipped, 'fasta' if first == b">" else 'fastq' if first == b"@" else 'lines'
+  return gzipped, 'lines'
+
+def _align(f, pos, kind):
+  """
+    start of the first record/line at or after byte pos (the file size if there is none)
+  """
+  if pos == 0:
+    return 0
+  # reading from pos - 1 skips the rest of the line pos is in, unless pos starts a line
+  f.seek(pos - 1)
+  f.readline()
+  window = []
+  while True:
+    start = f.tell()
+    line = f.readline()
+    if not line:
+      return start
+    if kind == 'lines' or (kind == 'fasta' and line.startswith(b">")):
+      return start
+    if kind == 'fastq':
+      window = (window + [(start, line)])[-3:]
+      # quality lines can start with '@' too, a header is followed by a '+' line two lines later
+      if len(window) == 3 and window[0][1].startswith(b"@") and window[2][1].startswith(b"+"):
+        return window[0][0]
+
+def plan_ranges(paths, range_size=64 << 20):
+  """
+    list of shard tasks, one per byte range of every file:
+      {'shard', 'source', 'kind', 'gzip', 'start', 'end', 'source_size', 'source_mtime'}
+  """
+  tasks = []
+  for path in paths:
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    gzipped, kind = _detect(path)
+    if gzipped:
+      bounds = [0, stat.st_size]
+    else:
+      with open(path, 'rb') as f:
+        bounds = sorted({_align(f, pos, kind) for pos in range(0, stat.st_size, range_size)} | {stat.st_size})
+    for start, end in zip(bounds, bounds[1:]):
+      tasks.append({'shard': len(tasks), 'source': path, 'kind': kind, 'gzip': gzipped, 'start': start,
+                    'end': end, 'source_size': stat.st_size, 'source_mtime': stat.st_mtime})
+  return tasks
+
+class _RangeFile:
+  """
+    readline() over bytes [start, end) of an open file
+  """
+  def __init__(self, f, start, end):
+    f.seek(start)
+    self.f = f
+    self.left = end - start
+
+  def readline(self, size=-1):
+    if self.left <= 0:
+      return b""
+    line = self.f.readline(self.left if size is None or size < 0 else min(size, self.left))
+    self.left -= len(line)
+    return line
+
+def _documents(task, reader_args):
+  """
+    yields (name, sequence) for every document of a task's range, name is None for lines
+  """
+  with (gzip.open if task['gzip'] else open)(task['source'], 'rb') as f:
+    source = f if task['gzip'] else _RangeFile(f, task['start'], task['end'])
+    if task['kind'] == 'lines':
+      for line in iter(source.readline, b""):
+        line = line.rstrip(b"\r\n")
+        if line:
+          yield None, line.decode('utf-8')
+    else:
+      yield from FastxReader(source, **reader_args)
+
+def _shard_paths(out_dir, shard):
+  prefix = os.path.join(out_dir, f"shard_{shard:05d}")
+  return prefix + ".bin", prefix + ".json"
+
+def _json_default(value):
+  return sorted(value) if isinstance(value, (set, frozenset)) else repr(value)
+
+def _plain(value):
+  """
+    value with numpy scalars/arrays as python ones and mappings as sorted item lists
+  """
+  if isinstance(value, Mapping):
+    return sorted((repr(_plain(key)), _plain(item)) for key, item in value.items())
+  if isinstance(value, (list, tuple)):
+    return [_plain(item) for item in value]
+  if isinstance(value, (np.generic, np.ndarray)):
+    return value.tolist()
+  return value
+
+def _fingerprint(tokenizer, encode_args=None, reader_args=None):
+  """
+    sha256 of the tokenizer's model (its public attributes, vocab/merges/k/...) and of the
+    encode/reader args
+  """
+  h = hashlib.sha256(type(tokenizer).__name__.encode('utf-8'))
+  # merges are a property on tokenizers that load them lazily
+  names = set(vars(tokenizer))
+  names.update(name for cls in type(tokenizer).__mro__ for name, attr in vars(cls).items() if isinstance(attr, property))
+  for name in sorted(names):
+    if not name.startswith('_'):
+      h.update(repr((name, _plain(getattr(tokenizer, name)))).encode('utf-8'))
+  h.update(json.dumps([encode_args or {}, reader_args or {}], sort_keys=True, default=_json_default).encode('utf-8'))
+  return h.hexdigest()
+
+def _spec(task, dtype, tokenizer, model):
+  return {**task, 'dtype': np.dtype(dtype).name, 'tokenizer': type(tokenizer).__name__, 'model': model}
+
+def _write_shard(tokenizer, task, out_dir, dtype, encode_args, reader_args, model):
+  """
+    encodes one range into its .bin/.json pair, returns the shard's json entry
+  """
+  bin_path, json_path = _shard_paths(out_dir, task['shard'])
+  names, offsets = [], [0]
+  with open(bin_path + '.tmp', 'wb') as f:
+    for name, sequence in _documents(task, reader_args):
+      ids = np.asarray(tokenizer.encode(sequence, out='numpy', dtype=dtype, **encode_args), dtype=dtype)
+      f.write(ids.tobytes())
+      names.append(name)
+      offsets.append(offsets[-1] + len(ids))
+  os.replace(bin_path + '.tmp', bin_path)
+  entry = {**_spec(task, dtype, tokenizer, model), 'path': os.path.basename(bin_path), 'n_tokens': offsets[-1],
+           'offsets': offsets}
+  if task['kind'] != 'lines':
+    entry['names'] = names
+  with open(json_path + '.tmp', 'w') as f:
+    json.dump(entry, f)
+  os.replace(json_path + '.tmp', json_path)
+  return entry
+
+def _shard_task(task):
+  tokenizer, out_dir, dtype, encode_args, reader_args, model = _worker_args
+  return _write_shard(tokenizer, task, out_dir, dtype, encode_args, reader_args, model)
+
+def _finished(task, out_dir, dtype, tokenizer, model):
+  """
+    the shard's json entry if a previous run already wrote this exact range, else None
+  """
+  bin_path, json_path = _shard_paths(out_dir, task['shard'])
+  if not (os.path.exists(json_path) and os.path.exists(bin_path)):
+    return None
+  with open(json_path, 'r') as f:
+    entry = json.load(f)
+  spec = _spec(task, dtype, tokenizer, model)
+  if any(entry.get(key) != value for key, value in spec.items()):
+    return None
+  if os.path.getsize(bin_path) != entry['n_tokens'] * np.dtype(dtype).itemsize:
+    return None
+  return entry
+
+def _remove_stale(out_dir, n_shards):
+  """
+    deletes the shards (and half-written temp files) of an older plan with more shards
+  """
+  for name in os.listdir(out_dir):
+    match = re.fullmatch(r"shard_(\d+)\.(bin|json)(\.tmp)?", name)
+    if match and (match.group(3) or int(match.group(1)) >= n_shards):
+      os.remove(os.path.join(out_dir, name))
+
+def build_dataset(tokenizer, paths, out_dir, num_workers=None, range_size=64 << 20, dtype=None,
+                  encode_args=None, reader_args=None):
+  """
+    pre-tokenizes every file in paths into token shards in out_dir, returns the index
+      - tokenizer: any subDNA tokenizer, pickled once per worker
+      - num_workers: processes in the pool, defaults to all cores, 1 runs in-process
+      - range_size: bytes per range (= per shard) before aligning to records/lines
+      - dtype: of the token ids in every shard, defaults to the one encode() picks for the vocab
+      - encode_args: extra kwargs for encode(), eg. {'unknown': 'skip'}
+      - reader_args: FastxReader normalisation (case=, ambiguous=) for fasta/fastq files, the
+        defaults suit every tokenizer, DNAtokenizer reads each run of 'N' as one '\n'
+  """
+  encode_args = dict(encode_args or {})
+  reader_args = dict(reader_args or {})
+  dtype = np.dtype(tokenizer.encode("", out='numpy').dtype if dtype is None else dtype)
+  os.makedirs(out_dir, exist_ok=True)
+  tasks = plan_ranges([paths] if isinstance(paths, (str, os.PathLike)) else paths, range_size)
+  model = _fingerprint(tokenizer, encode_args, reader_args)
+  _remove_stale(out_dir, len(tasks))
+
+  entries = {}
+  pending = []
+  for task in tasks:
+    entry = _finished(task, out_dir, dtype, tokenizer, model)
+    if entry is None:
+      pending.append(task)
+    else:
+      entries[task['shard']] = entry
+
+  num_workers = os.cpu_count() if num_workers is None else num_workers
+  progress = tokenizer.instrument.progress
+  if num_workers <= 1 or len(pending) <= 1:
+    for task in progress(pending, total=len(pending), desc="encoding shards"):
+      entries[task['shard']] = _write_shard(tokenizer, task, out_dir, dtype, encode_args, reader_args, model)
+  else:
+    args = (tokenizer, out_dir, dtype, encode_args, reader_args, model)
+    with mp.Pool(min(num_workers, len(pending)), initializer=_init_worker, initargs=args) as pool:
+      for entry in progress(pool.imap_unordered(_shard_task, pending), total=len(pending), desc="encoding shards"):
+        entries[entry['shard']] = entry
+
+  index = {
+    'dtype': dtype.name,
+    'tokenizer': type(tokenizer).__name__,
+    'model': model,
+    'n_tokens': sum(entry['n_tokens'] for entry in entries.values()),
+    'n_documents': sum(len(entry['offsets']) - 1 for entry in entries.values()),
+    'shards': [{key: entries[task['shard']][key] for key in ('path', 'source', 'start', 'end', 'n_tokens')}
+               for task in tasks],
+  }
+  with open(os.path.join(out_dir, 'index.json.tmp'), 'w') as f:
+    json.dump(index, f, indent=2)
+  os.replace(os.path.join(out_dir, 'index.json.tmp'), os.path.join(out_dir, 'index.json'))
+  return index
+
+class TokenDataset:
+  """
+    read side of build_dataset(): shards are mapped with np.memmap, nothing is loaded up front
+  """
+  def __init__(self, out_dir):
+    self.out_dir = out_dir
+    with open(os.path.join(out_dir, 'index.json'), 'r') as f:
+      self.index = json.load(f)
+    self.dtype = np.dtype(self.index['dtype'])
+    self._documents = {}
+
+  def __len__(self):
+    return self.index['n_tokens']
+
+  @property
+  def n_shards(self):
+    return len(self.index['shards'])
+
+  def shard(self, i):
+    """
+      token ids of shard i as a read-only np.memmap
+    """
+    entry = self.index['shards'][i]
+    if entry['n_tokens'] == 0:
+      return np.empty(0, dtype=self.dtype)
+    return np.memmap(os.path.join(self.out_dir, entry['path']), dtype=self.dtype, mode='r', shape=(entry['n_tokens'],))
+
+  def documents(self, i):
+    """
+      (names, offsets) of the documents in shard i, names are None for line documents
+    """
+    if i not in self._documents:
+      with open(os.path.join(self.out_dir, self.index['shards'][i]['path'][:-len('.bin')] + '.json'), 'r') as f:
+        entry = json.load(f)
+      self._documents[i] = (entry.get('names', [None] * (len(entry['offsets']) - 1)), entry['offsets'])
+    return self._documents[i]
+
+  def __iter__(self):
+    """
+      yields (name, ids) for every document in shard order, ids are views on the memmap
+    """
+    for i in range(self.n_shards):
+      tokens = self.shard(i)
+      names, offsets = self.documents(i)
+      for name, start, end in zip(names, offsets, offsets[1:]):
+        yield name, tokens[start:end]
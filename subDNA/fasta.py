@@ -0,0 +1,182 @@
+"""
+  streaming FASTA/FASTQ reader, plain or gzip (detected from the magic bytes, not the name)
+  --> the file is read in pieces of at most block_size bytes, records come out as
+      (record no, name, block) with blocks of at most block_size bases, so a record is only
+      fully in memory when it's asked for as one string (iterating the reader, sequences())
+  --> bases are normalised while reading:
+        - case: 'upper' unmasks soft-masked (lowercase) bases, 'keep' leaves them as they are
+        - ambiguous: IUPAC ambiguity codes and gaps become 'N' (default) or any other single
+          character, 'drop' removes them, 'keep' leaves them
+  --> a FastxReader can be passed straight to DNAtokenizer.train()/encode(),
+      KMerTokenizer.build_vocab(), KmerPairTokenizer.train_tokenizer() and to
+      encode_records() of any tokenizer for per-record ids, DNAtokenizer has no 'N' and reads
+      every run of ambiguity codes as one '\n' (like a record break), 'drop' would join the bases
+      on both sides of a gap instead
+"""
+
+import gzip
+import itertools
+from collections import namedtuple
+from .packed import _Packer
+
+Record = namedtuple('Record', ['name', 'sequence'])
+
+# IUPAC ambiguity codes and gaps
+AMBIGUOUS = b"RYSWKMBDHVN-."
+
+def _normaliser(case, ambiguous):
+  """
+    (translation table, bytes to delete) for bytes.translate()
+  """
+  table = bytearray(range(256))
+  if case == 'upper':
+    for c in range(ord('a'), ord('z') + 1):
+      table[c] = c - 32
+  delete = b""
+  if ambiguous == 'drop':
+    delete = AMBIGUOUS + AMBIGUOUS.lower()
+  elif ambiguous != 'keep':
+    code = ord(ambiguous)
+    for c in AMBIGUOUS:
+      table[c] = code
+      table[ord(chr(c).lower())] = code if case == 'upper' else ord(ambiguous.lower())
+  return bytes(table), delete
+
+def _read_pieces(source, block_size):
+  """
+    yields the lines of the file, lines longer than block_size in several pieces
+  """
+  if hasattr(source, 'readline'):
+    while True:
+      piece = source.readline(block_size)
+      if not piece:
+        break
+      yield piece.encode('latin-1') if isinstance(piece, str) else piece
+    return
+  with open(source, 'rb') as f:
+    gzipped = f.read(2) == b"\x1f\x8b"
+  with (gzip.open if gzipped else open)(source, 'rb') as f:
+    yield from _read_pieces(f, block_size)
+
+def _record_name(header):
+  words = header[1:].split(maxsplit=1)
+  return words[0].decode('utf-8', errors='replace') if words else ""
+
+def _parse(pieces):
+  """
+    yields (name, None) at the start of every record and (None, bases) for its sequence
+      - fasta: '>' header, sequence lines up to the next header
+      - fastq: '@' header, sequence lines up to the '+' line, then quality lines until
+        they are as long as the sequence (quality lines may start with '@' too)
+  """
+  state, fastq, at_start = None, False, True
+  header, seq_len, qual_len = b"", 0, 0
+  for piece in pieces:
+    line_start, at_start = at_start, piece.endswith(b"\n")
+    if line_start:
+      kind = piece[:1]
+      if state == 'qual' and qual_len >= seq_len:
+        state = None
+      if state is None and not piece.strip():
+        continue
+      if (state is None and kind in (b">", b"@")) or (state == 'seq' and not fastq and kind == b">"):
+        fastq = kind == b"@"
+        state, header, seq_len, qual_len = 'name', b"", 0, 0
+      elif state == 'seq' and fastq and kind == b"+":
+        state = 'plus'
+      elif state is None:
+        raise ValueError(f"expected a '>' or '@' header line, got {piece[:32]!r}")
+
+    if state == 'name':
+      header += piece
+      if at_start:
+        yield _record_name(header), None
+        state = 'seq'
+    elif state == 'seq':
+      bases = piece.rstrip(b"\r\n")
+      seq_len += len(bases)
+      yield None, bases
+    elif state == 'plus':
+      if at_start:
+        state = 'qual'
+    elif state == 'qual':
+      qual_len += len(piece.rstrip(b"\r\n"))
+  if state in ('plus', 'qual') and qual_len != seq_len:
+    raise ValueError("truncated fastq record, quality is shorter than the sequence")
+
+class FastxReader:
+  def __init__(self, source, block_size=1 << 20, case='upper', ambiguous='N'):
+    """
+      - source: path of a .fa/.fasta/.fq/.fastq file (gzipped or not) or an open file,
+        an open file can only be read once
+      - block_size: max no of bases per block (and bytes per read)
+      - case, ambiguous: normalisation, see the top of this file
+    """
+    assert case in ('upper', 'keep'), f"case = {case} not understood"
+    assert ambiguous in ('keep', 'drop') or len(ambiguous) == 1, f"ambiguous = {ambiguous} not understood"
+    self.source = source
+    self.block_size = block_size
+    self.case = case
+    self.ambiguous = ambiguous
+    self._table, self._delete = _normaliser(case, ambiguous)
+
+  def iter_blocks(self, multiple=1):
+    """
+      yields (record no, name, block) for every record in file order
+        - block sizes are rounded down to a multiple of `multiple` (e.g. k for k-mers), only
+          the last block of a record can be shorter
+        - a record without bases gives one empty block
+    """
+    size = max(self.block_size // multiple, 1) * multiple
+    record, name, buf, emitted = -1, None, bytearray(), False
+    for new_name, bases in _parse(_read_pieces(self.source, self.block_size)):
+      if new_name is not None:
+        if record >= 0 and (buf or not emitted):
+          yield record, name, buf.decode('latin-1')
+        record, name, buf, emitted = record + 1, new_name, bytearray(), False
+        continue
+      buf += bases.translate(self._table, self._delete)
+      if len(buf) >= size:
+        n_full = len(buf) // size * size
+        for i in range(0, n_full, size):
+          yield record, name, buf[i:i+size].decode('latin-1')
+        del buf[:n_full]
+        emitted = True
+    if record >= 0 and (buf or not emitted):
+      yield record, name, buf.decode('latin-1')
+
+  def records(self, multiple=1):
+    """
+      yields (name, blocks) per record, blocks is an iterator that has to be consumed
+      before moving on to the next record (like itertools.groupby)
+    """
+    for _, group in itertools.groupby(self.iter_blocks(multiple), key=lambda item: item[0]):
+      first = next(group)
+      yield first[1], itertools.chain([first[2]], (block for _, _, block in group))
+
+  def __iter__(self):
+    """
+      yields Record(name, sequence) with the whole sequence of every record
+    """
+    for name, blocks in self.records():
+      yield Record(name, "".join(blocks))
+
+  def sequences(self):
+    for record in self:
+      yield record.sequence
+
+  def pack(self, separator="\n"):
+    """
+      every record's sequence joined by separator as one 2-bit PackedSequence, built block
+      by block
+    """
+    packer = _Packer()
+    for i, (_, blocks) in enumerate(self.records()):
+      if i and separator:
+        packer.add(separator)
+      for block in blocks:
+        packer.add(block)
+    return packer.finish()
+
+  def __repr__(self):
+    return f"FastxReader({self.source!r}, block_size={self.block_size}, case={self.case!r}, ambiguous={self.ambiguous!r})"
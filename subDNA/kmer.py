@@ -1,51 +1,338 @@
-from tqdm import tqdm
+import numpy as np
 import json
+from .batch import BatchMixin
+from .packed import PackedSequence
+from .fasta import FastxReader
+from miniBPE.binary import save_binary_model, load_binary_model
+from miniBPE.idarray import as_ids, as_list
+from miniBPE.instrument import NULL
 
-class KMerTokenizer:
-  def __init__(self, k_mers: int=4):
+# 2-bit code of every base, -1 for anything else (newlines, N, lowercase, ...)
+_BASE_CODES = np.full(256, -1, dtype=np.int8)
+for _code, _base in enumerate(b"ACGT"):
+  _BASE_CODES[_base] = _code
+
+# largest k that gets a dense 4^k lookup table (4^12 ids = 64 MB)
+_MAX_TABLE_K = 12
+# strings are cut into blocks of this many bases, bounds the temporary arrays
+_BLOCK_SIZE = 1 << 20
+_UNSEEN = np.iinfo(np.int64).max
+
+# complement of every base, anything else is left as it is
+_COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+
+def _revcomp_codes(codes, k):
+  """
+    reverse complement of 2-bit packed k-mer codes (A=0, C=1, G=2, T=3):
+      - complement: xor 3 flips every base
+      - reverse: swap the 2-bit groups, then the nibbles, then the bytes, and shift the k
+        bases back down
+    lexicographic order of k-mers is the numeric order of their codes, so the canonical
+    k-mer is np.minimum(codes, _revcomp_codes(codes, k))
+  """
+  x = codes.astype(np.uint64) ^ np.uint64((1 << 2 * k) - 1)
+  x = ((x >> np.uint64(2)) & _M2) | ((x & _M2) << np.uint64(2))
+  x = ((x >> np.uint64(4)) & _M4) | ((x & _M4) << np.uint64(4))
+  return (x.byteswap() >> np.uint64(64 - 2 * k)).astype(np.int64)
+
+class KMerTokenizer(BatchMixin):
+  # timers/counters/progress bars, see miniBPE/instrument.py
+  instrument = NULL
+
+  def __init__(self, k_mers: int=4, stride: int=None, canonical: bool=False):
+    """
+      - stride: distance between the starts of consecutive k-mers, 1..k_mers, defaults to
+        k_mers (non-overlapping), can be changed per call in build_vocab()/encode()/decode()
+      - canonical: a k-mer and its reverse complement share one id, the one of the smaller
+        of the two, which about halves the vocab, encode(strands=True) returns which of the
+        two was seen so decode() can give back the original sequence
+    """
+    assert stride is None or 1 <= stride <= k_mers, f"stride must be in 1..{k_mers}"
     self.k_mers = k_mers
+    self.stride = k_mers if stride is None else stride
+    self.canonical = canonical
     self.vocab = {}
     self.id_to_token = []
     self.token_to_id = {}
+    self._code_table = None
+
+  def _stride(self, stride):
+    stride = self.stride if stride is None else stride
+    assert 1 <= stride <= self.k_mers, f"stride must be in 1..{self.k_mers}"
+    return stride
+
+  def _kmer_code(self, kmer):
+    code = 0
+    for base in kmer.encode('ascii'):
+      code = code * 4 + int(_BASE_CODES[base])
+    return code
+
+  def _code_kmer(self, code):
+    return "".join("ACGT"[(code >> 2 * (self.k_mers - 1 - j)) & 3] for j in range(self.k_mers))
+
+  def _canonical_kmer(self, kmer):
+    """
+      (canonical k-mer, strand), strand is 1 when the canonical one is the reverse complement,
+      symbols other than A/C/G/T/N are kept as they are
+    """
+    rc = kmer.translate(_COMPLEMENT)[::-1]
+    return (rc, 1) if rc < kmer else (kmer, 0)
+
+  def _build_code_table(self):
+    """
+      dense table from the 2-bit packed code of every A/C/G/T k-mer to its id, -1 if not in vocab
+      canonical: the reverse complement of every token maps to the same id, so encode() needs
+      no canonicalisation unless it returns strands
+    """
+    table = np.full(4 ** self.k_mers, -1, dtype=np.int64)
+    for token, idx in self.token_to_id.items():
+      if len(token) == self.k_mers and token.isascii() and all(_BASE_CODES[b] >= 0 for b in token.encode('ascii')):
+        table[self._kmer_code(token)] = idx
+    if self.canonical:
+      codes = np.flatnonzero(table >= 0)
+      table[_revcomp_codes(codes, self.k_mers)] = table[codes]
+    self._code_table = table
 
-  def tokenize_sequence(self, sequence):
-    kmers = [sequence[i:i+self.k_mers] for i in tqdm(range(0, len(sequence), self.k_mers), desc="tokenizing k-mers")]
+  def tokenize_sequence(self, sequence, stride=None):
+    """
+      k-mers starting every stride bases, until one reaches the end of the sequence (so the
+      last one can be shorter than k_mers)
+    """
+    k, stride = self.k_mers, self._stride(stride)
+    n_kmers = (max(len(sequence) - k, 0) + stride - 1) // stride + 1 if len(sequence) else 0
+    kmers = [sequence[i:i+k] for i in self.instrument.progress(range(0, n_kmers * stride, stride), desc="tokenizing k-mers")]
     return kmers
 
-  def build_vocab(self, sequences):
-    all_kmers = []
-    for sequence in sequences:
-      all_kmers.extend(self.tokenize_sequence(sequence))
-    token_count = {}
-    for kmer in all_kmers:
-      if kmer in token_count:
-        token_count[kmer] += 1
-      else:
-        token_count[kmer] = 1
-    sorted_tokens = sorted(token_count.items(), key=lambda x: x[1], reverse=True)
-    for token, _ in sorted_tokens:
-      self.token_to_id[token] = len(self.token_to_id)
-      self.id_to_token.append(token)
+  def _blocks(self, sequence):
+    if isinstance(sequence, PackedSequence):
+      return sequence.iter_blocks(_BLOCK_SIZE)
+    if isinstance(sequence, str):
+      return (sequence[i:i+_BLOCK_SIZE] for i in range(0, len(sequence), _BLOCK_SIZE))
+    return sequence
+
+  def _window_codes(self, text, n_windows, stride):
+    """
+      2-bit packed code of the k-mers starting at 0, stride, 2*stride, ... in text, -1 for the
+      ones holding a non-ACGT symbol
+        - code = (code << 2) | base, k strided passes over the block, pass j shifts in
+          base j of every window at once
+    """
+    k = self.k_mers
+    if text.isascii():
+      bases = _BASE_CODES.take(np.frombuffer(text.encode('ascii'), dtype=np.uint8))
+    else:
+      points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+      bases = np.where(points < 128, _BASE_CODES.take(np.minimum(points, 127)), -1).astype(np.int8)
+    span = (n_windows - 1) * stride + 1
+    codes = np.zeros(n_windows, dtype=np.int64)
+    for j in range(k):
+      codes <<= 2
+      codes |= bases[j:j+span:stride]
+    invalid = bases < 0
+    if invalid.any():
+      n_invalid = np.concatenate(([0], np.cumsum(invalid)))
+      codes[n_invalid[k:k+span:stride] != n_invalid[:span:stride]] = -1
+    return codes
+
+  def _windows(self, blocks, stride):
+    """
+      k-mers of one sequence given as consecutive blocks of text, same k-mers as
+      tokenize_sequence() over the whole of it, yields (text, codes) per block:
+        - codes[j] is the 2-bit code of text[j*stride:j*stride+k], -1 if that k-mer has to go
+          through the dict (non-ACGT symbols, the shorter last k-mer)
+        - less than k bases are carried over from one block to the next
+    """
+    k = self.k_mers
+    carry, emitted = "", False
+    for block in blocks:
+      text = carry + block
+      n_windows = (len(text) - k) // stride + 1 if len(text) >= k else 0
+      if n_windows:
+        with self.instrument.timer('pretokenize'):
+          codes = self._window_codes(text, n_windows, stride)
+        yield text, codes
+        emitted = True
+      carry = text[n_windows * stride:]
+    # shorter last k-mer, unless the last full one already reached the end
+    if len(carry) > (k - stride if emitted else 0):
+      yield carry, np.full(1, -1, dtype=np.int64)
+
+  def build_vocab(self, sequences, stride=None):
+    """
+      - sequences: iterable of strings/PackedSequences or a FastxReader (k-mers never span
+        two records)
+      - stride: see __init__(), defaults to self.stride
+      - ids are given by count, ties by first appearance
+      - canonical: only canonical k-mers get ids, a k-mer is counted as its canonical one
+      - k <= 12: A/C/G/T k-mers are counted by their 2-bit code in a dense 4^k array, so memory
+        doesn't grow with the sequences, only the rare other k-mers go into a dict, each block
+        is added into it in place (np.add.at) instead of through a second 4^k array
+    """
+    k, stride = self.k_mers, self._stride(stride)
+    if isinstance(sequences, FastxReader):
+      sequences = (blocks for _, blocks in sequences.records())
+    if k > _MAX_TABLE_K:
+      token_count = {}
+      for sequence in sequences:
+        if not isinstance(sequence, str):
+          sequence = "".join(self._blocks(sequence))
+        for kmer in self.tokenize_sequence(sequence, stride):
+          if self.canonical:
+            kmer = self._canonical_kmer(kmer)[0]
+          token_count[kmer] = token_count.get(kmer, 0) + 1
+      sorted_tokens = [token for token, _ in sorted(token_count.items(), key=lambda x: x[1], reverse=True)]
+    else:
+      counts = np.zeros(4 ** k, dtype=np.int64)
+      first = np.full(4 ** k, _UNSEEN, dtype=np.int64)
+      others = {}
+      pos = 0
+      for sequence in self.instrument.progress(sequences, desc="counting k-mers"):
+        for text, codes in self._windows(self._blocks(sequence), stride):
+          valid = codes >= 0
+          kept = codes[valid]
+          if self.canonical:
+            kept = np.minimum(kept, _revcomp_codes(kept, k))
+          np.add.at(counts, kept, 1)
+          new = first[kept] == _UNSEEN
+          if new.any():
+            new_codes, at = np.unique(kept[new], return_index=True)
+            first[new_codes] = pos + np.flatnonzero(valid)[np.flatnonzero(new)[at]]
+          for j in np.flatnonzero(~valid).tolist():
+            kmer = text[j*stride:j*stride+k]
+            if self.canonical:
+              kmer = self._canonical_kmer(kmer)[0]
+            entry = others.setdefault(kmer, [0, pos + j])
+            entry[0] += 1
+          pos += len(codes)
+      seen = np.flatnonzero(counts).tolist()
+      items = [(int(counts[code]), int(first[code]), self._code_kmer(code)) for code in seen]
+      items.extend((n, at, kmer) for kmer, (n, at) in others.items())
+      items.sort(key=lambda item: (-item[0], item[1]))
+      sorted_tokens = [token for _, _, token in items]
+    # built locally and set once, so the WatchedDict (see batch.py) isn't notified per token
+    token_to_id, id_to_token = dict(self.token_to_id), list(self.id_to_token)
+    for token in sorted_tokens:
+      token_to_id[token] = len(token_to_id)
+      id_to_token.append(token)
+    self.token_to_id, self.id_to_token = token_to_id, id_to_token
     self.vocab = self.token_to_id
+    self._code_table = None
+
+  def _lookup(self, kmer, unknown):
+    if self.canonical:
+      kmer = self._canonical_kmer(kmer)[0]
+    if kmer in self.token_to_id:
+      return self.token_to_id[kmer]
+    if unknown == 'raise':
+      raise KeyError(f"k-mer {kmer!r} is not in the vocab")
+    if unknown in ('skip', 'stop'):
+      return None
+    return unknown
+
+  def encode(self, sequence, unknown='stop', out='list', dtype=None, stride=None, strands=False):
+    """
+      - splits the sequence into k-mers every stride bases (see tokenize_sequence()) and maps
+        each one to its id
+      - k-mers of A/C/G/T are packed 2 bits per base (k strided passes per block, see
+        _window_codes()) and looked up in a dense table in one vectorized pass, anything else (newlines, the
+        shorter last k-mer) goes through the dict
+      - unknown: what to do with a k-mer that isn't in the vocab
+          'stop' -> the ids end before it, like a sequence whose length isn't a multiple of
+          k_mers usually ends with a shorter k-mer the vocab doesn't have
+          'raise' -> KeyError, 'skip' -> leave it out, an integer -> use that id
+      - out: 'list', 'array' (array.array) or 'numpy', the ids of the vectorized pass are
+        converted straight from the numpy array, see miniBPE/idarray.py
+      - dtype: element type of array/numpy outputs, defaults to the smallest that fits the vocab
+      - stride: see __init__(), defaults to self.stride
+      - strands: canonical only, returns (ids, strands), strands[i] is 1 when k-mer i was
+        the reverse complement of its token, as a uint8 list/array/numpy array
+    """
+    assert not strands or self.canonical, "strands are only kept by canonical tokenizers"
+    k, stride = self.k_mers, self._stride(stride)
+    n_ids = len(self.id_to_token)
+    inst = self.instrument
+    if k > _MAX_TABLE_K:
+      with inst.timer('lookup'):
+        kmers = self.tokenize_sequence(str(sequence), stride)
+        encoded_sequence = [self._lookup(kmer, unknown) for kmer in kmers]
+        if unknown == 'stop' and None in encoded_sequence:
+          kmers = kmers[:encoded_sequence.index(None)]
+          encoded_sequence = encoded_sequence[:len(kmers)]
+      if inst.enabled:
+        inst.count('bases_in', len(sequence))
+        inst.count('dict_lookups', len(encoded_sequence))
+      ids = as_ids([idx for idx in encoded_sequence if idx is not None], out, n_ids, dtype)
+      if strands:
+        flags = [self._canonical_kmer(kmer)[1] for kmer, idx in zip(kmers, encoded_sequence) if idx is not None]
+        return ids, as_ids(flags, out, 2, np.uint8)
+      return ids
 
-  def encode(self, sequence):
-    encoded_sequence = []
-    kmers = self.tokenize_sequence(sequence)
-    for kmer in tqdm(kmers, desc="encoding sequences"):
-      if kmer in self.token_to_id:
-        encoded_sequence.append(self.token_to_id[kmer])
-      else:
+    if self._code_table is None:
+      self._build_code_table()
+    parts, strand_parts, n_lookups = [], [], 0
+    for text, codes in self._windows(self._blocks(sequence), stride):
+      with inst.timer('lookup'):
+        ids = self._code_table.take(np.maximum(codes, 0))
+        ids[codes < 0] = -1
+        if strands:
+          flags = (codes > _revcomp_codes(codes, k)).astype(np.uint8)
+        # skipped k-mers are marked None -> -1 and dropped at the end
+        lookups = np.flatnonzero(ids < 0).tolist()
+        for j in lookups:
+          kmer = text[j*stride:j*stride+k]
+          idx = self._lookup(kmer, unknown)
+          ids[j] = -1 if idx is None else idx
+          if strands:
+            flags[j] = self._canonical_kmer(kmer)[1]
+        n_lookups += len(lookups)
+      stop = np.flatnonzero(ids < 0)[:1] if unknown == 'stop' else ()
+      if len(stop):
+        ids = ids[:stop[0]]
+        if strands:
+          flags = flags[:stop[0]]
+      parts.append(ids)
+      if strands:
+        strand_parts.append(flags)
+      if len(stop):
         break
-    return encoded_sequence
+    ids = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+    if strands:
+      flags = np.concatenate(strand_parts) if strand_parts else np.empty(0, dtype=np.uint8)
+    if unknown == 'skip':
+      keep = ids >= 0
+      ids = ids[keep]
+      if strands:
+        flags = flags[keep]
+    if inst.enabled:
+      inst.count('bases_in', len(sequence))
+      inst.count('dict_lookups', n_lookups)
+      inst.count('tokens_out', len(ids))
+    if strands:
+      return as_ids(ids, out, n_ids, dtype), as_ids(flags, out, 2, np.uint8)
+    return as_ids(ids, out, n_ids, dtype)
 
-  def decode(self, encoded_sequence):
+  def decode(self, encoded_sequence, stride=None, strands=None):
+    """
+      - overlapping k-mers (stride < k_mers) are stitched back together, every k-mer after the
+        first adds its last stride bases
+      - strands: from encode(strands=True), tokens flagged 1 are reverse complemented, without
+        them a canonical tokenizer decodes to the canonical k-mers
+    """
+    skip = self.k_mers - self._stride(stride)
+    flags = as_list(strands) if strands is not None else None
     decoded_tokens = []
-    for token_id in encoded_sequence:
-      if token_id < len(self.id_to_token):
-        decoded_tokens.append(self.id_to_token[token_id])
-      else:
-        break
-    return ''.join(decoded_tokens)
+    with self.instrument.timer('decode'):
+      for i, token_id in enumerate(as_list(encoded_sequence)):
+        if token_id < len(self.id_to_token):
+          token = self.id_to_token[token_id]
+          if flags is not None and flags[i]:
+            token = token.translate(_COMPLEMENT)[::-1]
+          decoded_tokens.append(token[skip:] if decoded_tokens else token)
+        else:
+          break
+      return ''.join(decoded_tokens)
   
   def save_model(self, model_path):
     vocab_file = f"{model_path}/base_{self.k_mers}k.json"
@@ -53,7 +340,29 @@ class KMerTokenizer:
       json.dump(self.vocab, f)
     print("saved the vocab!")
 
+  def save_binary(self, path):
+    """
+      saves the vocab as one binary '.bin' file (see miniBPE/binary.py), loads with load_model()
+    """
+    vocab = {idx: token for token, idx in self.token_to_id.items()}
+    save_binary_model(path, {}, vocab, meta={'tokenizer': 'kmer', 'k_mers': self.k_mers, 'stride': self.stride,
+                                             'canonical': self.canonical})
+
+  def load_binary(self, path):
+    model = load_binary_model(path)
+    assert model.meta.get('tokenizer') == 'kmer', f"{path} was not saved by KMerTokenizer"
+    self.k_mers = model.meta['k_mers']
+    self.stride = model.meta.get('stride', self.k_mers)
+    self.canonical = model.meta.get('canonical', False)
+    self.id_to_token = model.vocab.tokens()
+    self.token_to_id = {token: idx for idx, token in enumerate(self.id_to_token)}
+    self.vocab = self.token_to_id
+    self.vocab_size = len(self.vocab)
+    self._code_table = None
+
   def load_model(self, path):
+    if path.endswith('.bin'):
+      return self.load_binary(path)
     assert path.endswith('.json')
     with open(path, 'r') as f:
       vocab = json.load(f)
@@ -65,4 +374,5 @@ class KMerTokenizer:
 
     self.id_to_token = [None] * self.vocab_size
     for token, idx in self.vocab.items():
-        self.id_to_token[idx] = token
\ No newline at end of file
+        self.id_to_token[idx] = token
+    self._code_table = None
\ No newline at end of file
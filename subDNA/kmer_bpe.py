@@ -2,19 +2,34 @@ import os
 current_dir = os.path.dirname(os.path.realpath(__file__))
 os.chdir(current_dir)
 
-from tqdm import tqdm
 import json
+import numpy as np
+from .batch import BatchMixin
+from .fasta import FastxReader
+from miniBPE.binary import save_binary_model, load_binary_model, BinaryVocab
+from miniBPE.idarray import as_ids, as_list
+from miniBPE.instrument import NULL
+from miniBPE.encoder import merge_ids
+
+# k-mers up to this long are packed into one uint64 (a byte per symbol) for the vectorized lookup
+_MAX_PACKED_K = 8
+
+class KmerPairTokenizer(BatchMixin):
+  # timers/counters/progress bars, see miniBPE/instrument.py
+  instrument = NULL
 
-class KmerPairTokenizer:
   def __init__(self):
     self.k_mers = 4
     self.vocab = {}
     self.merges = {}
     self.vocab_size = 0
     self.init_vocab = {"\n": 1, "A": 2, "T": 3, "G": 4, "C": 5, "P": 6, "M": 7, "U": 8, " ": 9}
+    # k-mer -> base id, fixed by training, saved as the vocab entries no merge produced
+    self.kmer_to_id = {}
+    self._code_table = None
   
   def _tokenize_seq(self, sequence):
-    kmers = [sequence[i:i+self.k_mers] for i in tqdm(range(0, len(sequence), self.k_mers), desc="tokenizing k-mers")]
+    kmers = [sequence[i:i+self.k_mers] for i in self.instrument.progress(range(0, len(sequence), self.k_mers), desc="tokenizing k-mers")]
     return kmers
   
   def _get_stats(self, ids, counts=None):
@@ -45,6 +60,10 @@ class KmerPairTokenizer:
     return new_ids
   
   def get_ids(self, data):
+    """
+      numbers the k-mers of data in order of first appearance from 1, only used for training,
+      encode() maps k-mers through the kmer_to_id table learned here
+    """
     all_kmers = []
     seq_to_no = {}
     ass_no = []
@@ -62,15 +81,18 @@ class KmerPairTokenizer:
     return ass_no, seq_to_no
 
   def train_tokenizer(self, data: str, max_vocab: int):
+    """
+      - data: dna string or a FastxReader, k-mers are cut per record
+    """
     n_merges = max_vocab
-    text_pairs, init_vocab = self.get_ids([data])
+    text_pairs, init_vocab = self.get_ids(data.sequences() if isinstance(data, FastxReader) else [data])
     ids = list(text_pairs)
 
     del text_pairs, max_vocab
     merges = {}
     ids_len = len(init_vocab)
 
-    for i in tqdm(range(n_merges), desc="training the tokenizer"):
+    for i in self.instrument.progress(range(n_merges), total=n_merges, desc="training the tokenizer"):
       stats = self._get_stats(ids)
       pair = max(stats, key=stats.get)
       idx = ids_len + i + 1
@@ -84,27 +106,100 @@ class KmerPairTokenizer:
     self.vocab = vocab
     self.merges = merges
     self.vocab_size = len(self.vocab)
+    self.kmer_to_id = init_vocab
+    self._code_table = None
 
-    del vocab, merges, ids, stats, pair, idx
+    del vocab, merges, ids
   
-  def encode(self, text):
-    text_pairs, _ = self.get_ids([text])
-    ids = list(text_pairs)
-    total_pairs = len(ids) - 1
-
-    with tqdm(total=total_pairs, desc="Encoding text") as pbar:
-      while len(ids) >= 2:
-        stats = self._get_stats(ids)
-        pair = min(stats, key=lambda p: self.merges.get(p, float('inf')))
-        if pair not in self.merges:
-          break
-        idx = self.merges[pair]
-        ids = self._merge(ids, pair, idx)
-        pbar.update(1)
+  def _build_code_table(self):
+    """
+      sorted packed codes of the k-mers in kmer_to_id and their ids, for np.searchsorted()
+        - a k-mer of k ascii symbols is packed into one uint64, a byte per symbol
+    """
+    kmers = [kmer for kmer in self.kmer_to_id if len(kmer) == self.k_mers and kmer.isascii()]
+    if kmers:
+      codes = self._pack(np.frombuffer("".join(kmers).encode('ascii'), dtype=np.uint8))
+    else:
+      codes = np.empty(0, dtype=np.uint64)
+    order = np.argsort(codes)
+    ids = np.array([self.kmer_to_id[kmer] for kmer in kmers], dtype=np.int64)
+    self._code_table = (codes[order], ids[order])
+
+  def _pack(self, symbols):
+    blocks = symbols[:len(symbols) // self.k_mers * self.k_mers].reshape(-1, self.k_mers).astype(np.uint64)
+    codes = blocks[:, 0].copy()
+    for j in range(1, self.k_mers):
+      codes <<= np.uint64(8)
+      codes |= blocks[:, j]
+    return codes
+
+  def _lookup(self, kmer, unknown):
+    if kmer in self.kmer_to_id:
+      return self.kmer_to_id[kmer]
+    if unknown == 'raise':
+      raise KeyError(f"k-mer {kmer!r} is not in the vocab")
+    if unknown in ('skip', 'stop'):
+      return None
+    return unknown
+
+  def _base_ids(self, text, unknown):
+    """
+      k-mer ids of text as an int64 array, ascii text in one vectorized pass: the k-mers are
+      packed into uint64 codes and found in the sorted code table, only the shorter last
+      k-mer and k-mers missing from the table go through _lookup()
+    """
+    k = self.k_mers
+    if k > _MAX_PACKED_K or not text.isascii():
+      ids = [self._lookup(kmer, unknown) for kmer in self._tokenize_seq(text)]
+      return np.array([-1 if idx is None else idx for idx in ids], dtype=np.int64)
+    if self._code_table is None:
+      self._build_code_table()
+    table_codes, table_ids = self._code_table
+    n_full = len(text) // k
+    ids = np.full(n_full + (len(text) % k > 0), -1, dtype=np.int64)
+    if n_full and len(table_codes):
+      codes = self._pack(np.frombuffer(text.encode('ascii'), dtype=np.uint8))
+      pos = np.minimum(np.searchsorted(table_codes, codes), len(table_codes) - 1)
+      found = table_codes[pos] == codes
+      ids[:n_full][found] = table_ids[pos[found]]
+    for j in np.flatnonzero(ids < 0).tolist():
+      idx = self._lookup(text[j*k:(j+1)*k], unknown)
+      ids[j] = -1 if idx is None else idx
     return ids
 
+  def encode(self, text, unknown='stop', out='list', dtype=None):
+    """
+      - maps the k-mers to their base ids from training (kmer_to_id), then merges them with the
+        heap engine (miniBPE/encoder.py), same result as always merging the lowest ranked pair first
+      - unknown: what to do with a k-mer that wasn't seen in training, same as KMerTokenizer.encode()
+          'stop' -> the ids end before it (eg. the shorter last k-mer of the text)
+          'raise' -> KeyError, 'skip' -> leave it out, an integer -> use that id
+      - out: 'list', 'array' or 'numpy', see miniBPE/idarray.py
+    """
+    inst = self.instrument
+    with inst.timer('pretokenize'):
+      ids = self._base_ids(text, unknown)
+      if unknown == 'skip':
+        ids = ids[ids >= 0]
+      elif unknown == 'stop':
+        ids = ids[:np.argmin(ids >= 0)] if (ids < 0).any() else ids
+    n_in = len(ids)
+    n_ids = max(self.vocab, default=0) + 1
+
+    with inst.timer('merge'):
+      ids = merge_ids(ids.tolist(), self.merges)
+    if inst.enabled:
+      inst.count('kmers_in', n_in)
+      inst.count('tokens_out', len(ids))
+      inst.count('merges_applied', n_in - len(ids))
+    return as_ids(ids, out, n_ids, dtype)
+
   def decode(self, ids):
-    tokens = [self.vocab[idx] for idx in ids]
+    if isinstance(self.vocab, BinaryVocab):
+      # read the table out of the file once instead of slicing it for every token
+      self.vocab = self.vocab.to_dict()
+    with self.instrument.timer('decode'):
+      tokens = list(map(self.vocab.__getitem__, as_list(ids)))
     sequence = ''.join(tokens)
     return sequence
   
@@ -116,8 +211,35 @@ class KmerPairTokenizer:
       for ids1, ids2 in self.merges:
         f.write(f"{ids1} {ids2}\n")
     with open(vocab_file, 'w') as f:
-      json.dump(self.vocab, f)
+      json.dump(dict(self.vocab), f)
     print('model file saved successfully!')
+
+  def save_binary(self, path):
+    """
+      saves merges and vocab to one binary '.bin' file, see miniBPE/binary.py
+    """
+    vocab = {int(idx): token for idx, token in self.vocab.items()}
+    save_binary_model(path, self.merges, vocab, meta={'tokenizer': 'kmer_pair', 'k_mers': self.k_mers})
+
+  def load_binary(self, path):
+    """
+      maps a '.bin' file, vocab entries are read from it on lookup
+    """
+    model = load_binary_model(path)
+    assert model.meta.get('tokenizer') == 'kmer_pair', f"{path} was not saved by KmerPairTokenizer"
+    self.k_mers = model.meta['k_mers']
+    self.merges = model.merges
+    self.vocab = model.vocab
+    self.vocab_size = len(self.vocab)
+    self._set_kmer_table()
+
+  def _set_kmer_table(self):
+    """
+      the base k-mers are the vocab entries that no merge produced
+    """
+    merged = set(self.merges.values())
+    self.kmer_to_id = {self.vocab[idx]: idx for idx in self.vocab if idx not in merged}
+    self._code_table = None
   
   def load(self, model_path, vocab_path):
     assert model_path.endswith('.model')
@@ -126,14 +248,12 @@ class KmerPairTokenizer:
     with open(vocab_path, 'r') as f:
       vocab_data = json.load(f)
       
-    self.vocab = vocab_data
-    self.vocab_size = len(vocab_data)
+    self.vocab = {int(idx): token for idx, token in vocab_data.items()}
+    self.vocab_size = len(self.vocab)
 
-    merges = {}
-    idx = 256 + 1
     with open(model_path, 'r', encoding='utf-8') as fread:
-      for line in fread:
-        idx1, idx2 = map(int, line.split())
-        merges[(idx1, idx2)] = idx
-        idx += 1
-    self.merges = merges
+      pairs = [tuple(map(int, line.split())) for line in fread if line.strip()]
+    # training numbers the k-mers 1..n and the merges n+1.., in the order they were written
+    idx = max(self.vocab) - len(pairs) + 1
+    self.merges = {pair: idx + i for i, pair in enumerate(pairs)}
+    self._set_kmer_table()
@@ -7,13 +7,109 @@ r"""
     'vocab.json' is just for human interpretation
 """
 
-from tqdm import tqdm
+import numpy as np
+import multiprocessing as mp
 import json
+import re
 import os
 current_dir = os.path.dirname(os.path.realpath(__file__))
 os.chdir(current_dir)
 
-class DNAtokenizer:
+from .batch import BatchMixin
+from .packed import PackedSequence, fill_runs
+from .fasta import FastxReader, AMBIGUOUS
+from miniBPE.binary import save_binary_model, load_binary_model, merge_items, BinaryVocab
+from miniBPE.encoder import merge_ids
+from miniBPE.idarray import as_ids, as_list
+from miniBPE.instrument import NULL
+
+# a run of ambiguity codes (N, gaps, ...) is read as one newline, so no pair spans it
+_AMBIGUOUS_RUN = re.compile(f"[{re.escape(AMBIGUOUS.decode('ascii'))}]+")
+_AMBIGUOUS_CODES = np.frombuffer(AMBIGUOUS, dtype=np.uint8)
+
+# below this many ids (per merge) the heap encoder beats one vectorized pass per merge
+_HEAP_IDS_PER_MERGE, _HEAP_IDS_MIN = 4, 256
+
+# pair keys are packed as a * V + b, counted with bincount while there are at most this many
+# possible keys per pair in the input, past that np.unique over the present keys is faster
+# and the counters don't outgrow the ids (V * V is 16M at V=4096)
+_BINCOUNT_KEYS_PER_PAIR = 4
+
+def _most_common_pair(ids, V):
+  """
+    numpy version of max(stats, key=stats.get), ties go to the pair that occurs first
+  """
+  keys = ids[:-1].astype(np.int64) * V + ids[1:]
+  if V * V <= _BINCOUNT_KEYS_PER_PAIR * len(keys):
+    counts = np.bincount(keys)
+    best = counts.max()
+    candidates = np.flatnonzero(counts == best)
+  else:
+    uniq, counts = np.unique(keys, return_counts=True)
+    best = counts.max()
+    candidates = uniq[counts == best]
+  if len(candidates) == 1:
+    key = candidates[0]
+  else:
+    key = keys[np.argmax(np.isin(keys, candidates))]
+  p0, p1 = divmod(int(key), V)
+  return (p0, p1), int(best)
+
+def _merge_array(ids, pair, idx):
+  """
+    vectorized _merge(): replaces every left-to-right, non-overlapping occurrence of pair
+    in a run like AAAA with pair (A, A), only the occurrences at even offsets of the run are kept
+  """
+  starts = np.flatnonzero((ids[:-1] == pair[0]) & (ids[1:] == pair[1]))
+  if len(starts) == 0:
+    return ids
+  if pair[0] == pair[1]:
+    new_run = np.ones(len(starts), dtype=bool)
+    new_run[1:] = np.diff(starts) != 1
+    run_start = np.maximum.accumulate(np.where(new_run, starts, 0))
+    starts = starts[(starts - run_start) % 2 == 0]
+  keep = np.ones(len(ids), dtype=bool)
+  keep[starts + 1] = False
+  ids[starts] = idx
+  return ids[keep]
+
+def _shard_state(tokenizer, ids):
+  """
+    what the coordinator needs from a shard after each merge:
+      (pair counts, first token, last token, length of the run of equal tokens at the end, length)
+  """
+  if not ids:
+    return {}, None, None, 0, 0
+  trail = 1
+  while trail < len(ids) and ids[-trail-1] == ids[-1]:
+    trail += 1
+  return tokenizer._get_stats(ids), ids[0], ids[-1], trail, len(ids)
+
+def _shard_worker(tokenizer, conn, ids):
+  """
+    runs inside a worker process, keeps one shard of the training ids resident and
+    applies every merge broadcast by the coordinator
+      - head_consumed: first token was merged into the previous shard's last token
+      - tail_merge: last token absorbs the first token of the next shard
+  """
+  conn.send(_shard_state(tokenizer, ids))
+  while True:
+    msg = conn.recv()
+    if msg is None:
+      break
+    pair, idx, head_consumed, tail_merge = msg
+    if head_consumed:
+      ids = ids[1:]
+    ids = tokenizer._merge(ids, pair, idx)
+    if tail_merge:
+      ids[-1] = idx
+    conn.send(_shard_state(tokenizer, ids))
+  conn.close()
+
+class DNAtokenizer(BatchMixin):
+  # timers/counters/progress bars, see miniBPE/instrument.py
+  instrument = NULL
+
   def __init__(self):
     """
       inital variables:
@@ -29,21 +125,64 @@ class DNAtokenizer:
     self.vocab = {}
     self.string_to_index = {char: idx for idx, char in enumerate(self.chars)}
     self.index_to_string = {idx: char for idx, char in enumerate(self.chars)}
-  
+
+  @property
+  def merges(self):
+    # load_binary() leaves the merges in the file until they're first needed
+    if self._merges is None:
+      self._merges = self._watched(merge_items(self._merge_rows))
+      self._merge_rows = None
+    return self._merges
+
+  @merges.setter
+  def merges(self, merges):
+    self._merges, self._merge_rows = self._watched(merges), None
+
   def _encode(self, string):
     """
       encoder: takes a string, returns a list of integers
         eg. AATGC --> ['2', '2', '5', '4', '3']
+      every run of IUPAC ambiguity codes and gaps (eg. NNNN, see fasta.py) becomes one '\n',
+      the same boundary as between two records, so the bases around an N gap are never counted
+      as a pair and decode() gives '\n' back for it
+      a PackedSequence is mapped in one vectorized pass and gives an int32 array instead,
+      a FastxReader is packed first (records joined by newlines)
     """
-    encoded = [self.string_to_index[char] for char in string]
+    if isinstance(string, FastxReader):
+      string = string.pack()
+    try:
+      if isinstance(string, PackedSequence):
+        return self._encode_packed(string)
+      encoded = list(map(self.string_to_index.__getitem__, _AMBIGUOUS_RUN.sub("\n", string)))
+    except KeyError as e:
+      raise ValueError(f"DNAtokenizer can't encode {e.args[0]!r}, its characters are {self.chars} "
+                       f"and the ambiguity codes {AMBIGUOUS.decode('ascii')!r}") from None
     return encoded
+
+  def _encode_packed(self, sequence):
+    table = np.array([self.string_to_index[base] for base in "ACGT"], dtype=np.int32)
+    encoded = table[sequence.codes()]
+    starts, lengths, chars = sequence.exception_runs()
+    ambiguous = np.isin(chars, _AMBIGUOUS_CODES)
+    chars = np.where(ambiguous, ord("\n"), chars)
+    uniq, inverse = np.unique(chars, return_inverse=True)
+    ids = np.array([self.string_to_index[chr(char)] for char in uniq.tolist()], dtype=np.int32)
+    encoded = fill_runs(encoded, starts, lengths, ids[inverse])
+    if not ambiguous.any():
+      return encoded
+    # keep the first position of every stretch of back to back ambiguous runs
+    starts, lengths = starts[ambiguous], lengths[ambiguous]
+    keep = np.ones(len(encoded), dtype=bool)
+    fill_runs(keep, starts + 1, lengths - 1, np.zeros(len(starts), dtype=bool))
+    keep[starts[1:][starts[1:] == (starts + lengths)[:-1]]] = False
+    return encoded[keep]
   
   def _decode(self, integer):
     """
       decoder: takes a list of integers, returns a string
         eg. ['2', '2', '5', '4', '3'] --> AATGC
     """
-    decoded = ''.join([self.index_to_string[i] for i in integer])
+    decoded = ''.join(map(self.index_to_string.__getitem__, integer))
     return decoded
 
   def _get_stats(self, ids, counts=None):
@@ -79,7 +218,7 @@ class DNAtokenizer:
     """
     return {i: ids for i, ids in enumerate(self.chars)}
 
-  def train(self, train_data, target_vocab):
+  def train(self, train_data, target_vocab, num_workers=None, backend='python', checkpoint_path=None, checkpoint_every=100):
     """
       - takes in the data, encodes it using _encode() function, converts each unique char to index
           eg. AATGC --> ['2', '2', '5', '4', '3']
@@ -89,33 +228,209 @@ class DNAtokenizer:
       - at the end uses merges to build final vocab
 
       Args:
-        train_data (str): a big file containing lots of dna sequence
+        train_data (str, PackedSequence or FastxReader): a big file containing lots of dna sequence,
+          the records of a FastxReader are joined by newlines, runs of 'N' and the other ambiguity
+          codes are read as one newline each (see _encode()), any other character raises a ValueError
         target_vocab (integer): name tells you fucking idiot
+        num_workers (integer): if > 1, the ids are sharded at newlines across that many
+          worker processes, gives the same merges as the single process loop
+        backend (str): 'python' or 'numpy', numpy keeps the ids in one integer array and
+          counts/merges pairs with vectorized ops, same merges as 'python', the python backend
+          works on a python list of ids (8+ bytes a base), a packed input only stays small with numpy
+        checkpoint_path (str): if given, training state is written there every
+          checkpoint_every merges and can be picked up again with resume_train()
     """
-    vocab = self._build_vocab()
-    tokens = self._encode(train_data)
-    ids = list(tokens)
+    with self.instrument.timer('pretokenize'):
+      ids = self._encode(train_data)
     
-    merges = {}
     n_merges = target_vocab - self.vocab_size + 1
-    for i in tqdm(range(n_merges), desc='Training the tokenizer\t'):
-      stats = self._get_stats(ids)
-      pair = max(stats, key=stats.get)
-      idx = self.vocab_size + i
-      ids = self._merge(ids, pair, idx)
-      merges[pair] = idx
+    if num_workers is not None and num_workers > 1:
+      assert backend == 'python', "numpy backend runs in a single process"
+      assert checkpoint_path is None, "checkpoints are only written by single process training"
+      with self.instrument.timer('train'):
+        merges = self._train_sharded(ids, n_merges, num_workers)
+      self.instrument.count('merges_learned', len(merges))
+    else:
+      merges = self._train_loop(ids, {}, n_merges, self.vocab_size, backend, None, checkpoint_path, checkpoint_every)
     
+    self.merges = merges
+    self.vocab = self._vocab_from_merges(merges)
+    self.vocab_size = len(self.vocab)
+  
+  def _vocab_from_merges(self, merges):
+    """
+      initial chars + every merge, in merge order
+    """
+    vocab = self._build_vocab()
     for (p0, p1), idx in merges.items():
       vocab[idx] = vocab[p0] + vocab[p1]
-    
-    self.vocab = vocab
+    return vocab
+
+  def _train_loop(self, ids, merges, n_merges, start_idx, backend='python', stats=None, checkpoint_path=None, checkpoint_every=100):
+    """
+      - runs n_merges merges on top of the given merges, new ids start at start_idx
+      - 'numpy' backend counts and merges pairs on a contiguous int32 array instead of lists
+      - stats: pair counts of ids if already known (eg. from a checkpoint), python backend only
+      - returns the merges, writes a checkpoint every checkpoint_every merges and at the end
+    """
+    merges = dict(merges)
+    target_merges = len(merges) + n_merges
+    if backend == 'numpy':
+      ids = np.asarray(ids, dtype=np.int32)
+      V = start_idx + n_merges
+    elif backend == 'python':
+      ids = ids.tolist() if isinstance(ids, np.ndarray) else list(ids)
+      stats = self._get_stats(ids) if stats is None else stats
+    else:
+      raise ValueError(f"backend = {backend} not understood")
+
+    inst = self.instrument
+    with inst.timer('train'):
+      for i in inst.progress(range(n_merges), total=n_merges, desc='Training the tokenizer\t'):
+        idx = start_idx + i
+        if backend == 'numpy':
+          pair, _ = _most_common_pair(ids, V)
+          ids = _merge_array(ids, pair, idx)
+        else:
+          pair = max(stats, key=stats.get)
+          ids = self._merge(ids, pair, idx)
+          stats = self._get_stats(ids)
+        merges[pair] = idx
+        if checkpoint_path is not None and ((i + 1) % checkpoint_every == 0 or i + 1 == n_merges):
+          self._save_checkpoint(checkpoint_path, ids, merges, stats if backend == 'python' else None, target_merges, backend)
+    inst.count('merges_learned', n_merges)
+    return merges
+
+  def _save_checkpoint(self, path, ids, merges, stats, target_merges, backend):
+    """
+      writes the training state as a '.npz' file, replacing the old one atomically:
+        - ids: current merged id sequence
+        - merges: (n, 3) array of [p0, p1, idx] in merge order
+        - stats: (k, 3) array of [p0, p1, count] in first occurrence order, empty for numpy backend
+    """
+    merge_rows = np.array([[p0, p1, idx] for (p0, p1), idx in merges.items()], dtype=np.int64).reshape(-1, 3)
+    stat_rows = np.array([[p0, p1, c] for (p0, p1), c in (stats or {}).items()], dtype=np.int64).reshape(-1, 3)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, ids=np.asarray(ids, dtype=np.int32), merges=merge_rows, stats=stat_rows,
+               target_merges=target_merges, backend=backend)
+    os.replace(tmp_path, path)
+
+  def resume_train(self, checkpoint_path, checkpoint_every=100):
+    """
+      - picks up training exactly where the checkpoint written by train() stopped
+      - keeps writing checkpoints to the same file
+
+      Args:
+        checkpoint_path (str): path of the checkpoint file
+    """
+    with np.load(checkpoint_path) as ckpt:
+      ids = ckpt['ids']
+      merges = {(int(p0), int(p1)): int(idx) for p0, p1, idx in ckpt['merges']}
+      stats = {(int(p0), int(p1)): int(c) for p0, p1, c in ckpt['stats']}
+      target_merges = int(ckpt['target_merges'])
+      backend = str(ckpt['backend'])
+
+    if backend == 'python':
+      ids = ids.tolist()
+    n_merges = target_merges - len(merges)
+    start_idx = max(merges.values()) + 1 if merges else len(self.chars)
+    merges = self._train_loop(ids, merges, n_merges, start_idx, backend, stats or None, checkpoint_path, checkpoint_every)
+
     self.merges = merges
-    self.vocab_size = len(vocab)
-  
-  def continue_train(self, train_data, n_merges):
+    self.vocab = self._vocab_from_merges(merges)
+    self.vocab_size = len(self.vocab)
+
+  def _split_shards(self, ids, num_workers):
     """
-      - takes in the data, performs iteration till n_merges
-      - continues from the last index of the loaded merges
+      splits the ids into at most num_workers shards, each cut right after a newline
+    """
+    newline = self.string_to_index["\n"]
+    shard_len = len(ids) // num_workers + 1
+    shards, start = [], 0
+    while start < len(ids):
+      try:
+        end = ids.index(newline, start + shard_len - 1) + 1
+      except ValueError:
+        end = len(ids)
+      shards.append(ids[start:end])
+      start = end
+    return shards
+
+  def _train_sharded(self, ids, n_merges, num_workers):
+    """
+      - every worker keeps one shard and returns its partial pair counts each round
+      - counts are summed in shard order, with the pair spanning each shard boundary
+        counted in between, so ties resolve exactly like max() over the whole sequence
+      - the coordinator decides which boundary pairs get merged and broadcasts the
+        chosen merge, workers apply it locally
+    """
+    if isinstance(ids, np.ndarray):
+      ids = ids.tolist()
+    shards = self._split_shards(ids, num_workers)
+    conns, procs = [], []
+    for shard in shards:
+      parent, child = mp.Pipe()
+      proc = mp.Process(target=_shard_worker, args=(self, child, shard), daemon=True)
+      proc.start()
+      conns.append(parent)
+      procs.append(proc)
+    del shards
+
+    merges = {}
+    try:
+      states = [conn.recv() for conn in conns]
+      for i in self.instrument.progress(range(n_merges), total=n_merges, desc='Training the tokenizer\t'):
+        active = [k for k, state in enumerate(states) if state[4]]
+        stats = {}
+        for j, k in enumerate(active):
+          if j > 0:
+            pair = (states[active[j-1]][2], states[k][1])
+            stats[pair] = stats.get(pair, 0) + 1
+          for pair, count in states[k][0].items():
+            stats[pair] = stats.get(pair, 0) + count
+
+        pair = max(stats, key=stats.get)
+        idx = self.vocab_size + i
+        flags = [[False, False] for _ in states]
+        run = 0
+        for j, k in enumerate(active):
+          _, head, tail, trail, size = states[k]
+          # length of the run of pair[0] tokens ending at this shard's last token
+          if tail != pair[0]:
+            run = 0
+          elif trail == size:
+            run += size
+          else:
+            run = trail
+          if j + 1 == len(active) or tail != pair[0] or states[active[j+1]][1] != pair[1]:
+            continue
+          # in a run like AAAA the merge pairs up tokens left to right, so for (A, A)
+          # the boundary is merged only when the shard's last A sits at an even offset
+          if pair[0] != pair[1] or run % 2 == 1:
+            flags[k][1] = True
+            flags[active[j+1]][0] = True
+
+        for conn, (head_consumed, tail_merge) in zip(conns, flags):
+          conn.send((pair, idx, head_consumed, tail_merge))
+        states = [conn.recv() for conn in conns]
+        merges[pair] = idx
+    finally:
+      for conn in conns:
+        # a worker that died (often why we're here) can't take the stop message, the
+        # error it raised must come out, not the broken pipe
+        try:
+          conn.send(None)
+        except (BrokenPipeError, OSError):
+          pass
+      for proc in procs:
+        proc.join()
+    return merges
+
+  def continue_train(self, train_data, n_merges, backend='python', checkpoint_path=None, checkpoint_every=100):
+    """
+      - takes in the data, applies the already learned merges to it in order
+      - then performs iteration till n_merges, new ids continue after the largest existing id
       - each iteration, makes dictonary of 2 consecutive pairs and then merges the max occuring
         pair together (same as train())
       - at the end uses merges to build final vocab
@@ -123,46 +438,57 @@ class DNAtokenizer:
       Args:
         train_data (str): a big file containing lots of dna sequence
         n_merges (integer): no of merges
-      
-      ** this function has some problems
-    """
-    tokens = self._encode(train_data)
-    ids = list(tokens)
-    for i in tqdm(range(n_merges), desc='Training continue'):
-      stats = self._get_stats(ids)
-      pair = max(stats, key=stats.get)
-      idx = self.vocab_size + i
-      ids = self._merge(ids, pair, idx)
-      self.merges[pair] = idx
-    
-    for (p0, p1), idx in self.merges.items():
-      self.vocab[idx] = self.vocab[p0] + self.vocab[p1]
-    
+    """
+    ids = np.asarray(self._encode(train_data), dtype=np.int32)
+    for pair, idx in sorted(self.merges.items(), key=lambda item: item[1]):
+      ids = _merge_array(ids, pair, idx)
+
+    start_idx = max(self._vocab_from_merges(self.merges)) + 1
+    merges = self._train_loop(ids, self.merges, n_merges, start_idx, backend, None, checkpoint_path, checkpoint_every)
+
+    self.merges = merges
+    self.vocab = self._vocab_from_merges(merges)
     self.vocab_size = len(self.vocab)
   
-  def encode(self, text):
+  def encode(self, text, out='list', dtype=None):
     """
       - takes in the input string, encodes it using initial vocab '_encode()' function
-      - fetches merges from saved or loaded merges
+      - fetches merges from saved or loaded merges, applies them in merge order with the
+        vectorized _merge_array(), same result as always merging the lowest ranked pair first
+      - inputs shorter than about 4 ids per merge go through the heap encoder of
+        miniBPE/encoder.py instead, one numpy pass per merge costs more than the whole heap there
       
       Args:
-        train_data (str): string of dna sequence
+        train_data (str or PackedSequence): string of dna sequence
         self.merges (dictonary): contains merges
+        out (str): 'list', 'array' (array.array) or 'numpy', see miniBPE/idarray.py
+        dtype: element type of array/numpy outputs, defaults to the smallest that fits the vocab
     """
-    tokens = self._encode(text)
-    ids = list(tokens)
-    while len(ids) >= 2:
-      stats = self._get_stats(ids)
-      pair = min(stats, key=lambda p: self.merges.get(p, float('inf')))
-      if pair not in self.merges:
-        break
-
-      idx = self.merges[pair]
-      ids = self._merge(ids, pair, idx)
-    return ids
+    inst = self.instrument
+    with inst.timer('pretokenize'):
+      ids = self._encode(text)
+    n_in = len(ids)
+    with inst.timer('merge'):
+      if n_in < _HEAP_IDS_PER_MERGE * len(self.merges) + _HEAP_IDS_MIN:
+        ids = merge_ids(as_list(ids), self.merges)
+      else:
+        ids = np.asarray(ids, dtype=np.int32)
+        for pair, idx in sorted(self.merges.items(), key=lambda item: item[1]):
+          if len(ids) < 2:
+            break
+          ids = _merge_array(ids, pair, idx)
+    if inst.enabled:
+      inst.count('chars_in', n_in)
+      inst.count('tokens_out', len(ids))
+      inst.count('merges_applied', n_in - len(ids))
+    return as_ids(ids, out, max(len(self.vocab), len(self.chars)), dtype)
 
   def decode(self, de_text):
-    tokens = [self.vocab[idx] for idx in de_text]
+    if isinstance(self.vocab, BinaryVocab):
+      # read the table out of the file once instead of slicing it for every token
+      self.vocab = self.vocab.to_dict()
+    with self.instrument.timer('decode'):
+      tokens = list(map(self.vocab.__getitem__, as_list(de_text)))
     text = ''.join(tokens)
     return text
   
@@ -184,9 +510,36 @@ class DNAtokenizer:
         fwrite.write(f"{ids1} {ids2}\n")
     vocab_file = model_prefix + '_vocab.json'
     with open(vocab_file, 'w') as f:
-      json.dump(self.vocab, f)
+      json.dump(dict(self.vocab), f)
     print('model file saved successfully!')
 
+  def save_binary(self, path):
+    """
+      - saves chars, merges and vocab to one binary '.bin' file, see miniBPE/binary.py
+      - loads with mmap through load_binary() or load_model()
+
+      Args:
+        path (str): path of the '.bin' file
+    """
+    save_binary_model(path, self.merges, self.vocab, meta={'tokenizer': 'dna', 'chars': self.chars})
+
+  def load_binary(self, path):
+    """
+      - maps the '.bin' file, merges are read from it on first use, vocab entries on lookup
+        until decode() reads the whole table once
+
+      Args:
+        path (str): path to the '.bin' file
+    """
+    model = load_binary_model(path)
+    assert model.meta.get('tokenizer') == 'dna', f"{path} was not saved by DNAtokenizer"
+    self.chars = model.meta['chars']
+    self.string_to_index = {char: idx for idx, char in enumerate(self.chars)}
+    self.index_to_string = {idx: char for idx, char in enumerate(self.chars)}
+    self._merges, self._merge_rows = None, model.merge_rows
+    self.vocab = model.vocab
+    self.vocab_size = len(self.vocab)
+
   def load_model(self, model_path):
     """
       - loads the '.model' file
@@ -194,8 +547,10 @@ class DNAtokenizer:
       - builds the vocab again for further use
 
       Args:
-        model_path (str): path to the '.model' file
+        model_path (str): path to the '.model' file, a '.bin' file goes to load_binary()
     """
+    if model_path.endswith('.bin'):
+      return self.load_binary(model_path)
     assert model_path.endswith('.model')
 
     merges = {}
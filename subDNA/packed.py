@@ -0,0 +1,272 @@
+"""
+  2-bit packed dna sequences
+  --> A, C, G, T take 2 bits each (A=0, C=1, G=2, T=3), four bases per byte, first base
+      in the high bits
+  --> any other character (newline, N, lowercase, ...) is kept in a sparse side-table of
+      (start, length, char) runs, so a multi-megabase run of N is one entry, its slots in the
+      packed bytes hold a 0
+  --> positions are uint32 while the sequence is shorter than 4G bases, run chars are uint8
+      while every one of them is below 256, about 9 bytes a run
+  --> slicing returns a view on the same buffers, nothing is copied
+  --> save() writes a flat binary file that load() maps straight from disk
+"""
+
+import struct
+import numpy as np
+
+_MAGIC = b"PKDNA\x00v2"
+_HEADER = struct.Struct("<8sQQ")
+_LETTERS = np.frombuffer(b"ACGT", dtype=np.uint8)
+_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+# 2-bit code of every ascii base, 255 for anything else
+_CODES = np.full(128, 255, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+  _CODES[_base] = _code
+
+def _pack_codes(codes):
+  """
+    packs 2-bit codes (uint8, length multiple of 4) into bytes
+  """
+  quads = codes.reshape(-1, 4)
+  return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+def _pos_dtype(length):
+  return np.uint32 if length < 1 << 32 else np.int64
+
+def _char_dtype(chars):
+  return np.uint8 if not len(chars) or int(chars.max()) < 256 else np.uint32
+
+def _to_runs(positions, chars):
+  """
+    sorted positions and their chars -> (starts, lengths, chars) of the runs of one char
+  """
+  if not len(positions):
+    return positions, np.empty(0, dtype=np.int64), chars
+  first = np.ones(len(positions), dtype=bool)
+  first[1:] = (np.diff(positions) != 1) | (chars[1:] != chars[:-1])
+  starts = np.flatnonzero(first)
+  lengths = np.diff(np.append(starts, len(positions)))
+  return positions[starts], lengths, chars[starts]
+
+def _join_runs(starts, lengths, chars):
+  """
+    merges runs that touch and have the same char (eg. cut at block boundaries)
+  """
+  if len(starts) < 2:
+    return starts, lengths, chars
+  join = (starts[1:] == starts[:-1] + lengths[:-1]) & (chars[1:] == chars[:-1])
+  if not join.any():
+    return starts, lengths, chars
+  keep = np.flatnonzero(np.concatenate([[True], ~join]))
+  return starts[keep], np.add.reduceat(lengths, keep), chars[keep]
+
+def fill_runs(out, starts, lengths, values):
+  """
+    out[start:start + length] = value for every run, runs of one go in a single vectorized
+    pass, only the longer ones are assigned one by one
+  """
+  single = lengths == 1
+  out[starts[single]] = values[single]
+  for start, length, value in zip(starts[~single].tolist(), lengths[~single].tolist(), values[~single].tolist()):
+    out[start:start + length] = value
+  return out
+
+class _Packer:
+  """
+    builds a PackedSequence from text blocks of any size
+  """
+  def __init__(self):
+    self.chunks = []
+    self.runs = []
+    self.carry = np.empty(0, dtype=np.uint8)
+    self.length = 0
+
+  def add(self, text):
+    points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    codes = np.full(len(points), 255, dtype=np.uint8)
+    ascii_mask = points < 128
+    codes[ascii_mask] = _CODES[points[ascii_mask]]
+    other = np.flatnonzero(codes == 255)
+    if len(other):
+      starts, lengths, chars = _to_runs(other, points[other])
+      self.runs.append((starts + self.length, lengths, chars))
+      codes[other] = 0
+    self.length += len(codes)
+
+    codes = np.concatenate([self.carry, codes])
+    n_full = len(codes) // 4 * 4
+    self.chunks.append(_pack_codes(codes[:n_full]))
+    self.carry = codes[n_full:]
+
+  def finish(self):
+    if len(self.carry):
+      tail = np.zeros(4, dtype=np.uint8)
+      tail[:len(self.carry)] = self.carry
+      self.chunks.append(_pack_codes(tail))
+    packed = np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=np.uint8)
+    if self.runs:
+      starts, lengths, chars = _join_runs(*(np.concatenate(parts) for parts in zip(*self.runs)))
+    else:
+      starts, lengths, chars = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32)
+    pos_dtype = _pos_dtype(self.length)
+    return PackedSequence(packed, self.length, starts.astype(pos_dtype), lengths.astype(pos_dtype), chars.astype(_char_dtype(chars)))
+
+class PackedSequence:
+  def __init__(self, packed, length, exc_starts, exc_lengths, exc_chars, start=0):
+    """
+      - packed: uint8 array, 4 bases per byte
+      - exc_starts, exc_lengths, exc_chars: runs of non-ACGT characters, sorted absolute start
+        positions, their lengths and the code point of each run
+      - start, length: the part of the buffers this sequence covers
+    """
+    self.packed = packed
+    self.exc_starts = exc_starts
+    self.exc_lengths = exc_lengths
+    self.exc_chars = exc_chars
+    self.start = start
+    self.length = length
+
+  @classmethod
+  def from_string(cls, text, block_size=1 << 22):
+    packer = _Packer()
+    for i in range(0, len(text), block_size):
+      packer.add(text[i:i+block_size])
+    return packer.finish()
+
+  @classmethod
+  def from_file(cls, path, block_size=1 << 22):
+    """
+      packs a plain text sequence file block by block, the file is never fully in memory as text
+      every line break is a run of its own, line-wrapped fasta is smaller through
+      FastxReader.pack(), which drops them
+    """
+    packer = _Packer()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+      while True:
+        block = f.read(block_size)
+        if not block:
+          break
+        packer.add(block)
+    return packer.finish()
+
+  def __len__(self):
+    return self.length
+
+  def _exc_range(self):
+    """
+      (first, last + 1) index of the runs that overlap this view
+    """
+    lo = int(np.searchsorted(self.exc_starts, self.start, side='right')) - 1
+    if lo < 0 or int(self.exc_starts[lo]) + int(self.exc_lengths[lo]) <= self.start:
+      lo += 1
+    hi = int(np.searchsorted(self.exc_starts, self.start + self.length))
+    return lo, hi
+
+  def exception_runs(self):
+    """
+      returns (starts relative to this view, lengths, code points) of the runs of non-ACGT
+      characters, the runs at the edges are cut to the view
+    """
+    lo, hi = self._exc_range()
+    starts = self.exc_starts[lo:hi].astype(np.int64) - self.start
+    ends = np.minimum(starts + self.exc_lengths[lo:hi], self.length)
+    starts = np.maximum(starts, 0)
+    return starts, ends - starts, self.exc_chars[lo:hi]
+
+  def exceptions(self):
+    """
+      returns (positions relative to this view, code points) of every non-ACGT character,
+      one entry per position, exception_runs() keeps long runs (eg. of N) small
+    """
+    starts, lengths, chars = self.exception_runs()
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets, np.repeat(chars, lengths)
+
+  def codes(self):
+    """
+      returns the 2-bit code of every position as a uint8 array (non-ACGT positions hold 0)
+    """
+    first = self.start // 4
+    last = (self.start + self.length + 3) // 4
+    unpacked = (self.packed[first:last, None] >> _SHIFTS) & 3
+    offset = self.start - first * 4
+    return unpacked.reshape(-1)[offset:offset + self.length]
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      start, stop, step = key.indices(self.length)
+      if step != 1:
+        raise ValueError("PackedSequence only supports contiguous slices")
+      return PackedSequence(self.packed, max(stop - start, 0), self.exc_starts, self.exc_lengths, self.exc_chars, self.start + start)
+    if key < 0:
+      key += self.length
+    if not 0 <= key < self.length:
+      raise IndexError("PackedSequence index out of range")
+    pos = self.start + key
+    i = int(np.searchsorted(self.exc_starts, pos, side='right')) - 1
+    if i >= 0 and pos < int(self.exc_starts[i]) + int(self.exc_lengths[i]):
+      return chr(self.exc_chars[i])
+    return "ACGT"[(int(self.packed[pos // 4]) >> (6 - 2 * (pos % 4))) & 3]
+
+  def iter_blocks(self, block_size=1 << 20):
+    """
+      yields the sequence as strings of at most block_size characters
+    """
+    for i in range(0, self.length, block_size):
+      yield str(self[i:i+block_size])
+
+  def __iter__(self):
+    for block in self.iter_blocks():
+      yield from block
+
+  def __str__(self):
+    points = _LETTERS[self.codes()].astype(np.uint32)
+    fill_runs(points, *self.exception_runs())
+    return points.tobytes().decode('utf-32-le')
+
+  def __repr__(self):
+    lo, hi = self._exc_range()
+    return f"PackedSequence(length={self.length}, exception_runs={hi - lo})"
+
+  def save(self, path):
+    """
+      header (magic, length, no of exception runs), run starts and lengths (uint32, int64
+      from 4G bases on), run code points (uint32), packed bases
+    """
+    starts, lengths, chars = self.exception_runs()
+    if self.start % 4 == 0:
+      packed = self.packed[self.start // 4:(self.start + self.length + 3) // 4]
+    else:
+      codes = np.zeros((self.length + 3) // 4 * 4, dtype=np.uint8)
+      codes[:self.length] = self.codes()
+      packed = _pack_codes(codes)
+    pos_dtype = _pos_dtype(self.length)
+    with open(path, 'wb') as f:
+      f.write(_HEADER.pack(_MAGIC, self.length, len(starts)))
+      f.write(np.asarray(starts, dtype=pos_dtype).tobytes())
+      f.write(np.asarray(lengths, dtype=pos_dtype).tobytes())
+      f.write(np.asarray(chars, dtype=np.uint32).tobytes())
+      f.write(np.asarray(packed, dtype=np.uint8).tobytes())
+
+  @classmethod
+  def load(cls, path):
+    """
+      maps a file written by save(), the bases are read from disk on demand
+    """
+    with open(path, 'rb') as f:
+      magic, length, n_exc = _HEADER.unpack(f.read(_HEADER.size))
+    assert magic == _MAGIC, f"{path} is not a packed dna file"
+    offset = _HEADER.size
+    pos_dtype = _pos_dtype(length)
+    size = np.dtype(pos_dtype).itemsize
+    starts = np.fromfile(path, dtype=pos_dtype, count=n_exc, offset=offset)
+    lengths = np.fromfile(path, dtype=pos_dtype, count=n_exc, offset=offset + size * n_exc)
+    offset += 2 * size * n_exc
+    chars = np.fromfile(path, dtype=np.uint32, count=n_exc, offset=offset)
+    offset += 4 * n_exc
+    chars = chars.astype(_char_dtype(chars))
+    if length == 0:
+      return cls(np.empty(0, dtype=np.uint8), 0, starts, lengths, chars)
+    packed = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=((length + 3) // 4,))
+    return cls(packed, length, starts, lengths, chars)
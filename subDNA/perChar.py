@@ -1,8 +1,15 @@
 import os
+import itertools
 current_dir = os.path.dirname(os.path.realpath(__file__))
 os.chdir(current_dir)
 
-class PerCharTokenizer:
+import numpy as np
+from .batch import BatchMixin
+from .packed import PackedSequence, fill_runs
+from miniBPE.idarray import as_ids, as_list
+from miniBPE.instrument import NULL
+
+class PerCharTokenizer(BatchMixin):
   """
   Args:
     - chars (list): all bases along with special tokens represented as characters
@@ -14,6 +21,9 @@ class PerCharTokenizer:
       and returns it's position as integer
     - decode(): takes input of a list of integers and returns the specific item from vocab
   """
+  # timers/counters/progress bars, see miniBPE/instrument.py
+  instrument = NULL
+
   def __init__(self):
     super().__init__()
     self.chars = ['\n', 'A', 'T', 'G', 'C', 'P', 'M', 'U', ' ']
@@ -21,7 +31,23 @@ class PerCharTokenizer:
     self.string_to_index = {ch: i for i, ch in enumerate(self.chars)}
     self.index_to_string = {i: ch for i, ch in enumerate(self.chars)}
 
-  def encode(self, string):
+  def encode(self, string, out='list', dtype=None):
+    """
+      - out: 'list', 'array' (array.array) or 'numpy', see miniBPE/idarray.py
+      - dtype: element type of array/numpy outputs, defaults to the smallest that fits the vocab
+    """
+    if isinstance(string, PackedSequence):
+      # bases in one vectorized pass, only the sparse non-ACGT characters go through the loop below
+      table = np.array([self.string_to_index[base] for base in "ACGT"], dtype=np.int64)
+      encoded = table[string.codes()]
+      starts, lengths, chars = string.exception_runs()
+      uniq, first, inverse = np.unique(chars, return_index=True, return_inverse=True)
+      ids = np.zeros(len(uniq), dtype=np.int64)
+      # unseen characters get their ids in the order they appear, as in the loop below
+      for i in np.argsort(first, kind='stable').tolist():
+        ids[i] = self.encode(chr(uniq[i]))[0]
+      fill_runs(encoded, starts, lengths, ids[inverse])
+      return as_ids(encoded, out, len(self.string_to_index), dtype)
     encoded = []
     for char in string:
       if char in self.string_to_index:
@@ -31,11 +57,50 @@ class PerCharTokenizer:
         self.string_to_index[char] = special_index
         self.index_to_string[special_index] = char
         encoded.append(special_index)
-    return encoded
+    return as_ids(encoded, out, len(self.string_to_index), dtype)
   
+  def _register_chars(self, texts):
+    """
+      gives the unseen characters of texts their ids, in the same order encode() would
+    """
+    for text in texts:
+      if isinstance(text, PackedSequence):
+        text = "".join(chr(char) for char in text.exception_runs()[2].tolist())
+      for char in dict.fromkeys(text):
+        if char not in self.string_to_index:
+          special_index = len(self.string_to_index)
+          self.string_to_index[char] = special_index
+          self.index_to_string[special_index] = char
+
+  def encode_batch(self, texts, num_workers=None, chunksize=16, stream=False, **kwargs):
+    """
+      same as BatchMixin.encode_batch(), unseen characters get new ids while encoding though,
+      and the workers only know the ids from when their pool started:
+        - texts are read num_workers * chunksize at a time, the new characters of each window
+          are registered in this process before the window goes to the pool (which restarts
+          only if the window added characters)
+        - with num_workers=1 encode() registers them itself as it goes
+    """
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers <= 1:
+      return super().encode_batch(texts, num_workers, chunksize, stream, **kwargs)
+    results = self._encode_windows(iter(texts), num_workers, chunksize, stream, kwargs)
+    return results if stream else [ids for _, ids in results]
+
+  def _encode_windows(self, texts, num_workers, chunksize, stream, kwargs):
+    start = 0
+    while True:
+      window = list(itertools.islice(texts, num_workers * chunksize))
+      if not window:
+        break
+      self._register_chars(window)
+      encoded = super().encode_batch(window, num_workers, chunksize, stream, **kwargs)
+      yield from ((start + i, ids) for i, ids in (encoded if stream else enumerate(encoded)))
+      start += len(window)
+
   def decode(self, integer):
     decoded = []
-    for i in integer:
+    for i in as_list(integer):
       if i in self.index_to_string:
         decoded.append(self.index_to_string[i])
       else:
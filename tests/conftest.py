@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the packages live at the repo root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
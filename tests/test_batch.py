@@ -0,0 +1,20 @@
+from miniBPE import RegexTokenizer
+
+TEXT = "hello hello world, the world says hello " * 20
+
+def test_pool_restarts_after_in_place_model_edit():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 270)
+  texts = [TEXT[i:] for i in range(0, 400, 40)]
+  try:
+    assert tokenizer.encode_batch(texts, num_workers=2) == [tokenizer.encode(text) for text in texts]
+    pool = tokenizer._pool
+    assert tokenizer.encode_batch(texts, num_workers=2, stream=True) is not None and tokenizer._pool is pool
+    # swap the last merge for another one, same no of merges
+    pair = max(tokenizer.merges, key=tokenizer.merges.get)
+    idx = tokenizer.merges.pop(pair)
+    tokenizer.merges[(ord("o"), ord(" "))] = idx
+    assert tokenizer.encode_batch(texts, num_workers=2) == [tokenizer.encode(text) for text in texts]
+    assert tokenizer._pool is not pool
+  finally:
+    tokenizer.close_pool()
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from miniBPE import BasicTokenizer, RegexTokenizer
+from subDNA import DNAtokenizer
+from miniBPE.binary import BinaryVocab, save_binary_model, load_binary_model
+
+TEXT = "hello world, the binary format keeps merges, vocab and special tokens. " * 20
+
+@pytest.mark.parametrize('special_tokens', [
+  {'<a>': 300, '<b>': 299},
+  {'<a>': 1000, '<c>': 1002, '<b>': 1001, '<d>': 1003},
+  {'<x>': 5000, '<y>': 400, '<z>': 4000},
+])
+def test_special_tokens_out_of_order_round_trip(tmp_path, special_tokens):
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 280)
+  tokenizer.register_special_token(special_tokens)
+  path = str(tmp_path / 'model.bin')
+  tokenizer.save_binary(path)
+
+  loaded = RegexTokenizer()
+  loaded.load_binary(path)
+  assert loaded.special_tokens == special_tokens
+  text = "hello " + " world ".join(special_tokens)
+  ids = tokenizer.encode(text, allowed_special='all')
+  assert loaded.encode(text, allowed_special='all') == ids
+  assert loaded.decode(ids) == text
+
+def test_vocab_round_trip(tmp_path):
+  vocab = {idx: bytes([idx]) for idx in range(256)}
+  vocab.update({300: b"ab", 256: b"cd"})
+  path = str(tmp_path / 'vocab.bin')
+  save_binary_model(path, {}, vocab)
+  loaded = load_binary_model(path).vocab
+  assert dict(loaded) == vocab
+
+def test_unsorted_ids_are_rejected():
+  ids = np.array([2, 1], dtype=np.int32)
+  offsets = np.array([0, 1, 2], dtype=np.uint64)
+  with pytest.raises(AssertionError):
+    BinaryVocab(ids, offsets, np.frombuffer(b"ab", dtype=np.uint8), as_str=False)
+
+@pytest.mark.parametrize('make, text, n', [
+  (RegexTokenizer, TEXT, 280),
+  (BasicTokenizer, TEXT, 280),
+  (DNAtokenizer, "ACGTTGCAACGTTTGA\n" * 40, 20),
+])
+def test_merges_are_read_on_first_use(tmp_path, make, text, n):
+  tokenizer = make()
+  tokenizer.train(text, n)
+  path = str(tmp_path / 'model.bin')
+  tokenizer.save_binary(path)
+  loaded = make()
+  loaded.load_binary(path)
+  assert loaded._merges is None
+  ids = loaded.encode(text)
+  assert ids == tokenizer.encode(text)
+  assert loaded.merges == tokenizer.merges
+  assert loaded.decode(ids) == text
+
+def test_dna_decode_reads_the_vocab_table_once(tmp_path):
+  tokenizer = DNAtokenizer()
+  tokenizer.train("ACGTTGCAACGTTTGA\n" * 40, 20)
+  path = str(tmp_path / 'model.bin')
+  tokenizer.save_binary(path)
+  loaded = DNAtokenizer()
+  loaded.load_binary(path)
+  assert isinstance(loaded.vocab, BinaryVocab)
+  assert loaded.decode(tokenizer.encode("ACGTTGCA")) == "ACGTTGCA"
+  assert loaded.vocab == tokenizer.vocab and isinstance(loaded.vocab, dict)
@@ -0,0 +1,34 @@
+import random
+import pytest
+from subDNA import DNAtokenizer
+
+random.seed(5)
+TEXT = "\n".join(''.join(random.choice("AACGTT") for _ in range(random.randint(50, 300))) for _ in range(20))
+
+class _Interrupted(Exception):
+  pass
+
+class _StoppingTokenizer(DNAtokenizer):
+  """
+    dies right after its second checkpoint, like a killed training run
+  """
+  saves = 0
+
+  def _save_checkpoint(self, *args):
+    super()._save_checkpoint(*args)
+    self.saves += 1
+    if self.saves == 2:
+      raise _Interrupted
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_resumed_training_matches_an_uninterrupted_run(tmp_path, backend):
+  path = str(tmp_path / 'train.ckpt')
+  with pytest.raises(_Interrupted):
+    _StoppingTokenizer().train(TEXT, 50, backend=backend, checkpoint_path=path, checkpoint_every=7)
+  resumed = DNAtokenizer()
+  resumed.resume_train(path, checkpoint_every=7)
+  full = DNAtokenizer()
+  full.train(TEXT, 50, backend=backend)
+  assert list(resumed.merges.items()) == list(full.merges.items())
+  assert resumed.vocab == full.vocab
+  assert resumed.encode(TEXT) == full.encode(TEXT)
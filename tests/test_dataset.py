@@ -0,0 +1,50 @@
+import os
+import random
+from subDNA import DNAtokenizer, KMerTokenizer, FastxReader, build_dataset, TokenDataset
+
+ENCODE_ARGS = {'unknown': 'skip'}
+
+def _fasta(path, seed=0):
+  rng = random.Random(seed)
+  with open(path, 'w') as f:
+    for i in range(60):
+      f.write(f">r{i}\n" + "".join(rng.choice("ACGT") for _ in range(rng.randint(100, 2000))) + "\n")
+
+def _tokenizer(seed):
+  rng = random.Random(seed)
+  tokenizer = KMerTokenizer(4)
+  tokenizer.build_vocab(["".join(rng.choice("ACGT") for _ in range(5000))])
+  return tokenizer
+
+def test_retrained_model_rebuilds_shards(tmp_path):
+  path, out = str(tmp_path / 'seqs.fa'), str(tmp_path / 'ds')
+  _fasta(path)
+  first = build_dataset(_tokenizer(1), [path], out, num_workers=1, range_size=10000, encode_args=ENCODE_ARGS)
+  retrained = _tokenizer(2)
+  second = build_dataset(retrained, [path], out, num_workers=1, range_size=10000, encode_args=ENCODE_ARGS)
+  assert first['model'] != second['model']
+  for (name, ids), record in zip(TokenDataset(out), FastxReader(path)):
+    assert name == record.name
+    assert ids.tolist() == retrained.encode(record.sequence, out='list', **ENCODE_ARGS)
+
+def test_shards_of_an_older_plan_are_removed(tmp_path):
+  path, out = str(tmp_path / 'seqs.fa'), str(tmp_path / 'ds')
+  _fasta(path)
+  tokenizer = _tokenizer(1)
+  assert len(build_dataset(tokenizer, [path], out, num_workers=1, range_size=5000, encode_args=ENCODE_ARGS)['shards']) > 1
+  index = build_dataset(tokenizer, [path], out, num_workers=1, range_size=1 << 20, encode_args=ENCODE_ARGS)
+  assert sorted(name for name in os.listdir(out) if name.startswith('shard_')) == ['shard_00000.bin', 'shard_00000.json']
+  assert len(TokenDataset(out)) == index['n_tokens']
+
+def test_dna_shards_of_a_fasta_with_n_runs(tmp_path):
+  path, out = str(tmp_path / 'n.fa'), str(tmp_path / 'ds')
+  _fasta(path)
+  with open(path, 'a') as f:
+    f.write(">gaps\nACGTTG" + "N" * 500 + "CATTAG\nNNNNACGA\n")
+  tokenizer = DNAtokenizer()
+  tokenizer.train(FastxReader(path), 20)
+  build_dataset(tokenizer, [path], out, num_workers=1, range_size=10000)
+  for (name, ids), record in zip(TokenDataset(out), FastxReader(path)):
+    assert name == record.name
+    assert ids.tolist() == tokenizer.encode(record.sequence)
+  assert tokenizer.decode(ids.tolist()) == "ACGTTG\nCATTAG\nACGA"
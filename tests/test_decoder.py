@@ -0,0 +1,57 @@
+import pytest
+from miniBPE import BasicTokenizer, RegexTokenizer
+
+TEXT = "hello hello world, the world says hello " * 20
+
+@pytest.mark.parametrize("cls", [RegexTokenizer, BasicTokenizer])
+def test_byte_table_follows_in_place_vocab_edits(cls):
+  tokenizer = cls()
+  tokenizer.train(TEXT, 270)
+  ids = tokenizer.encode("hello")
+  assert tokenizer.decode(ids) == "hello"
+  # same ids, same length: only the generation tells the table is stale
+  tokenizer.vocab[ord("h")] = b"j"
+  assert tokenizer.decode(tokenizer.encode("h")) == "j"
+
+def test_byte_table_follows_in_place_special_token_edits():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 270)
+  tokenizer.register_special_token({"<|end|>": 1000})
+  assert tokenizer.decode([1000]) == "<|end|>"
+  tokenizer.special_tokens["<|end|>"] = 1001
+  assert tokenizer.decode([1001]) == "<|end|>"
+  with pytest.raises(ValueError, match="1000"):
+    tokenizer.decode([1000])
+
+def test_batch_and_buffer_decoding_match_decode():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 270)
+  texts = ["hello world", "", "wörld 🌍 says", TEXT]
+  batch = [tokenizer.encode(text) for text in texts]
+  assert tokenizer.decode_batch(batch) == texts
+  assert tokenizer.decode(tokenizer.encode(TEXT, out='numpy')) == TEXT
+  out = bytearray(8 + len(TEXT))
+  assert tokenizer.decode_into(batch[-1], out, offset=8) == len(TEXT)
+  assert out[8:] == TEXT.encode('utf-8')
+  with pytest.raises(ValueError, match="too small"):
+    tokenizer.decode_into(batch[-1], bytearray(4))
+  with pytest.raises(ValueError, match="invalid token id: 5000"):
+    tokenizer.decode_batch([[104], [5000]])
+
+def test_stream_decoder_holds_back_split_characters():
+  tokenizer = BasicTokenizer()
+  tokenizer.train("ab", 256)
+  text = "é🌍x"
+  stream = tokenizer.stream_decoder()
+  # no merges: one token per byte, é is 2 bytes and 🌍 4
+  pieces = [stream.step(idx) for idx in tokenizer.encode(text)]
+  assert pieces == ["", "é", "", "", "", "🌍", "x"]
+  assert stream.flush() == ""
+  assert stream.step(0xf0) == "" and stream.flush() == "�"
+
+def test_stream_decoder_follows_a_trained_model():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT + "wörld 🌍 " * 10, 300)
+  text = "hello wörld 🌍 🌍, says the world"
+  stream = tokenizer.stream_decoder()
+  assert "".join(stream.step(idx) for idx in tokenizer.encode(text)) + stream.flush() == text
@@ -0,0 +1,52 @@
+import random
+import numpy as np
+import pytest
+from subDNA import DNAtokenizer, FastxReader, PackedSequence
+from subDNA.main import _merge_array
+
+FASTA = ">a\nACGTACGTNNNNNNNNTTGACCA\nNNNNACGTAC\n>b\nACGGGTACGTRNNACGT\n"
+
+def test_ambiguity_runs_are_read_as_one_boundary(tmp_path):
+  path = tmp_path / 'n.fa'
+  path.write_text(FASTA)
+  tokenizer = DNAtokenizer()
+  tokenizer.train(FastxReader(str(path)), 14)
+  reference = DNAtokenizer()
+  reference.train("ACGTACGT\nTTGACCA\nACGTAC\nACGGGTACGT\nACGT", 14)
+  assert tokenizer.merges == reference.merges
+  assert all("N" not in token for token in tokenizer.vocab.values())
+
+  ids = tokenizer.encode("ACGTNNNNNNTTGA")
+  assert ids == tokenizer.encode("ACGT\nTTGA")
+  assert tokenizer.decode(ids) == "ACGT\nTTGA"
+  packed = PackedSequence.from_string("ACGTNNN-NNTTGANACGT")
+  assert tokenizer.encode(packed) == tokenizer.encode("ACGT\nTTGA\nACGT")
+  assert tokenizer.encode(FastxReader(str(path))) == reference.encode("ACGTACGT\nTTGACCA\nACGTAC\nACGGGTACGT\nACGT")
+
+def test_unknown_characters_raise_a_clear_error():
+  with pytest.raises(ValueError, match="'x'"):
+    DNAtokenizer().encode("ACGxT")
+
+def test_short_and_long_inputs_merge_alike():
+  random.seed(0)
+  text = ''.join(random.choice("ACGT") for _ in range(6000))
+  tokenizer = DNAtokenizer()
+  tokenizer.train(text, 40, backend='numpy')
+  # 64 bases go through the heap encoder, the whole text through one numpy pass per merge
+  for piece in (text[:64], text[:1000] + "\n" + text[1000:1100], text):
+    ids = np.asarray(tokenizer._encode(piece), dtype=np.int32)
+    for pair, idx in tokenizer.merges.items():
+      ids = _merge_array(ids, pair, idx)
+    assert tokenizer.encode(piece) == ids.tolist()
+    assert tokenizer.encode(piece, out='numpy').tolist() == ids.tolist()
+    assert tokenizer.decode(tokenizer.encode(piece)) == piece
+
+@pytest.mark.parametrize("target_vocab", [30, 200])
+def test_numpy_backend_learns_the_python_merges(target_vocab):
+  # 30 ids count pairs with bincount, 200 ids (40000 keys) with np.unique
+  random.seed(1)
+  text = "\n".join(''.join(random.choice("AACGTT") for _ in range(random.randint(50, 300))) for _ in range(20))
+  python, vectorized = DNAtokenizer(), DNAtokenizer()
+  python.train(text, target_vocab)
+  vectorized.train(text, target_vocab, backend='numpy')
+  assert list(vectorized.merges.items()) == list(python.merges.items())
@@ -0,0 +1,36 @@
+import random
+from miniBPE import RegexTokenizer
+from miniBPE.base import get_stats, merge
+from miniBPE.encoder import merge_ids
+
+TEXT = ("the quick brown fox jumps over the lazy dog, the dog naps. "
+        "ünïcödé wörds, 1234 numbers 5678 and aaaa runs of aaaaa letters\n") * 5
+
+def _reference_encode(ids, merges):
+  """
+    the minbpe loop: merge the lowest ranked pair present until none is left
+  """
+  ids = list(ids)
+  while len(ids) >= 2:
+    stats = get_stats(ids)
+    pair = min(stats, key=lambda p: merges.get(p, float('inf')))
+    if pair not in merges:
+      break
+    ids = merge(ids, pair, merges[pair])
+  return ids
+
+def test_heap_encoder_matches_the_reference_loop():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 256 + 80)
+  random.seed(7)
+  for _ in range(50):
+    start = random.randrange(len(TEXT))
+    chunk = TEXT[start:start + random.randint(0, 40)].encode('utf-8')
+    assert merge_ids(chunk, tokenizer.merges) == _reference_encode(chunk, tokenizer.merges)
+    assert tokenizer._encode_chunk(chunk) == _reference_encode(chunk, tokenizer.merges)
+
+def test_heap_encoder_on_runs():
+  # (1, 1) pairs up a run left to right, (300, 1) only sees what is left after that
+  merges = {(1, 1): 300, (300, 1): 301, (300, 300): 302}
+  for n in range(1, 10):
+    assert merge_ids([1] * n, merges) == _reference_encode([1] * n, merges)
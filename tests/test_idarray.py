@@ -0,0 +1,33 @@
+from array import array
+import numpy as np
+import pytest
+from miniBPE import BasicTokenizer, RegexTokenizer
+from miniBPE.idarray import id_dtype
+from subDNA import DNAtokenizer, KMerTokenizer, PerCharTokenizer
+
+TEXT = "hello hello world, the world says hello " * 20
+DNA = "ACGTTGCAACGTAGGCTTACGATCGATCGGATCCA" * 20
+
+def _tokenizers():
+  regex, basic, dna, kmer = RegexTokenizer(), BasicTokenizer(), DNAtokenizer(), KMerTokenizer(k_mers=3)
+  regex.train(TEXT, 270)
+  basic.train(TEXT, 270)
+  dna.train(DNA, 30)
+  kmer.build_vocab([DNA])
+  return [(regex, TEXT), (basic, TEXT), (dna, DNA), (kmer, DNA[:-2]), (PerCharTokenizer(), DNA)]
+
+@pytest.mark.parametrize("tokenizer, text", _tokenizers())
+def test_compact_outputs_hold_the_list_ids(tokenizer, text):
+  ids = tokenizer.encode(text)
+  packed = tokenizer.encode(text, out='array')
+  numpy = tokenizer.encode(text, out='numpy')
+  assert isinstance(packed, array) and packed.typecode == 'H' and packed.tolist() == ids
+  assert numpy.dtype == np.uint16 and numpy.tolist() == ids
+  assert tokenizer.encode(text, out='numpy', dtype=np.int64).dtype == np.int64
+  assert tokenizer.decode(packed) == tokenizer.decode(numpy) == tokenizer.decode(ids)
+
+def test_id_dtype_grows_with_the_vocab():
+  assert id_dtype(1 << 16) == np.uint16
+  assert id_dtype((1 << 16) + 1) == np.uint32
+  with pytest.raises(AssertionError):
+    id_dtype(10, np.float32)
@@ -0,0 +1,50 @@
+import logging
+import pickle
+from miniBPE import RegexTokenizer
+from miniBPE.instrument import Metrics, Sink, LoggingSink, PrometheusSink, NULL
+
+TEXT = "hello hello world, the world says hello " * 20
+
+class _Recorder(Sink):
+  def __init__(self):
+    self.timings, self.counts, self.flushed = [], {}, []
+
+  def on_timing(self, phase, seconds):
+    self.timings.append(phase)
+
+  def on_count(self, name, n):
+    self.counts[name] = self.counts.get(name, 0) + n
+
+  def flush(self, snapshot):
+    self.flushed.append(snapshot)
+
+def test_phases_and_counters_of_an_encode():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 270)
+  plain = tokenizer.encode(TEXT)
+  sink = _Recorder()
+  tokenizer.instrument = Metrics(sink)
+  assert tokenizer.encode(TEXT) == plain
+  counters = tokenizer.instrument.snapshot()['counters']
+  assert counters == sink.counts
+  assert counters['bytes_in'] == len(TEXT.encode('utf-8'))
+  assert counters['tokens_out'] == len(plain)
+  assert counters['merges_applied'] == counters['bytes_in'] - counters['tokens_out']
+  assert counters['cache_hits'] + counters['cache_misses'] == counters['chunks']
+  assert {'pretokenize', 'merge'} <= set(sink.timings)
+  tokenizer.instrument.flush()
+  assert sink.flushed[-1]['timings']['merge']['calls'] == 1
+  # the metrics stay with the tokenizer that collects them
+  assert pickle.loads(pickle.dumps(tokenizer)).instrument is NULL
+
+def test_logging_and_prometheus_sinks(tmp_path, caplog):
+  path = tmp_path / 'tok.prom'
+  metrics = Metrics(LoggingSink(), PrometheusSink(str(path), labels={'model': 'test'}))
+  with metrics.timer('decode'):
+    metrics.count('tokens_in', 3)
+  with caplog.at_level(logging.INFO, logger='tokenizers'):
+    metrics.flush()
+  assert "counter tokens_in: 3" in caplog.text
+  lines = path.read_text().splitlines()
+  assert 'tokenizer_tokens_in_total{model="test"} 3' in lines
+  assert 'tokenizer_phase_calls_total{model="test",phase="decode"} 1' in lines
@@ -0,0 +1,105 @@
+import os
+import random
+from collections import Counter
+import numpy as np
+import pytest
+from subDNA import KMerTokenizer, KmerPairTokenizer, PackedSequence
+from subDNA import kmer
+from miniBPE.encoder import merge_ids
+
+MODELS = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'subDNA', 'trained models')
+
+def test_trailing_partial_kmer_does_not_raise():
+  tokenizer = KMerTokenizer(k_mers=5)
+  tokenizer.load_model(os.path.join(MODELS, 'base_5k.json'))
+  sequence = "ACGTAACGTTG"
+  ids = tokenizer.encode(sequence)
+  assert len(ids) == 2
+  assert tokenizer.decode(ids) == sequence[:10]
+  assert tokenizer.encode(sequence * 1000) == tokenizer.encode(sequence * 1000, unknown='stop')
+  assert tokenizer.encode(sequence, unknown='skip') == ids
+  with pytest.raises(KeyError, match="'G'"):
+    tokenizer.encode(sequence, unknown='raise')
+
+def test_encode_stops_at_the_first_unknown_kmer():
+  tokenizer = KMerTokenizer(k_mers=3)
+  tokenizer.build_vocab(["ACGTTTACG"])
+  assert tokenizer.encode("ACGNNNTTT") == tokenizer.encode("ACG")
+  assert tokenizer.encode("ACGNNNTTT", unknown='skip') == tokenizer.encode("ACGTTT")
+  assert tokenizer.encode("ACGNNNTTT", out='numpy').tolist() == tokenizer.encode("ACG")
+
+def test_kmer_pair_trailing_partial_kmer_does_not_raise():
+  tokenizer = KmerPairTokenizer()
+  text = "ACGTACGTTTGAACGTACGTTTGA" * 4
+  tokenizer.train_tokenizer(text, 3)
+  assert tokenizer.decode(tokenizer.encode(text + "AC")) == text
+  with pytest.raises(KeyError, match="'AC'"):
+    tokenizer.encode(text + "AC", unknown='raise')
+
+@pytest.mark.parametrize("stride", [1, 2, 4])
+def test_sliding_window_kmers_across_blocks(monkeypatch, stride):
+  monkeypatch.setattr(kmer, '_BLOCK_SIZE', 7)
+  random.seed(stride)
+  sequence = ''.join(random.choice("ACGT") for _ in range(200)) + "NACGT" + ''.join(random.choice("ACGT") for _ in range(53))
+  tokenizer = KMerTokenizer(k_mers=4, stride=stride)
+  tokenizer.build_vocab([sequence])
+  kmers = tokenizer.tokenize_sequence(sequence)
+  counts = Counter(kmers)
+  # ids by count, ties by first appearance
+  assert tokenizer.id_to_token == sorted(counts, key=lambda kmer: (-counts[kmer], kmers.index(kmer)))
+  ids = tokenizer.encode(sequence)
+  assert ids == [tokenizer.token_to_id[kmer] for kmer in kmers]
+  assert tokenizer.decode(ids) == sequence
+
+def _revcomp(sequence):
+  return sequence[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+def test_canonical_kmers_share_an_id_and_round_trip():
+  random.seed(22)
+  sequence = ''.join(random.choice("ACGT") for _ in range(3000))
+  tokenizer = KMerTokenizer(k_mers=5, canonical=True)
+  tokenizer.build_vocab([sequence])
+  kmers = tokenizer.tokenize_sequence(sequence)
+  counts = Counter(min(word, _revcomp(word)) for word in kmers)
+  assert all(token <= _revcomp(token) for token in tokenizer.id_to_token)
+  assert sorted(tokenizer.id_to_token) == sorted(counts)
+  assert [counts[token] for token in tokenizer.id_to_token] == sorted(counts.values(), reverse=True)
+
+  ids, strands = tokenizer.encode(sequence, strands=True)
+  assert ids == tokenizer.encode(_revcomp(sequence))[::-1]
+  assert tokenizer.decode(ids, strands=strands) == sequence
+  assert tokenizer.decode(ids) == ''.join(min(word, _revcomp(word)) for word in kmers)
+  codes = np.array([tokenizer._kmer_code(word) for word in kmers])
+  assert [tokenizer._code_kmer(code) for code in kmer._revcomp_codes(codes, 5).tolist()] == [_revcomp(word) for word in kmers]
+
+def test_kmer_pair_round_trip_through_both_model_formats(tmp_path):
+  random.seed(23)
+  text = ''.join(random.choice("AACGT") for _ in range(4000))
+  tokenizer = KmerPairTokenizer()
+  tokenizer.train_tokenizer(text, 20)
+  ids = tokenizer.encode(text)
+  base = [tokenizer.kmer_to_id[text[i:i+4]] for i in range(0, len(text), 4)]
+  assert ids == merge_ids(base, tokenizer.merges)
+  assert tokenizer.decode(ids) == text
+  # non-ascii text takes the per k-mer path
+  assert tokenizer.encode(text + "ÄÄÄÄ", unknown='skip') == ids
+
+  tokenizer.save_binary(str(tmp_path / 'pair.bin'))
+  tokenizer.save_model(str(tmp_path))
+  from_binary, from_text = KmerPairTokenizer(), KmerPairTokenizer()
+  from_binary.load_binary(str(tmp_path / 'pair.bin'))
+  from_text.load(str(tmp_path / 'base_mer.model'), str(tmp_path / 'base_kmer.json'))
+  for loaded in (from_binary, from_text):
+    assert loaded.kmer_to_id == tokenizer.kmer_to_id
+    assert loaded.encode(text) == ids
+    assert loaded.decode(ids) == text
+
+def test_vectorized_encode_matches_dict_lookups(monkeypatch):
+  monkeypatch.setattr(kmer, '_BLOCK_SIZE', 1000)
+  tokenizer = KMerTokenizer(k_mers=5)
+  tokenizer.load_model(os.path.join(MODELS, 'base_5k.json'))
+  random.seed(10)
+  sequence = ''.join(random.choice("ACGT") for _ in range(6000))
+  expected = [tokenizer.token_to_id[word] for word in tokenizer.tokenize_sequence(sequence)]
+  assert tokenizer.encode(sequence) == expected
+  assert tokenizer.encode(PackedSequence.from_string(sequence), out='numpy').tolist() == expected
@@ -0,0 +1,39 @@
+import random
+from subDNA import PackedSequence, DNAtokenizer
+
+def _text(rng, n):
+  parts = []
+  while sum(map(len, parts)) < n:
+    r = rng.random()
+    parts.append("N" * rng.randint(1, 50) if r < 0.05 else "\n" if r < 0.1 else "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 80))))
+  return "".join(parts)[:n]
+
+def test_round_trip_and_slices(tmp_path):
+  rng = random.Random(0)
+  for _ in range(10):
+    text = _text(rng, rng.randint(0, 2000))
+    packed = PackedSequence.from_string(text, block_size=rng.randint(1, 300))
+    assert str(packed) == text
+    for _ in range(10):
+      a = rng.randint(0, len(text))
+      b = rng.randint(a, len(text))
+      view = packed[a:b]
+      assert str(view) == text[a:b]
+      positions, chars = view.exceptions()
+      assert [(int(p), chr(c)) for p, c in zip(positions, chars)] == [(i, c) for i, c in enumerate(text[a:b]) if c not in "ACGT"]
+      path = str(tmp_path / 'seq.pkd')
+      view.save(path)
+      assert str(PackedSequence.load(path)) == text[a:b]
+
+def test_long_n_run_is_one_exception():
+  text = "ACGT" * 10 + "N" * 1_000_000 + "ACGT" * 10
+  packed = PackedSequence.from_string(text, block_size=1 << 16)
+  starts, lengths, chars = packed.exception_runs()
+  assert starts.tolist() == [40] and lengths.tolist() == [1_000_000] and chars.tolist() == [ord("N")]
+  assert packed[40] == "N" and packed[1_000_040] == "A"
+
+def test_dna_encode_matches_string():
+  text = "ACGTACGGT\nACGTTT\n" * 50
+  tokenizer = DNAtokenizer()
+  tokenizer.train(text, 12)
+  assert tokenizer.encode(PackedSequence.from_string(text)) == tokenizer.encode(text)
@@ -0,0 +1,21 @@
+from subDNA import PerCharTokenizer
+
+TEXTS = ["ACGT", "ACNNT", "TTGC", "AXGT", "ACGT\nAC", "ZZA", "GGA", "ACQ"]
+
+def test_batches_read_the_input_a_window_at_a_time():
+  reference = PerCharTokenizer()
+  expected = [reference.encode(text) for text in TEXTS]
+  read = []
+  def texts():
+    for text in TEXTS:
+      read.append(text)
+      yield text
+  with PerCharTokenizer() as tokenizer:
+    results = tokenizer.encode_batch(texts(), num_workers=2, chunksize=1, stream=True)
+    first = next(results)
+    assert len(read) == 2 and first[0] in (0, 1)
+    assert sorted([first, *results]) == list(enumerate(expected))
+    assert tokenizer.string_to_index == reference.string_to_index
+    assert tokenizer.encode_batch(TEXTS, num_workers=2, chunksize=1) == expected
+    assert tokenizer._pool is not None
+  assert tokenizer._pool is None
@@ -0,0 +1,27 @@
+import io
+import regex as re
+import pytest
+from miniBPE import RegexTokenizer
+from miniBPE.pretokenize import iter_chunks, count_chunks
+from miniBPE.regex import regex_pattern
+
+TEXT = ("Hello world!  It's   2024, isn't it?\r\n\n\n   tabs\t\tand  spaces   \n"
+        "ünïcödé wörds 123456 and 🌍 emoji...   \n\n") * 4
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 5, 8, 13, 64, 1 << 20])
+def test_chunks_across_block_boundaries(block_size):
+  pattern = re.compile(regex_pattern)
+  # a string source is a path, an open file is read block_size characters at a time
+  assert list(iter_chunks(io.StringIO(TEXT), pattern, block_size)) == pattern.findall(TEXT)
+  counts = count_chunks(iter(TEXT[i:i+7] for i in range(0, len(TEXT), 7)), pattern, block_size)
+  assert counts == {chunk: pattern.findall(TEXT).count(chunk) for chunk in set(pattern.findall(TEXT))}
+
+def test_streamed_training_and_encoding_match_in_memory(tmp_path):
+  path = tmp_path / 'corpus.txt'
+  path.write_text(TEXT, encoding='utf-8', newline='')
+  tokenizer, streamed = RegexTokenizer(), RegexTokenizer()
+  tokenizer.train(TEXT, 300)
+  streamed.train_stream(str(path), 300, block_size=11)
+  assert list(streamed.merges.items()) == list(tokenizer.merges.items())
+  ids = [idx for block in streamed.iter_encode(str(path), block_size=11) for idx in block]
+  assert ids == tokenizer.encode_ordinary(TEXT)
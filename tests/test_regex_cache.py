@@ -0,0 +1,35 @@
+import pickle
+from miniBPE import RegexTokenizer
+
+TEXT = "hello hello world, the world says hello " * 20
+
+def _trained():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 270)
+  return tokenizer
+
+def test_in_place_merges_edit_drops_cached_ids():
+  tokenizer = _trained()
+  before = tokenizer.encode(TEXT)
+  pair = max(tokenizer.merges, key=tokenizer.merges.get)
+  idx = tokenizer.merges.pop(pair)
+  assert tokenizer.encode(TEXT) != before
+  tokenizer.merges[pair] = idx
+  assert tokenizer.encode(TEXT) == before
+
+def test_in_place_special_tokens_edit_is_seen():
+  tokenizer = _trained()
+  text = "hello<|end|>world"
+  plain = tokenizer.encode(text, allowed_special='all')
+  tokenizer.special_tokens['<|end|>'] = 1000
+  assert tokenizer.inverse_special_tokens[1000] == '<|end|>'
+  ids = tokenizer.encode(text, allowed_special='all')
+  assert 1000 in ids and ids != plain
+  del tokenizer.special_tokens['<|end|>']
+  assert tokenizer.encode(text, allowed_special='all') == plain
+
+def test_pickled_tokenizer_keeps_watching():
+  tokenizer = pickle.loads(pickle.dumps(_trained()))
+  before = tokenizer.encode(TEXT)
+  tokenizer.merges.clear()
+  assert tokenizer.encode(TEXT) == list(TEXT.encode('utf-8')) != before
@@ -0,0 +1,74 @@
+import json
+import asyncio
+from miniBPE import RegexTokenizer
+from miniBPE.server import TokenizerServer, Client, Overloaded
+
+def _tokenizer():
+  tokenizer = RegexTokenizer()
+  tokenizer.train("the quick brown fox jumps over the lazy dog " * 20, 280)
+  return tokenizer
+
+async def _raw(port, request):
+  """
+    (status, headers, json body) of one raw request
+  """
+  reader, writer = await asyncio.open_connection('127.0.0.1', port)
+  writer.write(request)
+  await writer.drain()
+  status = int((await reader.readline()).split(b" ", 2)[1])
+  headers = {}
+  while True:
+    line = await reader.readline()
+    if line in (b"\r\n", b""):
+      break
+    name, _, value = line.decode('latin-1').partition(':')
+    headers[name.strip().lower()] = value.strip()
+  body = json.loads(await reader.readexactly(int(headers['content-length'])))
+  writer.close()
+  return status, headers, body
+
+def test_concurrent_requests_share_a_batch():
+  tokenizer = _tokenizer()
+  texts = [f"the lazy dog {i}" for i in range(8)]
+  async def main():
+    async with TokenizerServer({'t': tokenizer}, num_workers=0, max_batch_size=8, max_wait_ms=200) as server:
+      results = await asyncio.gather(*(server.submit('encode', {'text': text}) for text in texts))
+      return results, server.stats()
+  results, stats = asyncio.run(main())
+  assert [result['ids'] for result in results] == [tokenizer.encode(text) for text in texts]
+  assert stats['counters']['batches'] == 1
+  assert stats['batch_size']['mean'] == 8
+
+def test_full_queue_answers_503():
+  async def main():
+    async with TokenizerServer({'t': _tokenizer()}, num_workers=0, max_queue=2, max_wait_ms=200) as server:
+      results = await asyncio.gather(*(server.submit('encode', {'text': 'fox'}) for _ in range(5)), return_exceptions=True)
+      pending = [asyncio.ensure_future(server.submit('encode', {'text': 'fox'})) for _ in range(2)]
+      await asyncio.sleep(0)
+      body = json.dumps({'text': 'fox'}).encode('utf-8')
+      response = await _raw(server.address[1], b"POST /encode HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+      await asyncio.gather(*pending)
+      return results, response
+  results, (status, headers, body) = asyncio.run(main())
+  assert sum(isinstance(result, Overloaded) for result in results) == 3
+  assert status == 503 and headers['retry-after'] == '1' and 'overloaded' in body['error']
+
+def test_malformed_requests_get_an_error_response():
+  async def main():
+    async with TokenizerServer({'t': _tokenizer()}, num_workers=0, max_body=1024) as server:
+      port = server.address[1]
+      responses = [await _raw(port, request) for request in (
+        b"POST /encode HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+        b"POST /encode HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+        b"POST /encode HTTP/1.1\r\nContent-Length: 4096\r\n\r\n",
+        b"garbage\r\n\r\n",
+        b"POST /encode HTTP/1.1\r\nContent-Length: 3\r\n\r\n{x}",
+        b"POST /encode HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}",
+      )]
+      async with Client(port=port) as client:
+        ok = await client.encode("the fox")
+      return responses, ok
+  responses, ok = asyncio.run(main())
+  assert [status for status, _, _ in responses] == [400, 400, 413, 400, 400, 400]
+  assert "'abc'" in responses[0][2]['error'] and "'-1'" in responses[1][2]['error']
+  assert ok == _tokenizer().encode("the fox")
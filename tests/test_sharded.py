@@ -0,0 +1,23 @@
+import random
+import pytest
+from subDNA import DNAtokenizer
+
+random.seed(3)
+TEXT = "\n".join(''.join(random.choice("AACGTT") for _ in range(random.randint(40, 400))) for _ in range(30))
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_sharded_training_learns_the_single_process_merges(num_workers):
+  single, sharded = DNAtokenizer(), DNAtokenizer()
+  single.train(TEXT, 60)
+  sharded.train(TEXT, 60, num_workers=num_workers)
+  assert list(sharded.merges.items()) == list(single.merges.items())
+  assert sharded.encode(TEXT) == single.encode(TEXT)
+
+class _CrashingTokenizer(DNAtokenizer):
+  def _merge(self, ids, pair, idx):
+    raise RuntimeError("worker crashed")
+
+def test_a_dead_worker_surfaces_its_error():
+  # the workers die on the first merge, the coordinator sees their pipes close
+  with pytest.raises(EOFError):
+    _CrashingTokenizer().train(TEXT, 20, num_workers=2)
@@ -0,0 +1,30 @@
+import random
+import regex as re
+from miniBPE.regex import regex_pattern
+from miniBPE.sketch import train_approx_merges, merge_divergence
+from miniBPE.trainer import train_merges
+
+_rng = random.Random(0)
+_WORDS = ["".join(_rng.choice("etaoinshrdlcu") for _ in range(_rng.randint(2, 7))) for _ in range(300)]
+TEXT = " ".join(_rng.choices(_WORDS, [1 / (rank + 1) for rank in range(300)], k=800))
+CHUNKS = [list(chunk.encode('utf-8')) for chunk in re.findall(regex_pattern, TEXT)]
+
+def _counted(chunks):
+  passes = []
+  def corpus():
+    passes.append(1)
+    return chunks
+  return corpus, passes
+
+def test_small_vocab_matches_exact_training():
+  assert train_approx_merges(lambda: CHUNKS, 40, width=1 << 14) == train_merges(CHUNKS, 40)
+
+def test_several_merges_per_pass():
+  corpus, passes = _counted(CHUNKS)
+  strict = train_approx_merges(corpus, 120, width=1 << 14, merges_per_pass=16, tolerance=1.0)
+  assert strict == train_merges(CHUNKS, 120)
+  assert len(passes) < 120
+  corpus, passes = _counted(CHUNKS)
+  default = train_approx_merges(corpus, 200, width=1 << 14)
+  assert len(default) == 200 and len(passes) < 200
+  assert merge_divergence(default, train_merges(CHUNKS, 200))['overlap'] > 0.8
@@ -0,0 +1,43 @@
+import regex as re
+import pytest
+from miniBPE import RegexTokenizer
+
+TEXT = "hello hello world, the world says hello " * 20
+SPECIALS = {"<|end|>": 1000, "<|endoftext|>": 1001, "<|fim|>": 1002}
+
+def _tokenizer():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 270)
+  tokenizer.register_special_token(dict(SPECIALS))
+  return tokenizer
+
+def _reference_encode(tokenizer, text, allowed):
+  """
+    minbpe's re.split over the allowed special tokens, longest first
+  """
+  special = sorted(allowed, key=len, reverse=True)
+  ids = []
+  for part in re.split("(" + "|".join(re.escape(k) for k in special) + ")", text):
+    ids.extend([SPECIALS[part]] if part in allowed else tokenizer.encode_ordinary(part))
+  return ids
+
+def test_special_tokens_split_in_one_pass():
+  tokenizer = _tokenizer()
+  text = "<|endoftext|>hello<|end|> world<|fim|><|end|><|endoftext|>says"
+  assert tokenizer.encode(text, allowed_special='all') == _reference_encode(tokenizer, text, SPECIALS)
+  assert tokenizer.encode(text, allowed_special={"<|end|>"}) == _reference_encode(tokenizer, text, {"<|end|>"})
+  assert tokenizer.encode(text, allowed_special='none') == tokenizer.encode_ordinary(text)
+  with pytest.raises(AssertionError, match=re.escape("<|endoftext|>")):
+    tokenizer.encode(text)
+  assert tokenizer.decode(tokenizer.encode(text, allowed_special='all')) == text
+
+def test_special_matcher_is_cached_until_the_tokens_change():
+  tokenizer = _tokenizer()
+  matcher = tokenizer._special_matcher('all')
+  tokenizer.encode("hello<|end|>", allowed_special='all')
+  assert tokenizer._special_matcher('all') is matcher
+  tokenizer.special_tokens["<|pad|>"] = 1003
+  assert tokenizer._special_matcher('all') is not matcher
+  assert tokenizer.encode("<|pad|>", allowed_special='all') == [1003]
+  with pytest.raises(ValueError):
+    tokenizer.encode("hello", allowed_special=["<|end|>"])
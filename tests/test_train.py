@@ -0,0 +1,36 @@
+import regex as re
+from miniBPE import BasicTokenizer, RegexTokenizer
+from miniBPE.base import get_stats, merge
+
+TEXT = ("the quick brown fox jumps over the lazy dog, the dog naps. "
+        "ünïcödé wörds, 1234 numbers 5678 and aaaa runs of aaaaa letters\n") * 5
+
+def _reference_merges(chunks, n_merges):
+  """
+    the get_stats()/merge() loop of base.py over every chunk, recounting after each merge
+  """
+  chunks = [list(chunk.encode('utf-8')) for chunk in chunks]
+  merges = {}
+  for i in range(n_merges):
+    stats = {}
+    for ids in chunks:
+      get_stats(ids, stats)
+    if not stats:
+      break
+    pair = max(stats, key=stats.get)
+    merges[pair] = 256 + i
+    chunks = [merge(ids, pair, 256 + i) for ids in chunks]
+  return merges
+
+def test_incremental_basic_training_matches_the_reference_loop():
+  tokenizer = BasicTokenizer()
+  tokenizer.train(TEXT, 256 + 60)
+  assert list(tokenizer.merges.items()) == list(_reference_merges([TEXT], 60).items())
+
+def test_deduplicated_regex_training_matches_the_reference_loop():
+  tokenizer = RegexTokenizer()
+  tokenizer.train(TEXT, 256 + 60)
+  chunks = re.findall(tokenizer.compiled_pattern, TEXT)
+  assert len(set(chunks)) < len(chunks)
+  assert list(tokenizer.merges.items()) == list(_reference_merges(chunks, 60).items())
+  assert tokenizer.decode(tokenizer.encode(TEXT)) == TEXT